@@ -0,0 +1,178 @@
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import select, func, literal, null, type_coerce, exists, String, union_all
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+import models, listing
+
+# Hot/cold tiering for the clinical tables. `manage.py archive` moves rows
+# older than a horizon from each hot table into its `*_archive` twin in small
+# batches, one short transaction per batch, so the hot tables and their
+# indexes only hold recent data. Archived rows are read-only: reads by ID,
+# version history, doctor calendars and patient timelines fall back to the
+# archive, while updates and deletes only see hot rows.
+
+DEFAULT_HORIZON_DAYS = 730
+BATCH_SIZE = 500
+TIMELINE_MAX_LIMIT = 500
+
+def cutoff_for(days: int) -> datetime:
+    # Server-side timestamps are UTC, so compare against naive UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=days)
+
+Policy = namedtuple("Policy", ["model", "archive", "age", "eligible"])
+
+def _appointment_unreferenced():
+    # Prescriptions point at appointments, so keep any appointment a hot
+    # prescription still references; it moves once the prescription has.
+    return ~exists().where(models.Prescription.appointment_id == models.Appointment.appointment_id)
+
+# Prescriptions go before appointments so their appointments become movable
+# in the same run.
+POLICIES = [
+    Policy(models.Prescription, models.PrescriptionArchive,
+           lambda: func.coalesce(models.Prescription.updated_on, models.Prescription.prescribed_on), lambda: []),
+    Policy(models.Appointment, models.AppointmentArchive,
+           lambda: models.Appointment.appointment_date, lambda: [_appointment_unreferenced()]),
+    Policy(models.LabTest, models.LabTestArchive,
+           lambda: models.LabTest.date_requested, lambda: [models.LabTest.status == models.LabTestStatusEnum.Completed]),
+    Policy(models.EMR, models.EMRArchive,
+           lambda: func.coalesce(models.EMR.updated_on, models.EMR.created_on), lambda: []),
+    Policy(models.Payment, models.PaymentArchive,
+           lambda: models.Payment.transaction_date, lambda: [models.Payment.status != models.PaymentStatusEnum.Pending]),
+]
+
+ARCHIVES = {policy.model: policy.archive for policy in POLICIES}
+
+def _primary_key(model):
+    return model.__table__.primary_key.columns.values()[0]
+
+# ------------------ MOVING ROWS ------------------
+def _candidates(policy: Policy, cutoff: datetime):
+    # The hot tables use AUTOINCREMENT, so moving any row, the newest
+    # included, never frees its ID for reuse
+    pk = _primary_key(policy.model)
+    return select(pk).where(policy.age() < cutoff, *policy.eligible())
+
+def pending_counts(engine: Engine, cutoff: datetime) -> dict:
+    with engine.connect() as conn:
+        return {
+            policy.model.__tablename__: conn.execute(
+                select(func.count()).select_from(_candidates(policy, cutoff).subquery())
+            ).scalar()
+            for policy in POLICIES
+        }
+
+def move_batch(engine: Engine, policy: Policy, cutoff: datetime, batch_size: int = BATCH_SIZE) -> int:
+    hot, cold = policy.model.__table__, policy.archive.__table__
+    pk = _primary_key(policy.model)
+    with engine.begin() as conn:
+        ids = conn.execute(_candidates(policy, cutoff).order_by(pk).limit(batch_size)).scalars().all()
+        if not ids:
+            return 0
+        columns = [column.name for column in hot.columns]
+        conn.execute(cold.insert().from_select(columns, select(*hot.columns).where(pk.in_(ids))))
+        conn.execute(hot.delete().where(pk.in_(ids)))
+    return len(ids)
+
+def archive_older_than(engine: Engine, cutoff: datetime, batch_size: int = BATCH_SIZE, pause: float = 0.0, log=print) -> dict:
+    moved = {}
+    for policy in POLICIES:
+        name = policy.model.__tablename__
+        moved[name] = 0
+        started = time.perf_counter()
+        while True:
+            count = move_batch(engine, policy, cutoff, batch_size)
+            if not count:
+                break
+            moved[name] += count
+            if pause:
+                # Let live writers take the SQLite write lock between batches
+                time.sleep(pause)
+        elapsed = time.perf_counter() - started
+        log(f"  {name:<14} {moved[name]:>8} rows archived in {elapsed:.2f}s")
+    return moved
+
+def table_sizes(engine: Engine) -> dict:
+    with engine.connect() as conn:
+        return {
+            policy.model.__tablename__: (
+                listing.count_rows(conn, policy.model),
+                listing.count_rows(conn, policy.archive),
+            )
+            for policy in POLICIES
+        }
+
+# ------------------ READ FALLBACK ------------------
+def select_row(db: Session, model, schema, record_id: int, fields=None) -> Optional[dict]:
+    row = listing.select_row(db, model, schema, _primary_key(model) == record_id, fields=fields)
+    if row is None and model in ARCHIVES:
+        cold = ARCHIVES[model]
+        row = listing.select_row(db, cold, schema, _primary_key(cold) == record_id, fields=fields)
+    return row
+
+def get_record(db: Session, model, record_id: int):
+    # ORM lookup for read-only callers; archived rows come back as the
+    # matching *Archive instance, which has the same attributes.
+    record = db.get(model, record_id)
+    if record is None and model in ARCHIVES:
+        record = db.get(ARCHIVES[model], record_id)
+    return record
+
+def select_rows(db: Session, model, schema, criteria) -> list[dict]:
+    # `criteria(source)` builds the WHERE clause against either tier
+    rows = []
+    for source in (model, ARCHIVES[model]):
+        rows.extend(listing.select_rows(db, source, schema, *criteria(source)))
+    return rows
+
+def references_user(db: Session, user_id: int) -> bool:
+    checks = (
+        models.AppointmentArchive.patient_id == user_id, models.AppointmentArchive.doctor_id == user_id,
+        models.PrescriptionArchive.patient_id == user_id, models.PrescriptionArchive.doctor_id == user_id,
+        models.PaymentArchive.user_id == user_id,
+        models.LabTestArchive.patient_id == user_id,
+        models.EMRArchive.patient_id == user_id, models.EMRArchive.doctor_id == user_id,
+    )
+    return any(db.execute(select(literal(1)).where(check).limit(1)).first() for check in checks)
+
+# ------------------ PATIENT TIMELINE ------------------
+def _timeline_select(model, kind: str, archived: bool, owner, at, status=None, doctor_id=None, detail=None):
+    return select(
+        literal(kind).label("kind"),
+        _primary_key(model).label("record_id"),
+        at.label("at"),
+        literal(archived).label("archived"),
+        (type_coerce(status, String) if status is not None else null()).label("status"),
+        (doctor_id if doctor_id is not None else null()).label("doctor_id"),
+        (detail if detail is not None else null()).label("detail"),
+    ).where(owner)
+
+def _timeline_parts(patient_id: int):
+    for archived in (False, True):
+        appt, pres, test, emr, pay = (ARCHIVES[m] if archived else m for m in
+                                      (models.Appointment, models.Prescription, models.LabTest, models.EMR, models.Payment))
+        yield _timeline_select(appt, "appointment", archived, appt.patient_id == patient_id,
+                               appt.appointment_date, appt.status, appt.doctor_id)
+        yield _timeline_select(pres, "prescription", archived, pres.patient_id == patient_id,
+                               pres.prescribed_on, doctor_id=pres.doctor_id, detail=func.substr(pres.notes, 1, 120))
+        yield _timeline_select(test, "lab_test", archived, test.patient_id == patient_id,
+                               test.date_requested, test.status, detail=test.test_type)
+        yield _timeline_select(emr, "emr", archived, emr.patient_id == patient_id,
+                               emr.created_on, doctor_id=emr.doctor_id, detail=func.substr(emr.summary, 1, 120))
+        yield _timeline_select(pay, "payment", archived, pay.user_id == patient_id,
+                               pay.transaction_date, pay.status, detail=type_coerce(pay.payment_method, String))
+
+def patient_timeline(db: Session, patient_id: int, before: datetime = None, limit: int = 100) -> list[dict]:
+    timeline = union_all(*_timeline_parts(patient_id)).subquery()
+    stmt = select(timeline)
+    if before is not None:
+        stmt = stmt.where(timeline.c.at < before)
+    stmt = stmt.order_by(timeline.c.at.desc(), timeline.c.kind, timeline.c.record_id.desc()).limit(limit)
+    result = db.execute(stmt)
+    keys = tuple(result.keys())
+    return [dict(zip(keys, row)) for row in result]
+
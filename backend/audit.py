@@ -0,0 +1,193 @@
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import Request, HTTPException
+from fastapi.exceptions import RequestValidationError
+from jose import jwt, JWTError
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import insert
+import models
+from auth import SECRET_KEY, ALGORITHM
+from database import current_tenant, shards
+
+# Access audit for clinical records. Handlers declare what they touch with
+# the `audited()` dependency; the entry is finished after the handler returns
+# or raises and is handed to a bounded queue. A single writer thread drains
+# the queue and inserts whole batches in one transaction, so a request never
+# waits on the audit insert. When the queue is full, submitters block for up
+# to SUBMIT_TIMEOUT before the entry is counted as dropped.
+
+QUEUE_SIZE = 10_000
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 0.5
+SUBMIT_TIMEOUT = 0.25
+FALLBACK_PATH = "audit-fallback.jsonl"
+
+logger = logging.getLogger("audit")
+
+audit_queue_depth = Gauge("audit_queue_depth", "Audit entries waiting to be written")
+audit_entries = Counter("audit_entries_total", "Audit entries by outcome", ["outcome"])
+audit_submit_blocked = Counter("audit_submit_blocked_total", "Submits that had to wait for queue space")
+audit_flush_seconds = Histogram("audit_flush_seconds", "Time spent writing one audit batch")
+
+COLUMNS = ("at", "actor", "actor_role", "action", "resource_type", "resource_id", "outcome", "client")
+
+class AuditEntry:
+    __slots__ = COLUMNS + ("tenant",)
+
+    def __init__(self, actor, actor_role, action, resource_type, resource_id=None, client=None):
+        self.tenant = current_tenant.get()
+        self.at = datetime.now(timezone.utc)
+        self.actor = actor
+        self.actor_role = actor_role
+        self.action = action
+        self.resource_type = resource_type
+        self.resource_id = resource_id
+        self.outcome = 200
+        self.client = client
+
+    def as_row(self) -> dict:
+        return {name: getattr(self, name) for name in COLUMNS}
+
+# ------------------ WRITER ------------------
+class AuditWriter:
+    def __init__(self, engine_for, queue_size: int = QUEUE_SIZE, batch_size: int = BATCH_SIZE):
+        # Entries are written to the database of the clinic they were made in
+        self.engine_for = engine_for
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        audit_queue_depth.set_function(self.queue.qsize)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, entry: AuditEntry):
+        self.start()
+        try:
+            self.queue.put_nowait(entry)
+            return
+        except queue.Full:
+            audit_submit_blocked.inc()
+        try:
+            self.queue.put(entry, timeout=SUBMIT_TIMEOUT)
+        except queue.Full:
+            audit_entries.labels(outcome="dropped").inc()
+            logger.error("Audit queue full, dropped %s %s %s", entry.action, entry.resource_type, entry.resource_id)
+
+    def _next_batch(self) -> list:
+        try:
+            batch = [self.queue.get(timeout=FLUSH_INTERVAL)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: list):
+        by_tenant = {}
+        for entry in batch:
+            by_tenant.setdefault(entry.tenant, []).append(entry.as_row())
+        for tenant, rows in by_tenant.items():
+            self._write_rows(tenant, rows)
+
+    def _write_rows(self, tenant: str, rows: list):
+        started = time.perf_counter()
+        try:
+            with self.engine_for(tenant).begin() as conn:
+                conn.execute(insert(models.AuditLog), rows)
+            audit_entries.labels(outcome="written").inc(len(rows))
+        except Exception:
+            # Never lose entries to a locked or broken database
+            logger.exception("Audit batch insert failed, appending %d entries to %s", len(rows), FALLBACK_PATH)
+            with open(FALLBACK_PATH, "a", encoding="utf-8") as fallback:
+                for row in rows:
+                    fallback.write(json.dumps({"tenant": tenant, **row}, default=str) + "\n")
+            audit_entries.labels(outcome="fallback").inc(len(rows))
+        finally:
+            audit_flush_seconds.observe(time.perf_counter() - started)
+
+    def _run(self):
+        while not (self._stopping.is_set() and self.queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+                for _ in batch:
+                    self.queue.task_done()
+
+    def flush(self, timeout: float = 10.0):
+        # Wait until everything submitted so far has been written
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def stop(self, timeout: float = 10.0):
+        self._stopping.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        # Anything left (writer never started or timed out) is written inline
+        leftover = []
+        while True:
+            try:
+                leftover.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if leftover:
+            self._write(leftover)
+            for _ in leftover:
+                self.queue.task_done()
+
+writer = AuditWriter(shards.get)
+atexit.register(writer.stop)
+
+# ------------------ DEPENDENCY ------------------
+def _actor(request: Request):
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None, None
+    try:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None, None
+    return claims.get("sub"), claims.get("role")
+
+def audited(resource_type: str, action: str, id_param: Optional[str] = None):
+    # Yields the entry so create handlers can fill in the new record's ID
+    def dependency(request: Request):
+        actor, role = _actor(request)
+        resource_id = request.path_params.get(id_param, "") if id_param else ""
+        entry = AuditEntry(actor, role, action, resource_type,
+                           int(resource_id) if resource_id.isdigit() else None,
+                           request.client.host if request.client else None)
+        # On success the outcome is the route's declared status (201 for creates)
+        entry.outcome = getattr(request.scope.get("route"), "status_code", None) or entry.outcome
+        try:
+            yield entry
+        except HTTPException as exc:
+            entry.outcome = exc.status_code
+            raise
+        except RequestValidationError:
+            entry.outcome = 422
+            raise
+        except Exception:
+            entry.outcome = 500
+            raise
+        finally:
+            writer.submit(entry)
+    return dependency
@@ -6,7 +6,7 @@ from jose import jwt, JWTError
 from crud import hash_password, get_user_by_email  # ensure these are imported 
 
 import models, schemas, crud
-from database import get_db
+from database import get_db, current_tenant, DEFAULT_TENANT, SessionLocal, shards
 
 SECRET_KEY = "your-secret-key"
 ALGORITHM = "HS256"
@@ -23,11 +23,23 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    return user_from_token(db, token)
+
+def get_stream_user(token: str = Depends(oauth2_scheme)):
+    # For long-lived responses: get_db's session would stay open, holding a
+    # pooled connection, until the response ends. This one closes before the
+    # handler runs and returns the user detached, with its columns loaded.
+    with SessionLocal(bind=shards.get(current_tenant.get())) as db:
+        return user_from_token(db, token)
+
+def user_from_token(db: Session, token: str):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email = payload.get("sub")
         if email is None:
             raise HTTPException(status_code=401, detail="Invalid token payload")
+        if payload.get("tenant", DEFAULT_TENANT) != current_tenant.get():
+            raise HTTPException(status_code=401, detail="Token was issued for a different clinic")
         user = db.query(models.User).filter(models.User.email == email).first()
         if user is None:
             raise HTTPException(status_code=401, detail="User not found")
@@ -55,7 +67,7 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
     token = create_access_token(
-        data={"sub": user.email, "role": user.role},
+        data={"sub": user.email, "role": user.role, "tenant": current_tenant.get()},
         expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     )
     return schemas.UserWithToken(
@@ -0,0 +1,194 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from prometheus_client.core import GaugeMetricFamily, REGISTRY
+import migrations
+from database import DEFAULT_TENANT, shards
+
+# Online backups through SQLite's backup API. Pages are copied in small
+# steps with a pause in between, so the source is only read-locked for one
+# step at a time and writers keep committing. A write from another
+# connection makes SQLite restart the copy; after MAX_RESTARTS the rest is
+# copied in a single step instead. Each backup gets a JSON manifest next to
+# it, and the /metrics collector below reads those manifests, so backups
+# taken by `manage.py backup` show up in the API's metrics too.
+
+BACKUP_DIR = "backups"
+RETENTION = 7
+PAGES_PER_STEP = 256
+STEP_SLEEP = 0.005
+MAX_RESTARTS = 5
+
+_running = set()
+_running_lock = threading.Lock()
+
+class BackupInProgress(RuntimeError):
+    pass
+
+class _TooManyRestarts(Exception):
+    pass
+
+def backup_dir(tenant: str) -> str:
+    return os.path.join(BACKUP_DIR, tenant)
+
+# ------------------ BACKUP ------------------
+def _copy(source_path: str, target_path: str, pages: int) -> int:
+    restarts, last_remaining = 0, None
+
+    def progress(status, remaining, total):
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > MAX_RESTARTS:
+                raise _TooManyRestarts()
+        last_remaining = remaining
+
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        try:
+            source.backup(target, pages=pages, progress=progress, sleep=STEP_SLEEP)
+        except _TooManyRestarts:
+            source.backup(target, pages=-1)
+        if target.execute("PRAGMA quick_check").fetchone()[0] != "ok":
+            raise RuntimeError(f"Backup of {source_path} failed its integrity check")
+    finally:
+        target.close()
+        source.close()
+    return restarts
+
+def create_backup(tenant: str = DEFAULT_TENANT, pages: int = PAGES_PER_STEP, keep: int = RETENTION,
+                  log=print) -> dict:
+    source_path = shards.path(tenant)
+    if not shards.exists(tenant) or not os.path.exists(source_path):
+        raise FileNotFoundError(f"No database for clinic {tenant!r}")
+    with _running_lock:
+        if tenant in _running:
+            raise BackupInProgress(f"A backup of clinic {tenant!r} is already running")
+        _running.add(tenant)
+    try:
+        os.makedirs(backup_dir(tenant), exist_ok=True)
+        created = datetime.now(timezone.utc)
+        name = f"{tenant}-{created:%Y%m%dT%H%M%S%fZ}.db"
+        path = os.path.join(backup_dir(tenant), name)
+        started = time.perf_counter()
+        restarts = _copy(source_path, f"{path}.partial", pages)
+        os.replace(f"{path}.partial", path)
+        manifest = {
+            "clinic_id": tenant,
+            "file": name,
+            "created_at": created.isoformat(),
+            "size_bytes": os.path.getsize(path),
+            "duration_seconds": round(time.perf_counter() - started, 3),
+            "restarts": restarts,
+        }
+        with open(f"{path}.json", "w", encoding="utf-8") as handle:
+            json.dump(manifest, handle, indent=2)
+        log(f"Backed up {source_path} to {path} ({manifest['size_bytes']} bytes in {manifest['duration_seconds']}s)")
+        if keep is not None:
+            rotate(tenant, keep=keep, log=log)
+        return manifest
+    finally:
+        with _running_lock:
+            _running.discard(tenant)
+
+def rotate(tenant: str, keep: int = RETENTION, log=print) -> list:
+    removed = []
+    for manifest in list_backups(tenant)[keep:]:
+        path = os.path.join(backup_dir(tenant), manifest["file"])
+        for stale in (path, f"{path}.json"):
+            if os.path.exists(stale):
+                os.remove(stale)
+        removed.append(manifest["file"])
+        log(f"Removed old backup {path}")
+    return removed
+
+def start_backup(tenant: str) -> threading.Thread:
+    # Used by the API so the request returns while pages are being copied
+    with _running_lock:
+        if tenant in _running:
+            raise BackupInProgress(f"A backup of clinic {tenant!r} is already running")
+    thread = threading.Thread(target=create_backup, args=(tenant,), kwargs={"log": lambda _: None},
+                              name=f"backup-{tenant}", daemon=True)
+    thread.start()
+    return thread
+
+def running() -> list:
+    with _running_lock:
+        return sorted(_running)
+
+# ------------------ LISTING ------------------
+def list_backups(tenant: str) -> list[dict]:
+    # Newest first; a backup counts once its manifest has been written
+    directory = backup_dir(tenant)
+    if not os.path.isdir(directory):
+        return []
+    manifests = []
+    for name in os.listdir(directory):
+        if name.endswith(".db.json"):
+            with open(os.path.join(directory, name), encoding="utf-8") as handle:
+                manifests.append(json.load(handle))
+    return sorted(manifests, key=lambda m: m["created_at"], reverse=True)
+
+def find_backup(path_or_name: str, tenant: str) -> str:
+    if os.path.exists(path_or_name):
+        return path_or_name
+    candidate = os.path.join(backup_dir(tenant), path_or_name)
+    if os.path.exists(candidate):
+        return candidate
+    raise FileNotFoundError(f"Backup {path_or_name!r} not found")
+
+# ------------------ RESTORE ------------------
+def restore(backup_path: str, tenant: str = DEFAULT_TENANT, log=print) -> dict:
+    # Copies the backup over the live database through the backup API, so
+    # open connections see the restored pages instead of a swapped file.
+    check = sqlite3.connect(backup_path)
+    try:
+        if check.execute("PRAGMA quick_check").fetchone()[0] != "ok":
+            raise ValueError(f"{backup_path} failed its integrity check")
+        version = check.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        check.close()
+    if version > migrations.LATEST_VERSION:
+        raise ValueError(f"{backup_path} is at schema version {version}, newer than this code ({migrations.LATEST_VERSION})")
+
+    log(f"Saving the current database of clinic {tenant!r} before restoring")
+    # Not rotated, which could otherwise remove the backup being restored
+    safety = create_backup(tenant, keep=None, log=log)
+    source = sqlite3.connect(backup_path)
+    target = sqlite3.connect(shards.path(tenant))
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+    log(f"Restored {backup_path} into {shards.path(tenant)} (schema version {version})")
+    if version < migrations.LATEST_VERSION:
+        log("Run `python manage.py migrate` to bring the restored schema up to date")
+    return {"restored": backup_path, "schema_version": version, "safety_backup": safety["file"]}
+
+# ------------------ METRICS ------------------
+class BackupCollector:
+    def collect(self):
+        last_success = GaugeMetricFamily("backup_last_success_timestamp_seconds",
+                                         "Unix time of the newest backup", labels=["clinic"])
+        last_duration = GaugeMetricFamily("backup_last_duration_seconds",
+                                          "Duration of the newest backup", labels=["clinic"])
+        last_size = GaugeMetricFamily("backup_last_size_bytes", "Size of the newest backup", labels=["clinic"])
+        retained = GaugeMetricFamily("backup_retained_bytes", "Total size of retained backups", labels=["clinic"])
+        for tenant in shards.tenants():
+            manifests = list_backups(tenant)
+            if not manifests:
+                continue
+            newest = manifests[0]
+            last_success.add_metric([tenant], datetime.fromisoformat(newest["created_at"]).timestamp())
+            last_duration.add_metric([tenant], newest["duration_seconds"])
+            last_size.add_metric([tenant], newest["size_bytes"])
+            retained.add_metric([tenant], sum(m["size_bytes"] for m in manifests))
+        yield from (last_success, last_duration, last_size, retained)
+
+REGISTRY.register(BackupCollector())
@@ -0,0 +1,78 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+import models, schemas, crud, migrations, group_commit
+
+# Concurrent POST /appointments/ work (crud.create_appointment from many
+# threads, one session each) with a commit per request versus the
+# group-commit writer, on a file-backed SQLite database.
+#
+#   python benchmarks/bench_group_commit.py --threads 32 --requests 2000
+
+def seed(engine):
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [
+            {"user_id": 1, "full_name": "Bench Patient", "email": "p@bench.test", "password_hash": "x", "role": "Patient"},
+            {"user_id": 2, "full_name": "Bench Doctor", "email": "d@bench.test", "password_hash": "x", "role": "Doctor"},
+        ])
+
+def run(Session, threads: int, requests: int) -> float:
+    start = datetime(2024, 1, 1, 8, 0)
+
+    def create(i: int):
+        db = Session()
+        try:
+            appt = schemas.AppointmentCreate(patient_id=1, doctor_id=2, appointment_date=start + timedelta(minutes=15 * i))
+            return crud.create_appointment(db, appt).appointment_id
+        finally:
+            db.close()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        ids = list(pool.map(create, range(requests)))
+    elapsed = time.perf_counter() - started
+    assert len(set(ids)) == requests
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark group commit on concurrent appointment creation")
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--window", type=float, default=group_commit.GROUP_COMMIT_WINDOW, help="seconds to collect a group")
+    args = parser.parse_args()
+
+    print(f"{'mode':<20}{'seconds':>10}{'creates/s':>12}")
+    results = {}
+    for mode in ("commit per request", "group commit"):
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}", connect_args={"check_same_thread": False})
+            migrations.upgrade(engine, log=lambda _: None)
+            seed(engine)
+            Session = sessionmaker(bind=engine)
+            committer = None
+            if mode == "group commit":
+                committer = group_commit.GroupCommitter(engine_for=lambda _: engine, window=args.window)
+            group_commit.committer = committer
+            try:
+                seconds = run(Session, args.threads, args.requests)
+            finally:
+                if committer is not None:
+                    committer.stop()
+                group_commit.committer = None
+                engine.dispose()
+        results[mode] = args.requests / seconds
+        print(f"{mode:<20}{seconds:>10.3f}{results[mode]:>12,.0f}")
+    print(f"speedup: {results['group commit'] / results['commit per request']:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+import models, schemas, listing, migrations
+
+# Compares the ORM + Pydantic + json list path with the column-select +
+# orjson path used by the list endpoints, on a synthetic Appointment table.
+#
+#   python benchmarks/bench_list_serialization.py --rows 100000
+
+def seed(engine, rows: int):
+    start = datetime(2024, 1, 1, 8, 0)
+    statuses = ["Pending", "Confirmed", "Cancelled"]
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [
+            {"user_id": 1, "full_name": "Bench Patient", "email": "p@bench.test", "password_hash": "x", "role": "Patient"},
+            {"user_id": 2, "full_name": "Bench Doctor", "email": "d@bench.test", "password_hash": "x", "role": "Doctor"},
+        ])
+        conn.execute(insert(models.Appointment), [
+            {"patient_id": 1, "doctor_id": 2, "appointment_date": start + timedelta(minutes=15 * i), "status": statuses[i % 3]}
+            for i in range(rows)
+        ])
+
+def orm_path(db) -> bytes:
+    adapter = TypeAdapter(list[schemas.AppointmentOut])
+    objs = db.query(models.Appointment).all()
+    validated = adapter.validate_python(objs, from_attributes=True)
+    return json.dumps(adapter.dump_python(validated, mode="json")).encode()
+
+def fast_path(db) -> bytes:
+    return listing.ORJSONResponse(listing.select_rows(db, models.Appointment, schemas.AppointmentOut)).body
+
+def measure(Session, fn, rows: int, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        db = Session()
+        try:
+            started = time.perf_counter()
+            body = fn(db)
+            best = min(best, time.perf_counter() - started)
+        finally:
+            db.close()
+    return best, rows / best, len(body)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark list serialization paths")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        migrations.upgrade(engine, log=lambda _: None)
+        seed(engine, args.rows)
+        Session = sessionmaker(bind=engine)
+
+        print(f"{'path':<22}{'seconds':>10}{'rows/s':>14}{'bytes':>12}")
+        results = {}
+        for name, fn in (("orm + pydantic + json", orm_path), ("columns + orjson", fast_path)):
+            seconds, rate, size = measure(Session, fn, args.rows, args.repeat)
+            results[name] = rate
+            print(f"{name:<22}{seconds:>10.3f}{rate:>14,.0f}{size:>12,}")
+        print(f"speedup: {results['columns + orjson'] / results['orm + pydantic + json']:.1f}x")
+        engine.dispose()
+
+if __name__ == "__main__":
+    main()
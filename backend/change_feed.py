@@ -0,0 +1,115 @@
+import json
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, func, insert, select
+import models, events, clinic_metrics
+from database import current_tenant, shards
+
+# Cross-process change feed. Writers that run outside the API, such as
+# `manage.py ingest-labs`, cannot reach the API's in-memory event bus or its
+# metric gauges, so they append their record changes to `change_feed` in the
+# same transaction as the change itself. A thread in the API polls the feed of
+# every clinic it has open and replays new rows through events.bus and
+# clinic_metrics, so live streams see them within POLL_SECONDS. A clinic's
+# first poll starts at the current end of its feed instead of replaying
+# history, and rows older than RETENTION are pruned.
+
+POLL_SECONDS = 1.0
+POLL_LIMIT = 1000
+RETENTION = timedelta(hours=1)
+PRUNE_EVERY = 60  # polls
+
+logger = logging.getLogger("change_feed")
+
+# Metric updates for each entity, from the replayed event's fields
+METRICS = {
+    "lab_test": lambda fields: clinic_metrics.lab_test_changed(fields.get("previous_status"), fields.get("status")),
+}
+
+# ------------------ WRITING ------------------
+def record(conn, entity: str, action: str, changes: list[dict]):
+    # Each change holds the event fields, including its record_id
+    if not changes:
+        return
+    now = datetime.now(timezone.utc)
+    conn.execute(insert(models.ChangeFeed), [
+        {
+            "at": now,
+            "entity": entity,
+            "action": action,
+            "record_id": change["record_id"],
+            "payload": json.dumps({name: value for name, value in change.items() if name != "record_id"}, default=str),
+        }
+        for change in changes
+    ])
+
+# ------------------ POLLING ------------------
+class FeedPoller:
+    def __init__(self, interval: float = POLL_SECONDS):
+        self.interval = interval
+        self._positions = {}
+        self._polls = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="change-feed", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _replay(self, tenant: str, rows):
+        token = current_tenant.set(tenant)
+        try:
+            for row in rows:
+                fields = json.loads(row.payload)
+                events.bus.publish(row.entity, row.action, row.record_id, **fields)
+                metric = METRICS.get(row.entity)
+                if metric is not None:
+                    metric(fields)
+        finally:
+            current_tenant.reset(token)
+
+    def poll_once(self) -> int:
+        feed = models.ChangeFeed.__table__
+        replayed = 0
+        for tenant in shards.open_tenants():
+            with shards.get(tenant).connect() as conn:
+                if tenant not in self._positions:
+                    self._positions[tenant] = conn.execute(select(func.coalesce(func.max(feed.c.change_id), 0))).scalar()
+                    continue
+                rows = conn.execute(
+                    select(feed).where(feed.c.change_id > self._positions[tenant]).order_by(feed.c.change_id).limit(POLL_LIMIT)
+                ).all()
+            if rows:
+                self._replay(tenant, rows)
+                self._positions[tenant] = rows[-1].change_id
+                replayed += len(rows)
+        return replayed
+
+    def prune(self):
+        cutoff = datetime.now(timezone.utc) - RETENTION
+        for tenant in shards.open_tenants():
+            with shards.get(tenant).begin() as conn:
+                conn.execute(delete(models.ChangeFeed).where(models.ChangeFeed.at < cutoff))
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll_once()
+                self._polls += 1
+                if self._polls % PRUNE_EVERY == 0:
+                    self.prune()
+            except Exception:
+                # A locked or missing shard must not kill the loop; retry next round
+                logger.exception("Polling the change feed failed")
+            self._stop.wait(self.interval)
+
+poller = FeedPoller()
@@ -0,0 +1,147 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import func, select
+import models
+from database import current_tenant, shards
+
+# Business gauges for Grafana and alerting. The crud write paths adjust them
+# as records change, so a scrape never touches the database. A background
+# thread re-counts them every RECONCILE_SECONDS with indexed COUNT queries,
+# for the clinics this process has open, which corrects drift from bulk
+# imports, CLI tools, other processes and the daily rollover of "today".
+# Until a clinic's first reconciliation its gauges have no baseline, so
+# write-path adjustments are ignored for it.
+
+LOW_STOCK_THRESHOLD = 10
+RECONCILE_SECONDS = 300
+
+lab_tests_pending = Gauge("clinic_lab_tests_pending", "Lab tests waiting for a result", ["clinic"])
+appointments_unconfirmed_today = Gauge(
+    "clinic_appointments_unconfirmed_today", "Pending appointments scheduled for today", ["clinic"]
+)
+inventory_low_stock = Gauge(
+    "clinic_inventory_low_stock_items", "Inventory items with quantity below the low-stock threshold", ["clinic"]
+)
+low_stock_threshold = Gauge("clinic_inventory_low_stock_threshold", "Quantity below which an item counts as low stock")
+payments_failed = Counter("clinic_payments_failed_total", "Payments recorded or updated as failed", ["clinic"])
+reconcile_seconds = Histogram("clinic_metrics_reconcile_seconds", "Time spent re-counting business gauges")
+reconcile_drift = Counter(
+    "clinic_metrics_drift_total", "Corrections made by reconciliation", ["clinic", "metric"]
+)
+
+low_stock_threshold.set(LOW_STOCK_THRESHOLD)
+
+_GAUGES = {
+    "lab_tests_pending": lab_tests_pending,
+    "appointments_unconfirmed_today": appointments_unconfirmed_today,
+    "inventory_low_stock": inventory_low_stock,
+}
+
+logger = logging.getLogger("clinic_metrics")
+
+# (clinic, metric) -> current value, for the clinics reconciled so far
+_values = {}
+_lock = threading.Lock()
+
+def _value(status):
+    return getattr(status, "value", status)
+
+def _adjust(metric: str, delta: int):
+    if not delta:
+        return
+    key = (current_tenant.get(), metric)
+    with _lock:
+        if key in _values:
+            _values[key] += delta
+            _GAUGES[metric].labels(clinic=key[0]).set(_values[key])
+
+# ------------------ WRITE PATHS ------------------
+def _unconfirmed_today(appointment_date, status) -> int:
+    # appointment_date is stored as naive wall-clock time
+    if appointment_date is None or _value(status) != "Pending":
+        return 0
+    return int(appointment_date.replace(tzinfo=None).date() == datetime.now().date())
+
+def appointment_changed(before=None, after=None):
+    # `before` / `after` are (appointment_date, status), None when absent
+    _adjust("appointments_unconfirmed_today",
+            (_unconfirmed_today(*after) if after else 0) - (_unconfirmed_today(*before) if before else 0))
+
+def lab_test_changed(before=None, after=None):
+    # `before` / `after` are statuses, None when the test did not exist
+    _adjust("lab_tests_pending", int(_value(after) == "Pending") - int(_value(before) == "Pending"))
+
+def inventory_changed(before=None, after=None):
+    # `before` / `after` are quantities, None when the item did not exist
+    def low(quantity):
+        return int(quantity is not None and quantity < LOW_STOCK_THRESHOLD)
+    _adjust("inventory_low_stock", low(after) - low(before))
+
+def payment_changed(before=None, after=None):
+    if _value(after) == "Failed" and _value(before) != "Failed":
+        payments_failed.labels(clinic=current_tenant.get()).inc()
+
+# ------------------ RECONCILIATION ------------------
+def count_all(engine) -> dict:
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    queries = {
+        "lab_tests_pending": select(func.count()).select_from(models.LabTest)
+            .where(models.LabTest.status == models.LabTestStatusEnum.Pending),
+        "appointments_unconfirmed_today": select(func.count()).select_from(models.Appointment)
+            .where(models.Appointment.appointment_date >= today,
+                   models.Appointment.appointment_date < today + timedelta(days=1),
+                   models.Appointment.status == models.StatusEnum.Pending),
+        "inventory_low_stock": select(func.count()).select_from(models.Inventory)
+            .where(models.Inventory.quantity < LOW_STOCK_THRESHOLD),
+    }
+    with engine.connect() as conn:
+        return {metric: conn.execute(query).scalar() for metric, query in queries.items()}
+
+def reconcile(tenants=None) -> dict:
+    results = {}
+    with reconcile_seconds.time():
+        for tenant in tenants or shards.open_tenants():
+            # A write racing the count may skew it by one until the next round
+            counts = count_all(shards.get(tenant))
+            with _lock:
+                for metric, count in counts.items():
+                    previous = _values.get((tenant, metric))
+                    if previous is not None and previous != count:
+                        reconcile_drift.labels(clinic=tenant, metric=metric).inc()
+                    _values[(tenant, metric)] = count
+                    _GAUGES[metric].labels(clinic=tenant).set(count)
+            results[tenant] = counts
+    return results
+
+class Reconciler:
+    def __init__(self, interval: float = RECONCILE_SECONDS):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="clinic-metrics", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                reconcile()
+            except Exception:
+                # A locked or missing shard must not kill the loop; retry next round
+                logger.exception("Reconciling clinic metrics failed")
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+reconciler = Reconciler()
@@ -1,29 +1,59 @@
+from datetime import datetime
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import func
 from fastapi import HTTPException
-import models, schemas
+import models, schemas, versioning, doctor_calendar, doctor_directory, events, archive, clinic_metrics, group_commit
 import bleach
-from passlib.context import CryptContext
+import passwords
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = passwords.context
 
 # ------------------------ AUTH HELPERS ------------------------
 def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+    return passwords.hash_password(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return passwords.verify_password(plain_password, hashed_password)
 
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
 def verify_user_credentials(db: Session, email: str, password: str):
     user = get_user_by_email(db, email)
-    if not user or not verify_password(password, user.password_hash):
+    if not user:
+        return None
+    valid, new_hash = passwords.verify_and_update(password, user.password_hash)
+    if not valid:
         return None
+    if new_hash:
+        # Hashed under an older scheme or cost; upgrade while we have the password
+        user.password_hash = new_hash
+        db.commit()
     return user
 def authenticate_user(db: Session, email: str, password: str):
     return verify_user_credentials(db, email, password)
 
+def _commit_version(db: Session, label: str):
+    # Two concurrent edits of the same version collide on the unique history key
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=f"{label} was modified concurrently, reload and retry")
+
+def _insert(db: Session, obj):
+    # Plain creates go through the group-commit writer when it is enabled
+    if group_commit.committer is not None:
+        # End the read transaction first, so callers waiting on the writer
+        # do not hold the pooled connections it needs
+        db.rollback()
+        return group_commit.committer.add(obj)
+    db.add(obj)
+    db.commit()
+    db.refresh(obj)
+    return obj
+
 # ------------------------ USERS ------------------------
 def create_user(db: Session, user: schemas.UserCreate):
     user_dict = user.dict()
@@ -32,6 +62,7 @@ def create_user(db: Session, user: schemas.UserCreate):
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    doctor_directory.directory.user_changed(db_user.user_id, db_user)
     return db_user
 
 def get_user(db: Session, user_id: int):
@@ -55,6 +86,7 @@ def update_user(db: Session, user_id: int, user: schemas.UserCreate):
     
     db.commit()
     db.refresh(db_user)
+    doctor_directory.directory.user_changed(db_user.user_id, db_user)
     return db_user
 
 def delete_user(db: Session, user_id: int):
@@ -72,9 +104,12 @@ def delete_user(db: Session, user_id: int):
         raise HTTPException(status_code=400, detail="User is referenced in lab tests")
     if db.query(models.EMR).filter((models.EMR.patient_id == user_id) | (models.EMR.doctor_id == user_id)).first():
         raise HTTPException(status_code=400, detail="User is referenced in EMRs")
+    if archive.references_user(db, user_id):
+        raise HTTPException(status_code=400, detail="User is referenced in archived records")
 
     db.delete(user)
     db.commit()
+    doctor_directory.directory.user_changed(user_id)
 # ------------------------ APPOINTMENTS ------------------------
 def create_appointment(db: Session, appt: schemas.AppointmentCreate):
     if not get_user(db, appt.patient_id):
@@ -82,9 +117,10 @@ def create_appointment(db: Session, appt: schemas.AppointmentCreate):
     if not get_user(db, appt.doctor_id):
         raise HTTPException(status_code=400, detail="Invalid doctor_id")
     db_appt = models.Appointment(**appt.dict())
-    db.add(db_appt)
-    db.commit()
-    db.refresh(db_appt)
+    db_appt = _insert(db, db_appt)
+    doctor_calendar.invalidate(db_appt.doctor_id, db_appt.appointment_date)
+    events.appointment_changed("created", db_appt)
+    clinic_metrics.appointment_changed(after=(db_appt.appointment_date, db_appt.status))
     return db_appt
 
 def get_appointment(db: Session, appt_id: int):
@@ -93,13 +129,42 @@ def get_appointment(db: Session, appt_id: int):
 def get_appointments(db: Session):
     return db.query(models.Appointment).all()
 
+def search_doctors(db: Session, query: str = None, specialty: str = None) -> list[dict]:
+    return doctor_directory.directory.search(db, query, specialty)
+
+def get_doctor_calendar(db: Session, doctor_id: int, start: datetime, end: datetime, granularity: schemas.CalendarGranularityEnum):
+    doctor = get_user(db, doctor_id)
+    if not doctor or doctor.role != models.RoleEnum.Doctor:
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    # appointment_date is stored as naive wall-clock time
+    start, end = start.replace(tzinfo=None), end.replace(tzinfo=None)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="'to' must be after 'from'")
+    if end - start > doctor_calendar.MAX_RANGE:
+        raise HTTPException(status_code=400, detail=f"Calendar range is limited to {doctor_calendar.MAX_RANGE.days} days")
+    return doctor_calendar.get_calendar(db, doctor_id, start, end, granularity)
+
+def get_patient_timeline(db: Session, patient_id: int, before: datetime = None, limit: int = 100):
+    patient = get_user(db, patient_id)
+    if not patient or patient.role != models.RoleEnum.Patient:
+        raise HTTPException(status_code=404, detail="Patient not found")
+    if before is not None:
+        before = before.replace(tzinfo=None)
+    return archive.patient_timeline(db, patient_id, before, limit)
+
 def update_appointment(db: Session, appt_id: int, appt: schemas.AppointmentCreate):
     db_appt = get_appointment(db, appt_id)
     if not db_appt:
         raise HTTPException(status_code=404, detail="Appointment not found")
+    previous = (db_appt.doctor_id, db_appt.appointment_date)
+    previous_status = db_appt.status
     for key, value in appt.dict().items():
         setattr(db_appt, key, value)
     db.commit()
+    doctor_calendar.invalidate(*previous)
+    doctor_calendar.invalidate(appt.doctor_id, appt.appointment_date)
+    events.appointment_changed("updated", db_appt, previous_status)
+    clinic_metrics.appointment_changed((previous[1], previous_status), (db_appt.appointment_date, db_appt.status))
     return db_appt
 
 def delete_appointment(db: Session, appt_id: int):
@@ -108,8 +173,12 @@ def delete_appointment(db: Session, appt_id: int):
         raise HTTPException(status_code=404, detail="Appointment not found")
     if db.query(models.Prescription).filter(models.Prescription.appointment_id == appt_id).first():
         raise HTTPException(status_code=400, detail="Appointment is referenced in prescriptions")
+    previous = (appt.doctor_id, appt.appointment_date)
     db.delete(appt)
     db.commit()
+    doctor_calendar.invalidate(*previous)
+    events.appointment_changed("deleted", appt, appt.status)
+    clinic_metrics.appointment_changed(before=(previous[1], appt.status))
 
 # ------------------------ PRESCRIPTIONS ------------------------
 def create_prescription(db: Session, pres: schemas.PrescriptionCreate):
@@ -134,19 +203,50 @@ def get_prescription(db: Session, pres_id: int):
 def get_prescriptions(db: Session):
     return db.query(models.Prescription).all()
 
+def get_prescription_versions(db: Session, pres_id: int):
+    pres = archive.get_record(db, models.Prescription, pres_id)
+    if pres:
+        return versioning.list_versions(db, "prescription", pres_id, pres.version, pres.updated_on or pres.prescribed_on)
+    if versioning.get_deleted(db, "prescription", pres_id):
+        return versioning.list_versions(db, "prescription", pres_id)
+    raise HTTPException(status_code=404, detail="Prescription not found")
+
+def get_prescription_version(db: Session, pres_id: int, version: int):
+    pres = archive.get_record(db, models.Prescription, pres_id)
+    if pres:
+        current = (pres.version, pres.updated_on or pres.prescribed_on, pres.notes)
+    else:
+        deleted = versioning.get_deleted(db, "prescription", pres_id)
+        if not deleted:
+            raise HTTPException(status_code=404, detail="Prescription not found")
+        if version > deleted.version:
+            raise HTTPException(status_code=404, detail="Prescription version not found")
+        current = (deleted.version + 1, None, None)
+    try:
+        entry = versioning.get_version(db, "prescription", pres_id, version, *current)
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Prescription version not found")
+    return {"prescription_id": pres_id, "version": version, "created_on": entry["created_on"], "notes": entry["text"]}
+
 def update_prescription(db: Session, pres_id: int, pres: schemas.PrescriptionCreate):
     db_pres = get_prescription(db, pres_id)
     if not db_pres:
         raise HTTPException(status_code=404, detail="Prescription not found")
+    version, created_on, notes = db_pres.version, db_pres.updated_on or db_pres.prescribed_on, db_pres.notes
     for key, value in pres.dict().items():
         setattr(db_pres, key, bleach.clean(value) if key == "notes" and value else value)
-    db.commit()
+    versioning.record_previous(db, "prescription", pres_id, version, created_on, notes, db_pres.notes)
+    db_pres.version = version + 1
+    db_pres.updated_on = func.now()
+    _commit_version(db, "Prescription")
     return db_pres
 
 def delete_prescription(db: Session, pres_id: int):
     pres = get_prescription(db, pres_id)
     if not pres:
         raise HTTPException(status_code=404, detail="Prescription not found")
+    versioning.record_deletion(db, "prescription", pres_id, pres.version, pres.updated_on or pres.prescribed_on,
+                               pres.notes, pres.patient_id, pres.doctor_id)
     db.delete(pres)
     db.commit()
 
@@ -155,9 +255,8 @@ def create_inventory(db: Session, item: schemas.InventoryCreate):
     clean_data = item.dict()
     clean_data["description"] = bleach.clean(clean_data["description"]) if clean_data["description"] else None
     db_item = models.Inventory(**clean_data)
-    db.add(db_item)
-    db.commit()
-    db.refresh(db_item)
+    db_item = _insert(db, db_item)
+    clinic_metrics.inventory_changed(after=db_item.quantity)
     return db_item
 
 def get_inventory_item(db: Session, item_id: int):
@@ -170,9 +269,11 @@ def update_inventory(db: Session, item_id: int, item: schemas.InventoryCreate):
     db_item = get_inventory_item(db, item_id)
     if not db_item:
         raise HTTPException(status_code=404, detail="Item not found")
+    previous_quantity = db_item.quantity
     for key, value in item.dict().items():
         setattr(db_item, key, bleach.clean(value) if key == "description" and value else value)
     db.commit()
+    clinic_metrics.inventory_changed(previous_quantity, db_item.quantity)
     return db_item
 
 def delete_inventory(db: Session, item_id: int):
@@ -181,15 +282,15 @@ def delete_inventory(db: Session, item_id: int):
         raise HTTPException(status_code=404, detail="Item not found")
     db.delete(item)
     db.commit()
+    clinic_metrics.inventory_changed(before=item.quantity)
 
 # ------------------------ PAYMENTS ------------------------
 def create_payment(db: Session, payment: schemas.PaymentCreate):
     if not get_user(db, payment.user_id):
         raise HTTPException(status_code=400, detail="Invalid user_id")
     db_payment = models.Payment(**payment.dict())
-    db.add(db_payment)
-    db.commit()
-    db.refresh(db_payment)
+    db_payment = _insert(db, db_payment)
+    clinic_metrics.payment_changed(after=db_payment.status)
     return db_payment
 
 def get_payment(db: Session, payment_id: int):
@@ -202,9 +303,11 @@ def update_payment(db: Session, payment_id: int, payment: schemas.PaymentCreate)
     db_payment = get_payment(db, payment_id)
     if not db_payment:
         raise HTTPException(status_code=404, detail="Payment not found")
+    previous_status = db_payment.status
     for key, value in payment.dict().items():
         setattr(db_payment, key, value)
     db.commit()
+    clinic_metrics.payment_changed(previous_status, db_payment.status)
     return db_payment
 
 def delete_payment(db: Session, payment_id: int):
@@ -221,9 +324,9 @@ def create_lab_test(db: Session, test: schemas.LabTestCreate):
     clean_data = test.dict()
     clean_data["result"] = bleach.clean(clean_data["result"]) if clean_data["result"] else None
     db_test = models.LabTest(**clean_data)
-    db.add(db_test)
-    db.commit()
-    db.refresh(db_test)
+    db_test = _insert(db, db_test)
+    events.lab_test_changed("created", db_test)
+    clinic_metrics.lab_test_changed(after=db_test.status)
     return db_test
 
 def get_lab_test(db: Session, test_id: int):
@@ -236,9 +339,12 @@ def update_lab_test(db: Session, test_id: int, test: schemas.LabTestCreate):
     db_test = get_lab_test(db, test_id)
     if not db_test:
         raise HTTPException(status_code=404, detail="Lab test not found")
+    previous_status = db_test.status
     for key, value in test.dict().items():
         setattr(db_test, key, bleach.clean(value) if key == "result" and value else value)
     db.commit()
+    events.lab_test_changed("updated", db_test, previous_status)
+    clinic_metrics.lab_test_changed(previous_status, db_test.status)
     return db_test
 
 def delete_lab_test(db: Session, test_id: int):
@@ -247,6 +353,8 @@ def delete_lab_test(db: Session, test_id: int):
         raise HTTPException(status_code=404, detail="Lab test not found")
     db.delete(test)
     db.commit()
+    events.lab_test_changed("deleted", test, test.status)
+    clinic_metrics.lab_test_changed(before=test.status)
 
 # ------------------------ EMR ------------------------
 def create_emr(db: Session, emr: schemas.EMRCreate):
@@ -268,18 +376,49 @@ def get_emr(db: Session, emr_id: int):
 def get_all_emrs(db: Session):
     return db.query(models.EMR).all()
 
+def get_emr_versions(db: Session, emr_id: int):
+    emr = archive.get_record(db, models.EMR, emr_id)
+    if emr:
+        return versioning.list_versions(db, "emr", emr_id, emr.version, emr.updated_on or emr.created_on)
+    if versioning.get_deleted(db, "emr", emr_id):
+        return versioning.list_versions(db, "emr", emr_id)
+    raise HTTPException(status_code=404, detail="EMR not found")
+
+def get_emr_version(db: Session, emr_id: int, version: int):
+    emr = archive.get_record(db, models.EMR, emr_id)
+    if emr:
+        current = (emr.version, emr.updated_on or emr.created_on, emr.summary)
+    else:
+        deleted = versioning.get_deleted(db, "emr", emr_id)
+        if not deleted:
+            raise HTTPException(status_code=404, detail="EMR not found")
+        if version > deleted.version:
+            raise HTTPException(status_code=404, detail="EMR version not found")
+        current = (deleted.version + 1, None, None)
+    try:
+        entry = versioning.get_version(db, "emr", emr_id, version, *current)
+    except LookupError:
+        raise HTTPException(status_code=404, detail="EMR version not found")
+    return {"emr_id": emr_id, "version": version, "created_on": entry["created_on"], "summary": entry["text"]}
+
 def update_emr(db: Session, emr_id: int, emr: schemas.EMRCreate):
     db_emr = get_emr(db, emr_id)
     if not db_emr:
         raise HTTPException(status_code=404, detail="EMR not found")
+    version, created_on, summary = db_emr.version, db_emr.updated_on or db_emr.created_on, db_emr.summary
     for key, value in emr.dict().items():
         setattr(db_emr, key, bleach.clean(value) if key == "summary" and value else value)
-    db.commit()
+    versioning.record_previous(db, "emr", emr_id, version, created_on, summary, db_emr.summary)
+    db_emr.version = version + 1
+    db_emr.updated_on = func.now()
+    _commit_version(db, "EMR")
     return db_emr
 
 def delete_emr(db: Session, emr_id: int):
     emr = get_emr(db, emr_id)
     if not emr:
         raise HTTPException(status_code=404, detail="EMR not found")
+    versioning.record_deletion(db, "emr", emr_id, emr.version, emr.updated_on or emr.created_on,
+                               emr.summary, emr.patient_id, emr.doctor_id)
     db.delete(emr)
     db.commit()
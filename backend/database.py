@@ -1,13 +1,101 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextvars import ContextVar
+
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 DATABASE_URL = "sqlite:///./telemedicine.db"
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# Per-clinic shards. The default clinic keeps telemedicine.db; every other
+# clinic gets its own SQLite file under SHARD_DIR, and with it its own write
+# lock. tenancy.TenantMiddleware sets `current_tenant` for each request and
+# get_db() binds the session to that clinic's engine. Engines are opened on
+# first use and the least recently used are disposed past MAX_OPEN_SHARDS.
+DEFAULT_TENANT = "default"
+SHARD_DIR = "shards"
+MAX_OPEN_SHARDS = 32
+TENANT_ID = re.compile(r"^[a-z0-9][a-z0-9_-]{0,62}$")
+
+current_tenant = ContextVar("current_tenant", default=DEFAULT_TENANT)
+
+def _create_engine(url: str):
+    return create_engine(url, connect_args={"check_same_thread": False})
+
+engine = _create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
 Base = declarative_base()
+
+class UnknownTenant(LookupError):
+    pass
+
+def shard_path(tenant: str) -> str:
+    return os.path.join(SHARD_DIR, f"{tenant}.db")
+
+class ShardRegistry:
+    def __init__(self, max_open: int = MAX_OPEN_SHARDS):
+        self.max_open = max_open
+        # Called with each newly opened shard engine, e.g. to check its schema
+        self.on_open = None
+        self._engines = OrderedDict()
+        self._lock = threading.Lock()
+
+    def exists(self, tenant: str) -> bool:
+        if tenant == DEFAULT_TENANT:
+            return True
+        return bool(TENANT_ID.match(tenant)) and os.path.exists(shard_path(tenant))
+
+    def get(self, tenant: str, create: bool = False):
+        if tenant == DEFAULT_TENANT:
+            return engine
+        with self._lock:
+            shard = self._engines.get(tenant)
+            if shard is not None:
+                self._engines.move_to_end(tenant)
+                return shard
+        if not TENANT_ID.match(tenant):
+            raise UnknownTenant(f"Unknown clinic {tenant!r}")
+        if not create and not os.path.exists(shard_path(tenant)):
+            raise UnknownTenant(f"Unknown clinic {tenant!r}")
+        os.makedirs(SHARD_DIR, exist_ok=True)
+        shard = _create_engine(f"sqlite:///./{shard_path(tenant)}")
+        if self.on_open and not create:
+            self.on_open(shard)
+        evicted = []
+        with self._lock:
+            # Another request may have opened it meanwhile; keep the first
+            if tenant in self._engines:
+                evicted.append(shard)
+                shard = self._engines[tenant]
+            else:
+                self._engines[tenant] = shard
+            while len(self._engines) > self.max_open:
+                evicted.append(self._engines.popitem(last=False)[1])
+        for old in evicted:
+            # Checked-out connections stay usable and are closed on return
+            old.dispose()
+        return shard
+
+    def tenants(self) -> list[str]:
+        names = []
+        if os.path.isdir(SHARD_DIR):
+            names = sorted(name[:-3] for name in os.listdir(SHARD_DIR)
+                           if name.endswith(".db") and TENANT_ID.match(name[:-3]))
+        return [DEFAULT_TENANT] + names
+
+    def open_tenants(self) -> list[str]:
+        with self._lock:
+            return [DEFAULT_TENANT] + list(self._engines)
+
+    def path(self, tenant: str) -> str:
+        return DATABASE_URL.split("///", 1)[1] if tenant == DEFAULT_TENANT else shard_path(tenant)
+
+shards = ShardRegistry()
+
 def get_db():
-    db = SessionLocal()
+    db = SessionLocal(bind=shards.get(current_tenant.get()))
     try:
         yield db
     finally:
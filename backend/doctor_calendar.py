@@ -0,0 +1,91 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, date, time, timedelta
+
+from sqlalchemy.orm import Session
+import models, schemas, archive
+from database import current_tenant
+
+# Week-bucketed cache behind GET /doctors/{id}/calendar. Each entry holds one
+# doctor's appointments for one Monday-based week of one clinic, loaded with a
+# range scan on ix_appointments_doctor_date. The appointment write paths in crud call
+# invalidate() for every (doctor, week) they touch.
+
+MAX_CACHED_WEEKS = 4096
+MAX_RANGE = timedelta(days=62)
+
+_weeks = OrderedDict()
+_lock = threading.Lock()
+_epoch = 0
+
+def week_start(value) -> date:
+    day = value.date() if isinstance(value, datetime) else value
+    return day - timedelta(days=day.weekday())
+
+def invalidate(doctor_id, appointment_date):
+    global _epoch
+    if doctor_id is None or appointment_date is None:
+        return
+    with _lock:
+        _epoch += 1
+        _weeks.pop((current_tenant.get(), doctor_id, week_start(appointment_date)), None)
+
+def clear():
+    global _epoch
+    with _lock:
+        _epoch += 1
+        _weeks.clear()
+
+def _load_week(db: Session, doctor_id: int, monday: date) -> list[dict]:
+    start = datetime.combine(monday, time.min)
+    # Old weeks may have been moved to the archive, partly or entirely
+    rows = archive.select_rows(db, models.Appointment, schemas.AppointmentOut, lambda source: (
+        source.doctor_id == doctor_id,
+        source.appointment_date >= start,
+        source.appointment_date < start + timedelta(days=7),
+    ))
+    rows.sort(key=lambda row: row["appointment_date"])
+    return rows
+
+def get_week(db: Session, doctor_id: int, monday: date) -> list[dict]:
+    key = (current_tenant.get(), doctor_id, monday)
+    with _lock:
+        if key in _weeks:
+            _weeks.move_to_end(key)
+            return _weeks[key]
+        epoch = _epoch
+    rows = _load_week(db, doctor_id, monday)
+    with _lock:
+        # A write that landed while we were reading makes this result suspect
+        if epoch == _epoch:
+            _weeks[key] = rows
+            while len(_weeks) > MAX_CACHED_WEEKS:
+                _weeks.popitem(last=False)
+    return rows
+
+def _bucket_start(value: datetime, granularity: schemas.CalendarGranularityEnum) -> datetime:
+    if granularity == schemas.CalendarGranularityEnum.hour:
+        return value.replace(minute=0, second=0, microsecond=0)
+    return datetime.combine(value.date(), time.min)
+
+def get_calendar(db: Session, doctor_id: int, start: datetime, end: datetime,
+                 granularity: schemas.CalendarGranularityEnum) -> dict:
+    buckets = OrderedDict()
+    monday, last_monday = week_start(start), week_start(end - timedelta(microseconds=1))
+    while monday <= last_monday:
+        for row in get_week(db, doctor_id, monday):
+            when = row["appointment_date"]
+            if start <= when < end:
+                bucket = buckets.setdefault(_bucket_start(when, granularity), [])
+                bucket.append(row)
+        monday += timedelta(days=7)
+    return {
+        "doctor_id": doctor_id,
+        "start": start,
+        "end": end,
+        "granularity": granularity,
+        "buckets": [
+            {"start": bucket_start, "count": len(rows), "appointments": rows}
+            for bucket_start, rows in buckets.items()
+        ],
+    }
@@ -0,0 +1,136 @@
+import difflib
+import threading
+import time
+from bisect import bisect_left
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+import models
+from database import current_tenant
+
+# In-memory doctor directory behind GET /doctors/. Each clinic gets a sorted
+# list of (name word, doctor_id), so a prefix lookup is a binary search
+# instead of a LIKE scan over users. Every word of a query must prefix some
+# word of the doctor's name ("jo sm" finds "John Smith"); a word with no
+# prefix hit falls back to close matches against the start of the known
+# words, which catches small typos ("farok" finds "Farooq"). crud keeps the
+# index current on user create, update and delete; it is rebuilt from the
+# database after REFRESH_SECONDS to pick up imports and writes made by other
+# processes.
+
+REFRESH_SECONDS = 600
+FUZZY_CUTOFF = 0.75
+FUZZY_CANDIDATES = 5
+
+def _words(text: str) -> list[str]:
+    return [word for word in (text or "").casefold().split() if word]
+
+class DoctorIndex:
+    def __init__(self, doctors):
+        # doctors: iterable of (user_id, full_name, specialty)
+        self.doctors = {}
+        self.words = []
+        for user_id, full_name, specialty in doctors:
+            self._add(user_id, full_name, specialty)
+        self.words.sort()
+        self.built_at = time.monotonic()
+
+    def _add(self, user_id: int, full_name: str, specialty):
+        self.doctors[user_id] = (full_name, specialty)
+        for word in set(_words(full_name)):
+            self.words.append((word, user_id))
+
+    def add(self, user_id: int, full_name: str, specialty):
+        self.remove(user_id)
+        self.doctors[user_id] = (full_name, specialty)
+        for word in set(_words(full_name)):
+            self.words.insert(bisect_left(self.words, (word, user_id)), (word, user_id))
+
+    def remove(self, user_id: int):
+        entry = self.doctors.pop(user_id, None)
+        if entry is None:
+            return
+        for word in set(_words(entry[0])):
+            position = bisect_left(self.words, (word, user_id))
+            if position < len(self.words) and self.words[position] == (word, user_id):
+                del self.words[position]
+
+    def _prefixed(self, prefix: str) -> set:
+        matches = set()
+        position = bisect_left(self.words, (prefix,))
+        while position < len(self.words) and self.words[position][0].startswith(prefix):
+            matches.add(self.words[position][1])
+            position += 1
+        return matches
+
+    def _fuzzy(self, word: str) -> set:
+        # Compared against name words cut to the typed length, since a
+        # typeahead query is usually an unfinished word
+        heads = {entry[0][:len(word)] for entry in self.words}
+        matches = set()
+        for close in difflib.get_close_matches(word, heads, n=FUZZY_CANDIDATES, cutoff=FUZZY_CUTOFF):
+            matches |= self._prefixed(close)
+        return matches
+
+    def search(self, query: str = None, specialty: str = None) -> list[dict]:
+        candidates = None
+        for word in _words(query):
+            matches = self._prefixed(word) or self._fuzzy(word)
+            candidates = matches if candidates is None else candidates & matches
+            if not candidates:
+                return []
+        if candidates is None:
+            candidates = self.doctors.keys()
+        wanted = specialty.casefold() if specialty else None
+        results = [
+            {"user_id": user_id, "full_name": self.doctors[user_id][0], "specialty": self.doctors[user_id][1]}
+            for user_id in candidates
+            if wanted is None or (self.doctors[user_id][1] or "").casefold() == wanted
+        ]
+        return sorted(results, key=lambda doctor: (doctor["full_name"].casefold(), doctor["user_id"]))
+
+class DoctorDirectory:
+    def __init__(self, refresh_seconds: float = REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def _load(self, db: Session) -> DoctorIndex:
+        rows = db.execute(
+            select(models.User.user_id, models.User.full_name, models.User.specialty)
+            .where(models.User.role == models.RoleEnum.Doctor)
+        ).all()
+        return DoctorIndex(rows)
+
+    def index(self, db: Session) -> DoctorIndex:
+        tenant = current_tenant.get()
+        with self._lock:
+            index = self._indexes.get(tenant)
+        if index is None or time.monotonic() - index.built_at > self.refresh_seconds:
+            index = self._load(db)
+            with self._lock:
+                self._indexes[tenant] = index
+        return index
+
+    def search(self, db: Session, query: str = None, specialty: str = None) -> list[dict]:
+        index = self.index(db)
+        with self._lock:
+            return index.search(query, specialty)
+
+    def user_changed(self, user_id: int, after=None):
+        # `after` is the committed User, None once deleted. Clinics whose
+        # index has not been built yet load it fresh on first search.
+        with self._lock:
+            index = self._indexes.get(current_tenant.get())
+            if index is None:
+                return
+            if after is not None and after.role == models.RoleEnum.Doctor:
+                index.add(user_id, after.full_name, after.specialty)
+            else:
+                index.remove(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+directory = DoctorDirectory()
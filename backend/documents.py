@@ -0,0 +1,148 @@
+import hashlib
+import html
+import time
+
+import orjson
+from fastapi import HTTPException, Response
+from prometheus_client import Counter, Histogram
+from sqlalchemy.orm import Session
+import models, archive
+
+# Printable prescriptions and EMR summaries, rendered as standalone HTML with
+# a print stylesheet (browsers and pharmacy systems print or save it as PDF).
+# The document is a pure function of the record (including its version), its
+# appointment and the doctor's and patient's details, so the SHA-256 of those
+# inputs plus TEMPLATE_VERSION is its ETag, and a client revalidating an
+# unchanged document gets a 304 without it being rendered. The inputs have to
+# be loaded either way (users carry no change marker), and rendering is one
+# str.format over them, so rendered pages are not cached.
+
+# Bump whenever the templates below change
+TEMPLATE_VERSION = 1
+
+document_requests = Counter("document_requests_total", "Document downloads by result", ["kind", "result"])
+document_render_seconds = Histogram("document_render_seconds", "Time to render one document", ["kind"])
+
+# ------------------ INPUTS ------------------
+def _when(value) -> str:
+    return value.strftime("%Y-%m-%d %H:%M") if value else ""
+
+def _person(db: Session, user_id: int) -> dict:
+    user = db.get(models.User, user_id) if user_id is not None else None
+    if user is None:
+        return {"user_id": user_id, "full_name": "(unknown)", "phone_number": None, "specialty": None}
+    return {"user_id": user.user_id, "full_name": user.full_name, "phone_number": user.phone_number, "specialty": user.specialty}
+
+def prescription_inputs(db: Session, prescription_id: int) -> dict:
+    pres = archive.get_record(db, models.Prescription, prescription_id)
+    if pres is None:
+        raise HTTPException(status_code=404, detail="Prescription not found")
+    appt = archive.get_record(db, models.Appointment, pres.appointment_id) if pres.appointment_id else None
+    return {
+        "id": pres.prescription_id,
+        "version": pres.version,
+        "issued": _when(pres.prescribed_on),
+        "updated": _when(pres.updated_on),
+        "notes": pres.notes or "",
+        "appointment": {"id": appt.appointment_id, "date": _when(appt.appointment_date)} if appt else None,
+        "doctor": _person(db, pres.doctor_id),
+        "patient": _person(db, pres.patient_id),
+    }
+
+def emr_inputs(db: Session, emr_id: int) -> dict:
+    emr = archive.get_record(db, models.EMR, emr_id)
+    if emr is None:
+        raise HTTPException(status_code=404, detail="EMR not found")
+    return {
+        "id": emr.emr_id,
+        "version": emr.version,
+        "issued": _when(emr.created_on),
+        "updated": _when(emr.updated_on),
+        "notes": emr.summary or "",
+        "appointment": None,
+        "doctor": _person(db, emr.doctor_id),
+        "patient": _person(db, emr.patient_id),
+    }
+
+# ------------------ RENDERING ------------------
+PAGE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{title} #{id}</title>
+<style>
+  body {{ font-family: Georgia, serif; max-width: 44rem; margin: 2rem auto; color: #111; }}
+  header {{ border-bottom: 2px solid #111; margin-bottom: 1.5rem; }}
+  h1 {{ font-size: 1.5rem; margin: 0 0 .25rem; }}
+  .meta {{ color: #555; font-size: .9rem; }}
+  table {{ width: 100%; border-collapse: collapse; margin-bottom: 1.5rem; }}
+  th {{ text-align: left; width: 9rem; color: #555; font-weight: normal; }}
+  td, th {{ padding: .2rem 0; vertical-align: top; }}
+  .notes {{ white-space: pre-wrap; border: 1px solid #ccc; padding: 1rem; min-height: 8rem; }}
+  footer {{ margin-top: 3rem; display: flex; justify-content: space-between; font-size: .9rem; }}
+  @media print {{ body {{ margin: 0; }} @page {{ margin: 2cm; }} }}
+</style>
+</head>
+<body>
+<header>
+  <h1>{title}</h1>
+  <div class="meta">No. {id} &middot; version {version} &middot; issued {issued}{updated}</div>
+</header>
+<table>
+  <tr><th>Patient</th><td>{patient}</td></tr>
+  <tr><th>Doctor</th><td>{doctor}</td></tr>
+{appointment}</table>
+<h2>{notes_heading}</h2>
+<div class="notes">{notes}</div>
+<footer><span>Doctor's signature: ______________________</span><span>{doctor_name}</span></footer>
+</body>
+</html>
+"""
+
+TITLES = {"prescription": ("Prescription", "Medication and instructions"), "emr": ("Medical Record Summary", "Summary")}
+
+def _describe(person: dict) -> str:
+    parts = [html.escape(person["full_name"]), f"(ID {person['user_id']})"]
+    if person.get("specialty"):
+        parts.append(f"&middot; {html.escape(person['specialty'])}")
+    if person.get("phone_number"):
+        parts.append(f"&middot; {html.escape(person['phone_number'])}")
+    return " ".join(parts)
+
+def render(kind: str, inputs: dict) -> bytes:
+    title, notes_heading = TITLES[kind]
+    appointment = inputs["appointment"]
+    return PAGE.format(
+        title=title,
+        notes_heading=notes_heading,
+        id=inputs["id"],
+        version=inputs["version"],
+        issued=html.escape(inputs["issued"]),
+        updated=f" &middot; updated {html.escape(inputs['updated'])}" if inputs["updated"] else "",
+        patient=_describe(inputs["patient"]),
+        doctor=_describe(inputs["doctor"]),
+        doctor_name=html.escape(inputs["doctor"]["full_name"]),
+        appointment=(f"  <tr><th>Appointment</th><td>#{appointment['id']} on {html.escape(appointment['date'])}</td></tr>\n"
+                     if appointment else ""),
+        notes=html.escape(inputs["notes"]),
+    ).encode()
+
+def document_key(kind: str, inputs: dict) -> str:
+    payload = orjson.dumps({"template": TEMPLATE_VERSION, "kind": kind, "inputs": inputs}, option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(payload).hexdigest()
+
+INPUTS = {"prescription": prescription_inputs, "emr": emr_inputs}
+
+def document_response(db: Session, kind: str, record_id: int, if_none_match: str = None) -> Response:
+    inputs = INPUTS[kind](db, record_id)
+    key = document_key(kind, inputs)
+    etag = f'"{key}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        document_requests.labels(kind=kind, result="not_modified").inc()
+        return Response(status_code=304, headers=headers)
+    started = time.perf_counter()
+    body = render(kind, inputs)
+    document_render_seconds.labels(kind=kind).observe(time.perf_counter() - started)
+    document_requests.labels(kind=kind, result="rendered").inc()
+    return Response(content=body, media_type="text/html; charset=utf-8", headers=headers)
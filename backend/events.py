@@ -0,0 +1,140 @@
+import asyncio
+import itertools
+import threading
+from datetime import datetime, timezone
+
+import orjson
+from database import current_tenant
+
+# In-process pub/sub for record changes. The crud write paths publish from
+# worker threads; subscribers are asyncio queues owned by streaming
+# endpoints, so delivery hops onto the subscriber's loop with
+# call_soon_threadsafe. A slow consumer loses its oldest events rather than
+# blocking writers. Events are stamped with the clinic they belong to and
+# only reach subscribers of that clinic.
+
+QUEUE_SIZE = 256
+HEARTBEAT_SECONDS = 15
+
+class Subscription:
+    def __init__(self, loop, predicate, queue_size: int = QUEUE_SIZE):
+        self.loop = loop
+        self.predicate = predicate
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def _offer(self, event: dict):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout: float = None):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+class EventBus:
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def subscribe(self, predicate=None) -> Subscription:
+        subscription = Subscription(asyncio.get_running_loop(), predicate or (lambda event: True))
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def close(self):
+        # Ends every open stream, e.g. when the server starts draining
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.loop.call_soon_threadsafe(subscription._offer, None)
+
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, entity: str, action: str, record_id: int, **fields) -> dict:
+        event = {
+            "id": next(self._ids),
+            "entity": entity,
+            "action": action,
+            "record_id": record_id,
+            "tenant": current_tenant.get(),
+            "at": datetime.now(timezone.utc),
+            **fields,
+        }
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            if not subscription.predicate(event):
+                continue
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._offer, event)
+            except RuntimeError:
+                # The subscriber's loop has shut down
+                self.unsubscribe(subscription)
+        return event
+
+bus = EventBus()
+
+# ------------------ RECORD EVENTS ------------------
+def _status(value):
+    return getattr(value, "value", value)
+
+def appointment_changed(action: str, appt, previous_status=None):
+    bus.publish(
+        "appointment", action, appt.appointment_id,
+        patient_id=appt.patient_id,
+        doctor_id=appt.doctor_id,
+        appointment_date=appt.appointment_date,
+        status=_status(appt.status),
+        previous_status=_status(previous_status),
+    )
+
+def lab_test_changed(action: str, test, previous_status=None):
+    bus.publish(
+        "lab_test", action, test.test_id,
+        patient_id=test.patient_id,
+        test_type=test.test_type,
+        status=_status(test.status),
+        previous_status=_status(previous_status),
+    )
+
+# ------------------ SERVER-SENT EVENTS ------------------
+def visible_to(role: str, user_id: int, entities=None, tenant: str = None):
+    # Patients see changes to their own records, doctors the appointments
+    # they are booked on plus lab tests, admins everything in their clinic.
+    tenant = tenant or current_tenant.get()
+    def predicate(event: dict) -> bool:
+        if event["tenant"] != tenant:
+            return False
+        if entities and event["entity"] not in entities:
+            return False
+        if role == "Admin":
+            return True
+        if role == "Doctor":
+            return event.get("doctor_id") == user_id or event["entity"] == "lab_test"
+        return event.get("patient_id") == user_id
+    return predicate
+
+async def sse_stream(request, subscription: Subscription):
+    try:
+        yield b"retry: 5000\n\n"
+        while not await request.is_disconnected():
+            try:
+                event = await subscription.get(timeout=HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield b": keep-alive\n\n"
+                continue
+            if event is None:
+                break
+            yield b"id: %d\nevent: %s\ndata: %s\n\n" % (
+                event["id"], event["entity"].encode(), orjson.dumps(event)
+            )
+    finally:
+        bus.unsubscribe(subscription)
@@ -0,0 +1,72 @@
+from typing import Optional
+
+from fastapi import Query, HTTPException
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+import archive, listing
+
+# `?expand=patient,doctor,appointment` for the dict read path. The names are
+# the models' relationship() attributes; related rows are fetched the way
+# selectinload() does it, with one `IN (...)` query per related model (plus
+# one against its archive for IDs that have moved there), however many rows
+# the page holds. Relationships that point at the same model, such as patient
+# and doctor, share that query. Each expanded row gains a nested summary next
+# to its foreign key, or null when the referenced row no longer exists.
+
+class Expansion:
+    def __init__(self, relations=()):
+        # (attribute name, foreign key column name, target model, target key column name, summary schema)
+        self.relations = list(relations)
+
+    def __bool__(self):
+        return bool(self.relations)
+
+    def fields(self, fields: Optional[list[str]]) -> Optional[list[str]]:
+        # ?fields= may leave out the foreign keys the expansion needs
+        if fields is None or not self.relations:
+            return fields
+        return fields + [local for _, local, _, _, _ in self.relations if local not in fields]
+
+    def apply(self, db: Session, rows: list[dict]) -> list[dict]:
+        if not self.relations or not rows:
+            return rows
+        wanted = {}
+        for _, local, target, remote, summary in self.relations:
+            ids = wanted.setdefault((target, remote, summary), set())
+            ids.update(row[local] for row in rows if row.get(local) is not None)
+        found = {key: self._load(db, *key, ids) for key, ids in wanted.items()}
+        for name, local, target, remote, summary in self.relations:
+            related = found[(target, remote, summary)]
+            for row in rows:
+                row[name] = related.get(row.get(local))
+        return rows
+
+    def _load(self, db: Session, target, remote: str, summary, ids: set) -> dict:
+        if not ids:
+            return {}
+        related = {row[remote]: row for row in listing.select_rows(db, target, summary, target.__table__.c[remote].in_(ids))}
+        missing = ids - related.keys()
+        if missing and target in archive.ARCHIVES:
+            cold = archive.ARCHIVES[target]
+            related.update((row[remote], row) for row in
+                           listing.select_rows(db, cold, summary, cold.__table__.c[remote].in_(missing)))
+        return related
+
+def expand_param(model, summaries: dict):
+    # `summaries` maps each expandable relationship name to its summary schema
+    relationships = inspect(model).relationships
+
+    def parse_expand(expand: Optional[str] = Query(None, description=f"Comma-separated: {', '.join(summaries)}")):
+        if expand is None:
+            return Expansion()
+        names = list(dict.fromkeys(name.strip() for name in expand.split(",") if name.strip()))
+        unknown = [name for name in names if name not in summaries]
+        if unknown or not names:
+            raise HTTPException(status_code=400,
+                                detail=f"Cannot expand {', '.join(unknown) or expand!r}. Allowed: {', '.join(summaries)}")
+        relations = []
+        for name in names:
+            (local, remote), = relationships[name].local_remote_pairs
+            relations.append((name, local.name, relationships[name].mapper.class_, remote.name, summaries[name]))
+        return Expansion(relations)
+    return parse_expand
@@ -0,0 +1,159 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from prometheus_client import Counter, Histogram
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+from database import current_tenant, shards
+
+# Optional group commit for small inserts (GROUP_COMMIT=1). On SQLite every
+# commit is a trip through the single write lock plus an fsync, so a burst of
+# creates is capped by commits per second, not by work. With group commit the
+# request thread hands its new row to one writer thread and waits; the writer
+# collects whatever arrives within GROUP_COMMIT_WINDOW (up to MAX_BATCH),
+# flushes them together and commits the lot once per clinic. If the group's
+# flush fails, rows are retried under one SAVEPOINT each, so a bad row (say
+# an integrity error) fails only its own caller; if the commit itself fails,
+# every caller of that group gets the error. Post-commit hooks stay in crud
+# and run in the request thread after `add()` returns.
+
+GROUP_COMMIT = os.getenv("GROUP_COMMIT", "0") == "1"
+GROUP_COMMIT_WINDOW = float(os.getenv("GROUP_COMMIT_WINDOW", "0.002"))
+MAX_BATCH = 128
+
+logger = logging.getLogger("group_commit")
+
+group_commit_batch_size = Histogram(
+    "group_commit_batch_size", "Rows committed per group commit", buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+group_commit_seconds = Histogram("group_commit_seconds", "Time to write and commit one group")
+group_commit_rows = Counter("group_commit_rows_total", "Rows handed to the group-commit writer by outcome", ["outcome"])
+
+class GroupCommitter:
+    def __init__(self, engine_for=shards.get, window: float = GROUP_COMMIT_WINDOW, max_batch: int = MAX_BATCH):
+        self.engine_for = engine_for
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        # Rows already queued are still committed before the thread exits
+        self._stopping.set()
+        self.queue.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def add(self, obj):
+        # Blocks until `obj` is committed, then returns it detached with its
+        # columns loaded; raises whatever its insert or the commit raised.
+        future = Future()
+        self.start()
+        self.queue.put((current_tenant.get(), obj, future))
+        return future.result()
+
+    def _collect(self, first) -> list:
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._stopping.set()
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return
+                continue
+            if item is None:
+                if self._stopping.is_set() and self.queue.empty():
+                    return
+                continue
+            batch = self._collect(item)
+            by_tenant = {}
+            for tenant, obj, future in batch:
+                by_tenant.setdefault(tenant, []).append((obj, future))
+            for tenant, items in by_tenant.items():
+                self._commit(tenant, items)
+
+    def _write(self, db: Session, items: list) -> list:
+        # The whole group goes in one flush; if that fails, rows are retried
+        # one SAVEPOINT each so only the failing rows' callers get the error
+        try:
+            with db.begin_nested():
+                db.add_all(obj for obj, _ in items)
+                db.flush()
+            return items
+        except Exception:
+            pass
+        written = []
+        for obj, future in items:
+            try:
+                with db.begin_nested():
+                    db.add(obj)
+                    db.flush()
+            except Exception as exc:
+                group_commit_rows.labels(outcome="error").inc()
+                future.set_exception(exc)
+                continue
+            written.append((obj, future))
+        return written
+
+    def _reload(self, db: Session, objs: list):
+        # Server defaults (timestamps) with one SELECT per model, not a
+        # refresh() per row
+        by_model = {}
+        for obj in objs:
+            by_model.setdefault(type(obj), []).append(obj)
+        for model, rows in by_model.items():
+            key = inspect(model).primary_key[0]
+            ids = [getattr(row, key.key) for row in rows]
+            db.query(model).filter(key.in_(ids)).populate_existing().all()
+
+    def _commit(self, tenant: str, items: list):
+        started = time.perf_counter()
+        try:
+            with Session(bind=self.engine_for(tenant), expire_on_commit=False) as db:
+                # An explicit BEGIN keeps the driver from committing when the
+                # outermost SAVEPOINT is released
+                db.connection().exec_driver_sql("BEGIN IMMEDIATE")
+                done = self._write(db, items)
+                self._reload(db, [obj for obj, _ in done])
+                db.commit()
+        except Exception as exc:
+            logger.exception("Group commit of %d rows for clinic %r failed", len(items), tenant)
+            for _, future in items:
+                if not future.done():
+                    group_commit_rows.labels(outcome="error").inc()
+                    future.set_exception(exc)
+            return
+        group_commit_batch_size.observe(len(done))
+        group_commit_seconds.observe(time.perf_counter() - started)
+        for obj, future in done:
+            group_commit_rows.labels(outcome="committed").inc()
+            future.set_result(obj)
+
+committer = GroupCommitter() if GROUP_COMMIT else None
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+
+from prometheus_client import Gauge
+import migrations, events
+from database import engine
+
+# Liveness, readiness and graceful drain. /healthz only says the process and
+# its event loop are up. /readyz says whether this instance should get
+# traffic: it fails while draining, when the default database's connection
+# pool is nearly exhausted, or when a timed probe (a read of the schema
+# version, so the file itself is touched) errors or is slower than
+# READY_DB_LATENCY. On SIGTERM the instance flips to draining before the
+# server's own shutdown starts: readiness fails, requests still arriving on
+# open keep-alive connections get 503 with `Connection: close`, and live
+# event streams are ended so they do not hold the shutdown open. Requests
+# already running finish; lifespan shutdown waits up to DRAIN_TIMEOUT for
+# them before stopping the background writers. Run uvicorn with
+# `--timeout-graceful-shutdown` no longer than the orchestrator's stop grace.
+
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "25"))
+READY_DB_LATENCY = float(os.getenv("READY_DB_LATENCY", "0.5"))
+# Readiness fails once this share of the pool's connections is checked out
+POOL_SATURATION_LIMIT = 0.9
+PROBE_PATHS = {"/healthz", "/readyz"}
+
+logger = logging.getLogger("health")
+
+class DrainState:
+    def __init__(self):
+        self.draining = False
+        self.in_flight = 0
+
+    def begin(self):
+        if not self.draining:
+            self.draining = True
+            logger.info("Draining: %d requests in flight", self.in_flight)
+            events.bus.close()
+
+state = DrainState()
+
+http_in_flight = Gauge("http_requests_in_flight", "HTTP requests being handled")
+http_in_flight.set_function(lambda: state.in_flight)
+db_probe_seconds = Gauge("readiness_db_probe_seconds", "Latency of the last readiness database probe")
+
+# ------------------ SIGNALS ------------------
+def install_signal_handler():
+    # Chained in front of the server's own handler, which still runs and
+    # starts the shutdown; only possible from the main thread
+    try:
+        previous = signal.getsignal(signal.SIGTERM)
+
+        def on_sigterm(signum, frame):
+            state.begin()
+            if callable(previous):
+                previous(signum, frame)
+            elif previous == signal.SIG_DFL:
+                raise SystemExit(128 + signum)
+
+        signal.signal(signal.SIGTERM, on_sigterm)
+    except ValueError:
+        logger.warning("Not in the main thread, SIGTERM will not start a drain")
+
+async def wait_for_drain(timeout: float = DRAIN_TIMEOUT) -> bool:
+    deadline = time.monotonic() + timeout
+    while state.in_flight and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    if state.in_flight:
+        logger.warning("Drain deadline passed with %d requests still in flight", state.in_flight)
+    return not state.in_flight
+
+# ------------------ MIDDLEWARE ------------------
+class DrainMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if state.draining and scope["path"] not in PROBE_PATHS:
+            body = json.dumps({"detail": "Server is shutting down, retry"}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                            (b"retry-after", b"1"), (b"connection", b"close")],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+        state.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            state.in_flight -= 1
+
+# ------------------ CHECKS ------------------
+def pool_check(db_engine=engine) -> dict:
+    pool = db_engine.pool
+    capacity = pool.size() + max(getattr(pool, "_max_overflow", 0), 0)
+    checked_out = pool.checkedout()
+    return {
+        "checked_out": checked_out,
+        "capacity": capacity,
+        "ok": checked_out < capacity * POOL_SATURATION_LIMIT,
+    }
+
+def database_check(db_engine=engine) -> dict:
+    started = time.perf_counter()
+    try:
+        migrations.current_version(db_engine)
+    except Exception as exc:
+        return {"ok": False, "error": str(exc)}
+    latency = time.perf_counter() - started
+    db_probe_seconds.set(latency)
+    return {"ok": latency <= READY_DB_LATENCY, "latency_ms": round(latency * 1000, 2)}
+
+def readiness() -> tuple[bool, dict]:
+    if state.draining:
+        return False, {"status": "draining", "in_flight": state.in_flight}
+    checks = {"pool": pool_check()}
+    # A saturated pool would make the probe itself wait for a connection
+    checks["database"] = database_check() if checks["pool"]["ok"] else {"ok": False, "skipped": "pool saturated"}
+    ready = all(check["ok"] for check in checks.values())
+    return ready, {"status": "ready" if ready else "not_ready", "in_flight": state.in_flight, "checks": checks}
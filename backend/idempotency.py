@@ -0,0 +1,169 @@
+import asyncio
+import hashlib
+import json
+import time
+
+from prometheus_client import Counter
+
+# Idempotency-Key support for retried creates. The first request with a key
+# runs normally and its response is stored; replays with the same key and
+# body get the stored response without reaching the handler, and concurrent
+# duplicates wait for the first one to finish instead of racing it.
+
+IDEMPOTENT_ROUTES = {("POST", "/payments/"), ("POST", "/appointments/")}
+KEY_TTL_SECONDS = 24 * 60 * 60
+WAIT_TIMEOUT_SECONDS = 30
+MAX_KEY_LENGTH = 255
+
+idempotent_requests = Counter(
+    "idempotent_requests_total",
+    "Requests carrying an Idempotency-Key, by outcome",
+    ["route", "outcome"],
+)
+
+# ------------------ KEY STORE ------------------
+class _Entry:
+    __slots__ = ("fingerprint", "expires_at", "done", "response")
+
+    def __init__(self, fingerprint: str, expires_at: float):
+        self.fingerprint = fingerprint
+        self.expires_at = expires_at
+        self.done = asyncio.Event()
+        self.response = None
+
+class IdempotencyStore:
+    # Every entry gets the same TTL, so dict insertion order is also expiry
+    # order and eviction only ever pops from the front.
+    def __init__(self, ttl: float = KEY_TTL_SECONDS, max_entries: int = 50_000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self, now: float):
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            expired = entry.expires_at <= now and entry.done.is_set()
+            if not expired and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[key]
+
+    def get(self, key):
+        self._evict(time.monotonic())
+        return self._entries.get(key)
+
+    def begin(self, key, fingerprint: str) -> _Entry:
+        entry = _Entry(fingerprint, time.monotonic() + self.ttl)
+        self._entries[key] = entry
+        return entry
+
+    def finish(self, key, entry: _Entry, response):
+        if response is None:
+            self._entries.pop(key, None)
+        else:
+            entry.response = response
+        entry.done.set()
+
+# ------------------ MIDDLEWARE ------------------
+class IdempotencyMiddleware:
+    def __init__(self, app, routes=None, store: IdempotencyStore = None):
+        self.app = app
+        self.routes = IDEMPOTENT_ROUTES if routes is None else routes
+        self.store = store or IdempotencyStore()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (scope["method"], scope["path"]) not in self.routes:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        raw_key = headers.get(b"idempotency-key")
+        if raw_key is None:
+            await self.app(scope, receive, send)
+            return
+
+        route = scope["path"]
+        if not raw_key.strip() or len(raw_key) > MAX_KEY_LENGTH:
+            await self._send_json(send, 400, {"detail": f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters"})
+            return
+
+        body = await self._read_body(receive)
+        # Keys are scoped to the caller's credentials and clinic so clients cannot collide
+        caller = hashlib.sha256(headers.get(b"authorization", b"") + b"\0" + headers.get(b"x-clinic-id", b"")).hexdigest()
+        key = (caller, scope["method"], route, raw_key)
+        fingerprint = hashlib.sha256(body).hexdigest()
+
+        deadline = time.monotonic() + WAIT_TIMEOUT_SECONDS
+        while True:
+            entry = self.store.get(key)
+            if entry is None:
+                break
+            if entry.fingerprint != fingerprint:
+                idempotent_requests.labels(route=route, outcome="mismatch").inc()
+                await self._send_json(send, 422, {"detail": "Idempotency-Key was already used with a different request body"})
+                return
+            if entry.done.is_set():
+                idempotent_requests.labels(route=route, outcome="replayed").inc()
+                await self._replay(send, entry.response)
+                return
+            try:
+                await asyncio.wait_for(entry.done.wait(), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                idempotent_requests.labels(route=route, outcome="conflict").inc()
+                await self._send_json(send, 409, {"detail": "A request with this Idempotency-Key is still in progress"})
+                return
+            # The first request either stored a response or failed and released the key
+
+        entry = self.store.begin(key, fingerprint)
+        captured = {"status": None, "headers": [], "body": []}
+
+        async def replay_body():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                captured["status"] = message["status"]
+                captured["headers"] = list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                captured["body"].append(message.get("body", b""))
+            await send(message)
+
+        response = None
+        try:
+            await self.app(scope, replay_body, capture)
+            status = captured["status"]
+            # Server errors, throttling and conflicts are worth retrying for real
+            if status is not None and status < 500 and status not in (409, 429):
+                response = (status, captured["headers"], b"".join(captured["body"]))
+        finally:
+            self.store.finish(key, entry, response)
+        idempotent_requests.labels(route=route, outcome="executed").inc()
+
+    async def _read_body(self, receive) -> bytes:
+        chunks, more = [], True
+        while more:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            chunks.append(message.get("body", b""))
+            more = message.get("more_body", False)
+        return b"".join(chunks)
+
+    async def _replay(self, send, response):
+        status, headers, body = response
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": headers + [(b"idempotent-replayed", b"true")],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def _send_json(self, send, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,271 @@
+import csv
+import json
+import os
+import time
+from collections import namedtuple, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Optional
+
+import bleach
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+import models, schemas, crud
+
+# Bulk import of legacy CSV / JSONL exports, one entity per file. Chunks of
+# rows are validated with the same `schemas.*Create` models the API uses (and
+# user passwords hashed) in worker processes; the main process then maps
+# legacy foreign keys to new IDs and inserts each chunk with one executemany
+# in its own transaction. Every imported row's legacy ID is recorded in
+# `legacy_ids` in that same transaction, which lets later files resolve
+# references to it and makes re-running a file skip rows already imported.
+# A JSON checkpoint next to the input remembers how far the file got; a
+# shared checkpoint given for several inputs keeps one entry per input path.
+
+CHUNK_SIZE = 1000
+PROGRESS_EVERY = 5.0
+
+Entity = namedtuple("Entity", ["model", "schema", "references", "clean", "timestamps"])
+
+ENTITIES = {
+    "users": Entity(models.User, schemas.UserCreate, {}, (), ("created_at",)),
+    "appointments": Entity(models.Appointment, schemas.AppointmentCreate,
+                           {"patient_id": "users", "doctor_id": "users"}, (), ()),
+    "prescriptions": Entity(models.Prescription, schemas.PrescriptionCreate,
+                            {"appointment_id": "appointments", "doctor_id": "users", "patient_id": "users"},
+                            ("notes",), ("prescribed_on",)),
+    "inventory": Entity(models.Inventory, schemas.InventoryCreate, {}, ("description",), ()),
+    "payments": Entity(models.Payment, schemas.PaymentCreate, {"user_id": "users"}, (), ("transaction_date",)),
+    "lab_tests": Entity(models.LabTest, schemas.LabTestCreate, {"patient_id": "users"}, ("result",), ("date_requested",)),
+    "emr": Entity(models.EMR, schemas.EMRCreate, {"patient_id": "users", "doctor_id": "users"}, ("summary",), ("created_on",)),
+}
+
+_timestamp = TypeAdapter(Optional[datetime])
+
+# ------------------ READING ------------------
+def read_records(path: str, fmt: str = None):
+    # Yields (record number, dict) with empty CSV cells as None
+    fmt = fmt or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    with open(path, newline="", encoding="utf-8") as handle:
+        if fmt == "csv":
+            for number, row in enumerate(csv.DictReader(handle), 1):
+                yield number, {key.strip(): (value if value != "" else None) for key, value in row.items() if key}
+        else:
+            number = 0
+            for line in handle:
+                if line.strip():
+                    number += 1
+                    yield number, json.loads(line)
+
+def _chunks(records, size: int):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# ------------------ VALIDATION (WORKERS) ------------------
+def prepare_chunk(kind: str, id_field: str, records: list) -> tuple[list, list]:
+    # Runs in a worker process. Reference fields hold legacy IDs, which the
+    # schema cannot check, so they are set aside and validated as 0.
+    entity = ENTITIES[kind]
+    ready, rejected = [], []
+    for number, raw in records:
+        try:
+            legacy_id = raw.get(id_field)
+            # Missing values fall back to the schema defaults, as in the API
+            data = {name: value for name, value in raw.items()
+                    if name in entity.schema.model_fields and value is not None}
+            refs = {name: data.get(name) for name in entity.references}
+            data.update({name: 0 for name in entity.references})
+            values = entity.schema(**data).dict()
+            for name, legacy in refs.items():
+                values[name] = None if legacy is None else str(legacy)
+            for name in entity.clean:
+                values[name] = bleach.clean(values[name]) if values.get(name) else None
+            for name in entity.timestamps:
+                if raw.get(name) is not None:
+                    values[name] = _timestamp.validate_python(raw[name])
+            if kind == "users":
+                values["password_hash"] = crud.hash_password(values.pop("password"))
+            ready.append((number, None if legacy_id is None else str(legacy_id), values))
+        except (ValidationError, ValueError, TypeError) as exc:
+            rejected.append((number, str(exc), raw))
+    return ready, rejected
+
+# ------------------ CHECKPOINTS ------------------
+def load_checkpoint(path: str) -> dict:
+    # {absolute input path: state}
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as handle:
+        checkpoints = json.load(handle)
+    if "path" in checkpoints:
+        # Single-input checkpoint written by an older version
+        checkpoints = {os.path.abspath(checkpoints["path"]): checkpoints}
+    return checkpoints
+
+def save_checkpoint(path: str, state: dict):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as handle:
+        json.dump(state, handle, indent=2)
+    os.replace(tmp, path)
+
+# ------------------ IMPORT ------------------
+class Importer:
+    def __init__(self, engine: Engine, kind: str, path: str, id_field: str = "id", chunk_size: int = CHUNK_SIZE,
+                 workers: int = None, checkpoint: str = None, fmt: str = None, log=print):
+        if kind not in ENTITIES:
+            raise ValueError(f"Unknown entity {kind!r}, expected one of: {', '.join(ENTITIES)}")
+        self.engine = engine
+        self.kind = kind
+        self.entity = ENTITIES[kind]
+        self.path = path
+        self.fmt = fmt
+        self.id_field = id_field
+        self.chunk_size = chunk_size
+        self.workers = os.cpu_count() if workers is None else workers
+        self.checkpoint_path = checkpoint or f"{path}.checkpoint.json"
+        self.checkpoint_key = os.path.abspath(path)
+        self.rejects_path = f"{path}.rejects.jsonl"
+        self.log = log
+        self.id_maps = {}
+
+    def _id_map(self, entity: str) -> dict:
+        if entity not in self.id_maps:
+            with self.engine.connect() as conn:
+                rows = conn.execute(
+                    select(models.LegacyId.legacy_id, models.LegacyId.new_id).where(models.LegacyId.entity == entity)
+                )
+                self.id_maps[entity] = dict(rows.all())
+        return self.id_maps[entity]
+
+    def _resolve(self, ready: list, rejected: list) -> tuple[list, int]:
+        own = self._id_map(self.kind)
+        rows, skipped = [], 0
+        for number, legacy_id, values in ready:
+            if legacy_id is not None and legacy_id in own:
+                skipped += 1  # imported by an earlier run, or a duplicate legacy ID
+                continue
+            resolved, missing = dict(values), []
+            for name, entity in self.entity.references.items():
+                if values[name] is None:
+                    continue
+                resolved[name] = self._id_map(entity).get(values[name])
+                if resolved[name] is None:
+                    missing.append(f"{name}={values[name]} not found in imported {entity}")
+            if missing:
+                rejected.append((number, "; ".join(missing), values))
+            else:
+                rows.append((number, legacy_id, resolved))
+        return rows, skipped
+
+    def _insert(self, conn, rows: list) -> list:
+        table = self.entity.model.__table__
+        pk = table.primary_key.columns.values()[0]
+        # executemany needs one column set per statement; optional timestamp
+        # columns left out fall back to the server default
+        groups = {}
+        for row in rows:
+            groups.setdefault(frozenset(row[2]), []).append(row)
+        mapped = []
+        for group in groups.values():
+            new_ids = conn.execute(
+                insert(table).returning(pk, sort_by_parameter_order=True), [values for _, _, values in group]
+            ).scalars().all()
+            mapped.extend({"entity": self.kind, "legacy_id": legacy_id, "new_id": new_id}
+                          for (_, legacy_id, _), new_id in zip(group, new_ids) if legacy_id is not None)
+        if mapped:
+            conn.execute(insert(models.LegacyId), mapped)
+        return mapped
+
+    def _store(self, rows: list, rejected: list) -> int:
+        if not rows:
+            return 0
+        try:
+            with self.engine.begin() as conn:
+                mapped = self._insert(conn, rows)
+        except IntegrityError:
+            # Isolate the offending rows (duplicate emails, reused legacy IDs)
+            mapped = []
+            for row in rows:
+                try:
+                    with self.engine.begin() as conn:
+                        mapped.extend(self._insert(conn, [row]))
+                except IntegrityError as exc:
+                    rejected.append((row[0], str(exc.orig), row[2]))
+            rows = [row for row in rows if row[0] not in {number for number, _, _ in rejected}]
+        own = self._id_map(self.kind)
+        own.update((entry["legacy_id"], entry["new_id"]) for entry in mapped)
+        return len(rows)
+
+    def _prepared(self, chunks, pool):
+        # Keeps a bounded number of chunks in flight, in input order
+        if pool is None:
+            for chunk in chunks:
+                yield prepare_chunk(self.kind, self.id_field, chunk)
+            return
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(prepare_chunk, self.kind, self.id_field, chunk))
+            if len(pending) >= self.workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def run(self, restart: bool = False) -> dict:
+        checkpoints = load_checkpoint(self.checkpoint_path)
+        state = {} if restart else checkpoints.get(self.checkpoint_key, {})
+        if restart and os.path.exists(self.rejects_path):
+            os.remove(self.rejects_path)
+        if state.get("done"):
+            self.log(f"{self.path} was already imported ({state['imported']} rows); use --restart to run it again")
+            return state
+        state = {"kind": self.kind, "path": self.path, "record": state.get("record", 0),
+                 "imported": state.get("imported", 0), "skipped": state.get("skipped", 0),
+                 "rejected": state.get("rejected", 0), "done": False}
+        if state["record"]:
+            self.log(f"Resuming {self.path} after record {state['record']}")
+
+        skip = state["record"]
+        records = ((number, raw) for number, raw in read_records(self.path, self.fmt) if number > skip)
+        started = last_report = time.perf_counter()
+        imported_now = 0
+        pool = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        try:
+            for ready, rejected in self._prepared(_chunks(records, self.chunk_size), pool):
+                last = max([r[0] for r in ready] + [r[0] for r in rejected])
+                rows, skipped = self._resolve(ready, rejected)
+                stored = self._store(rows, rejected)
+                if rejected:
+                    with open(self.rejects_path, "a", encoding="utf-8") as rejects:
+                        for number, error, raw in rejected:
+                            rejects.write(json.dumps({"record": number, "error": error, "row": raw}, default=str) + "\n")
+                imported_now += stored
+                state.update(record=last, imported=state["imported"] + stored,
+                             skipped=state["skipped"] + skipped, rejected=state["rejected"] + len(rejected))
+                checkpoints[self.checkpoint_key] = state
+                save_checkpoint(self.checkpoint_path, checkpoints)
+                now = time.perf_counter()
+                if now - last_report >= PROGRESS_EVERY:
+                    last_report = now
+                    self.log(f"  record {last:>9}  imported {state['imported']:>9}  "
+                             f"rejected {state['rejected']:>6}  {imported_now / (now - started):,.0f} rows/s")
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        elapsed = time.perf_counter() - started
+        state["done"] = True
+        checkpoints[self.checkpoint_key] = state
+        save_checkpoint(self.checkpoint_path, checkpoints)
+        rate = imported_now / elapsed if elapsed else 0.0
+        self.log(f"Imported {imported_now} {self.kind} in {elapsed:.1f}s ({rate:,.0f} rows/s), "
+                 f"{state['skipped']} already imported, {state['rejected']} rejected"
+                 + (f", see {self.rejects_path}" if state["rejected"] else ""))
+        return state
@@ -0,0 +1,200 @@
+import json
+import logging
+import os
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+
+import bleach
+from prometheus_client import Counter, Histogram
+from pydantic import ValidationError
+from sqlalchemy import bindparam, select, update
+import models, schemas, change_feed, importer
+from database import current_tenant, shards
+
+# Streams analyzer result files into pending lab tests. Each file flows
+# through a chain of generators, one row at a time: parse (CSV or JSONL),
+# validate against schemas.LabResultIn, sanitize the result text, then group
+# into batches. Each batch is matched to Pending lab tests with one indexed
+# query, oldest request first per (patient, test type) or by test_id when the
+# analyzer sends one, and completed with one executemany UPDATE in the same
+# transaction, together with change_feed rows from which the API publishes
+# the completions to live streams and metrics. Rows that fail validation or
+# find no pending test go to a dead-letter file with the reason. `watch()`
+# polls an inbox directory per clinic and moves each file to processed/ once
+# it is done.
+
+BATCH_SIZE = 500
+INBOX_DIR = "lab-inbox"
+POLL_SECONDS = 5.0
+# Files younger than this may still be being written by the analyzer
+SETTLE_SECONDS = 2.0
+RESULT_FILES = (".csv", ".jsonl")
+
+logger = logging.getLogger("lab_ingest")
+
+ingest_rows = Counter("lab_ingest_rows_total", "Lab result rows by outcome", ["outcome"])
+ingest_files = Counter("lab_ingest_files_total", "Lab result files processed")
+ingest_batch_seconds = Histogram("lab_ingest_batch_seconds", "Time to match and apply one batch of lab results")
+
+# ------------------ GENERATOR CHAIN ------------------
+def parse(path: str):
+    yield from importer.read_records(path)
+
+def validate(records, dead_letter):
+    for number, raw in records:
+        try:
+            yield number, schemas.LabResultIn(**raw)
+        except (ValidationError, TypeError) as exc:
+            dead_letter(number, raw, f"invalid: {exc.errors()[0]['msg'] if isinstance(exc, ValidationError) else exc}")
+
+def sanitize(rows):
+    for number, row in rows:
+        yield number, row.model_copy(update={"result": bleach.clean(row.result).strip()})
+
+def batched(rows, size: int):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# ------------------ MATCH AND APPLY ------------------
+def _match(conn, batch: list) -> tuple[list, list]:
+    # Pending tests of the batch's patients, oldest first, keyed like the rows
+    patient_ids = {row.patient_id for _, row in batch}
+    pending = conn.execute(
+        select(models.LabTest.test_id, models.LabTest.patient_id, models.LabTest.test_type)
+        .where(models.LabTest.patient_id.in_(patient_ids), models.LabTest.status == models.LabTestStatusEnum.Pending)
+        .order_by(models.LabTest.test_id)
+    ).all()
+    queues, by_id = defaultdict(deque), {}
+    for test in pending:
+        queues[(test.patient_id, test.test_type.casefold())].append(test.test_id)
+        by_id[test.test_id] = test
+    matched, unmatched, taken = [], [], set()
+    for number, row in batch:
+        test_id = None
+        if row.test_id is not None:
+            test = by_id.get(row.test_id)
+            if test is not None and test.patient_id == row.patient_id and row.test_id not in taken:
+                test_id = row.test_id
+        else:
+            queue = queues[(row.patient_id, row.test_type.casefold())]
+            while queue and queue[0] in taken:
+                queue.popleft()
+            if queue:
+                test_id = queue.popleft()
+        if test_id is None:
+            unmatched.append((number, row))
+        else:
+            taken.add(test_id)
+            matched.append((number, row, by_id[test_id]))
+    return matched, unmatched
+
+def apply_batch(engine, batch: list) -> tuple[list, list]:
+    table = models.LabTest.__table__
+    stmt = (
+        update(table)
+        .where(table.c.test_id == bindparam("b_id"), table.c.status == models.LabTestStatusEnum.Pending.value)
+        .values(result=bindparam("b_result"), status=models.LabTestStatusEnum.Completed.value)
+    )
+    with engine.begin() as conn:
+        matched, unmatched = _match(conn, batch)
+        if matched:
+            conn.execute(stmt, [{"b_id": test.test_id, "b_result": row.result} for _, row, test in matched])
+            change_feed.record(conn, "lab_test", "updated", [
+                {"record_id": test.test_id, "patient_id": test.patient_id, "test_type": test.test_type,
+                 "status": models.LabTestStatusEnum.Completed.value,
+                 "previous_status": models.LabTestStatusEnum.Pending.value}
+                for _, _, test in matched
+            ])
+    return matched, unmatched
+
+# ------------------ FILES ------------------
+class DeadLetter:
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self._handle = None
+
+    def __call__(self, number: int, row, reason: str):
+        if self._handle is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._handle = open(self.path, "a", encoding="utf-8")
+        payload = row.model_dump() if hasattr(row, "model_dump") else row
+        self._handle.write(json.dumps({"record": number, "reason": reason, "row": payload}, default=str) + "\n")
+        self.count += 1
+        ingest_rows.labels(outcome=reason.split(":")[0]).inc()
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+
+def ingest_file(path: str, tenant: str, dead_letter_path: str = None, batch_size: int = BATCH_SIZE, log=print) -> dict:
+    engine = shards.get(tenant)
+    dead_letter = DeadLetter(dead_letter_path or f"{path}.dead-letter.jsonl")
+    totals = {"completed": 0, "dead_letter": 0}
+    token = current_tenant.set(tenant)
+    started = time.perf_counter()
+    try:
+        rows = sanitize(validate(parse(path), dead_letter))
+        for batch in batched(rows, batch_size):
+            batch_started = time.perf_counter()
+            matched, unmatched = apply_batch(engine, batch)
+            ingest_batch_seconds.observe(time.perf_counter() - batch_started)
+            for number, row in unmatched:
+                dead_letter(number, row, "unmatched: no pending lab test for this patient and test type")
+            ingest_rows.labels(outcome="completed").inc(len(matched))
+            totals["completed"] += len(matched)
+    finally:
+        current_tenant.reset(token)
+        dead_letter.close()
+    totals["dead_letter"] = dead_letter.count
+    ingest_files.inc()
+    log(f"[{tenant}] {path}: completed {totals['completed']} lab tests in {time.perf_counter() - started:.2f}s"
+        + (f", {dead_letter.count} rows dead-lettered to {dead_letter.path}" if dead_letter.count else ""))
+    return totals
+
+# ------------------ INBOX ------------------
+def inbox_dir(tenant: str) -> str:
+    return os.path.join(INBOX_DIR, tenant)
+
+def ready_files(tenant: str) -> list[str]:
+    directory = inbox_dir(tenant)
+    if not os.path.isdir(directory):
+        return []
+    now = time.time()
+    paths = [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith(RESULT_FILES)]
+    return [path for path in paths if os.path.isfile(path) and now - os.path.getmtime(path) >= SETTLE_SECONDS]
+
+def process_inbox(tenant: str, batch_size: int = BATCH_SIZE, log=print) -> int:
+    processed = 0
+    for path in ready_files(tenant):
+        name = os.path.basename(path)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        dead_letter_path = os.path.join(inbox_dir(tenant), "dead-letter", f"{stamp}-{os.path.splitext(name)[0]}.jsonl")
+        try:
+            ingest_file(path, tenant, dead_letter_path=dead_letter_path, batch_size=batch_size, log=log)
+            target = os.path.join(inbox_dir(tenant), "processed", f"{stamp}-{name}")
+        except Exception:
+            # Applied batches stay applied; a rerun only finds what is still pending
+            logger.exception("Ingesting %s failed", path)
+            target = os.path.join(inbox_dir(tenant), "failed", f"{stamp}-{name}")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+        processed += 1
+    return processed
+
+def watch(tenants, poll: float = POLL_SECONDS, batch_size: int = BATCH_SIZE, log=print):
+    # `tenants()` is re-read every round, so new clinics' inboxes are picked up
+    for tenant in tenants():
+        os.makedirs(inbox_dir(tenant), exist_ok=True)
+    log(f"Watching {INBOX_DIR}/<clinic>/ for {', '.join(RESULT_FILES)} files")
+    while True:
+        for tenant in tenants():
+            process_inbox(tenant, batch_size=batch_size, log=log)
+        time.sleep(poll)
@@ -0,0 +1,122 @@
+from collections import namedtuple
+from typing import Optional
+
+import orjson
+from fastapi import Response, Query, HTTPException
+from sqlalchemy import select, cast, type_coerce, func, Float, Integer, String, Text, Numeric, Enum
+from sqlalchemy.orm import Session
+
+# Read path for list endpoints: select only the columns of the `*Out` schema,
+# build plain dicts from the row tuples and encode them with orjson. This
+# skips ORM identity-map hydration and per-row Pydantic validation, which
+# dominate the cost of large list responses. `?fields=` narrows both the SQL
+# column list and the payload, so large Text columns are only read on demand.
+# Pagination, sorting and filtering are pushed into SQL as well; a paged
+# request reports the unpaged row count in X-Total-Count.
+
+MAX_PAGE_SIZE = 500
+
+Page = namedtuple("Page", ["skip", "limit", "order_by", "criteria"])
+
+class ORJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+def output_columns(model, schema, fields=None):
+    table = model.__table__
+    columns = []
+    for name in fields or schema.model_fields:
+        column = table.c[name]
+        if isinstance(column.type, Numeric):
+            # DECIMAL columns would otherwise round-trip through Decimal objects
+            column = cast(column, Float)
+        elif isinstance(column.type, Enum):
+            column = type_coerce(column, String)
+        columns.append(column.label(name))
+    return columns
+
+def fields_param(schema):
+    def parse_fields(fields: Optional[str] = Query(None, description="Comma-separated fields to return")):
+        if fields is None:
+            return None
+        names = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+        unknown = [name for name in names if name not in schema.model_fields]
+        if unknown or not names:
+            allowed = ", ".join(schema.model_fields)
+            raise HTTPException(status_code=400, detail=f"Invalid fields: {', '.join(unknown) or fields!r}. Allowed: {allowed}")
+        return names
+    return parse_fields
+
+def _filter_criterion(model, schema, expression: str):
+    name, sep, raw = expression.partition(":")
+    name = name.strip()
+    if not sep or name not in schema.model_fields or name not in model.__table__.c:
+        raise HTTPException(status_code=400, detail=f"Invalid filter {expression!r}, expected field:value")
+    column = model.__table__.c[name]
+    if isinstance(column.type, Integer):
+        try:
+            return column == int(raw)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Filter {name} expects an integer")
+    if isinstance(column.type, Enum):
+        if raw not in column.type.enums:
+            raise HTTPException(status_code=400, detail=f"Filter {name} expects one of: {', '.join(column.type.enums)}")
+        return type_coerce(column, String) == raw
+    if isinstance(column.type, (String, Text)):
+        # Match the value literally, not as a LIKE pattern
+        escaped = raw.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return column.ilike(f"%{escaped}%", escape="\\")
+    raise HTTPException(status_code=400, detail=f"Filtering on {name} is not supported")
+
+def page_params(model, schema):
+    def parse_page(
+        skip: int = Query(0, ge=0),
+        limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+        sort: Optional[str] = Query(None, description="Field to sort by, prefix with - for descending"),
+        filter: Optional[list[str]] = Query(None, description="field:value, repeatable; text fields match substrings"),
+    ):
+        order_by = []
+        if sort:
+            name = sort.lstrip("-")
+            if name not in schema.model_fields or name not in model.__table__.c:
+                raise HTTPException(status_code=400, detail=f"Cannot sort by {name!r}")
+            column = model.__table__.c[name]
+            order_by.append(column.desc() if sort.startswith("-") else column.asc())
+        criteria = [_filter_criterion(model, schema, expression) for expression in filter or []]
+        return Page(skip, limit, order_by, criteria)
+    return parse_page
+
+def _select(model, schema, criteria, fields, page: Page = None):
+    primary_key = model.__table__.primary_key.columns.values()[0]
+    stmt = select(*output_columns(model, schema, fields)).where(*criteria)
+    if page:
+        stmt = stmt.where(*page.criteria).order_by(*page.order_by).offset(page.skip)
+        if page.limit is not None:
+            stmt = stmt.limit(page.limit)
+    return stmt.order_by(primary_key)
+
+def count_rows(db: Session, model, *criteria) -> int:
+    return db.execute(select(func.count()).select_from(model.__table__).where(*criteria)).scalar()
+
+def select_rows(db: Session, model, schema, *criteria, fields=None, page: Page = None, expand=None) -> list[dict]:
+    # `expand` is an expand.Expansion, which adds nested related rows
+    if expand:
+        fields = expand.fields(fields)
+    result = db.execute(_select(model, schema, criteria, fields, page))
+    keys = tuple(result.keys())
+    rows = [dict(zip(keys, row)) for row in result]
+    return expand.apply(db, rows) if expand else rows
+
+def select_row(db: Session, model, schema, *criteria, fields=None) -> Optional[dict]:
+    result = db.execute(_select(model, schema, criteria, fields).limit(1))
+    keys = tuple(result.keys())
+    row = result.first()
+    return dict(zip(keys, row)) if row else None
+
+def rows_response(db: Session, model, schema, *criteria, fields=None, page: Page = None, expand=None) -> ORJSONResponse:
+    response = ORJSONResponse(select_rows(db, model, schema, *criteria, fields=fields, page=page, expand=expand))
+    if page and page.limit is not None:
+        response.headers["X-Total-Count"] = str(count_rows(db, model, *criteria, *page.criteria))
+    return response
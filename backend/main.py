@@ -1,37 +1,113 @@
-from fastapi import FastAPI, Depends, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse, HTMLResponse
 from sqlalchemy.orm import Session
-from database import engine, SessionLocal, Base, get_db
-import models, schemas, crud
-from auth import router as auth_router, get_current_user, require_role
+from typing import Optional
+from datetime import datetime, timedelta
+from database import engine, SessionLocal, Base, get_db, shards, current_tenant, DEFAULT_TENANT
+import models, schemas, crud, migrations, listing, doctor_calendar, events, archive, audit, tenancy, backups, sqltrace, clinic_metrics, expand, group_commit, documents, health, change_feed, versioning
+from auth import router as auth_router, get_current_user, get_stream_user, require_role
 from schemas import RoleEnum
 from prometheus_fastapi_instrumentator import Instrumentator
-
-Base.metadata.create_all(bind=engine)
-
-app = FastAPI(title="Telemedicine Secure API")
+from ratelimit import RateLimitMiddleware
+from idempotency import IdempotencyMiddleware
+
+migrations.check_schema(engine)
+# Clinic shards are checked as they are first opened
+shards.on_open = migrations.check_schema
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    health.install_signal_handler()
+    audit.writer.start()
+    clinic_metrics.reconciler.start()
+    change_feed.poller.start()
+    if group_commit.committer is not None:
+        group_commit.committer.start()
+    yield
+    # Requests still running get DRAIN_TIMEOUT to finish before the writers stop
+    await health.wait_for_drain()
+    if group_commit.committer is not None:
+        group_commit.committer.stop()
+    clinic_metrics.reconciler.stop()
+    change_feed.poller.stop()
+    # Drain queued audit entries before the process exits
+    audit.writer.stop()
+
+app = FastAPI(title="Telemedicine Secure API", lifespan=lifespan)
+app.add_middleware(IdempotencyMiddleware)
+app.add_middleware(tenancy.TenantMiddleware)
+app.add_middleware(RateLimitMiddleware)
+if sqltrace.SQL_TRACE:
+    app.add_middleware(sqltrace.SQLTraceMiddleware)
+# Outermost, so requests turned away while draining skip everything else
+app.add_middleware(health.DrainMiddleware)
 instrumentator = Instrumentator()
 instrumentator.instrument(app).expose(app)
 
 # Mount Auth Router
 app.include_router(auth_router)
 
+HISTORY_TYPES = {models.Prescription: "prescription", models.EMR: "emr"}
+
+def _check_patient_access(db: Session, model, record_id: int, current_user: models.User):
+    # Patients may only read history of their own records, hot, archived or deleted
+    if current_user.role == RoleEnum.Patient:
+        record = archive.get_record(db, model, record_id)
+        if record is None and model in HISTORY_TYPES:
+            record = versioning.get_deleted(db, HISTORY_TYPES[model], record_id)
+        if record is not None and record.patient_id != current_user.user_id:
+            raise HTTPException(status_code=403, detail="Access denied")
+
+# ---------------- HEALTH ----------------
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz", include_in_schema=False)
+def readyz():
+    ready, report = health.readiness()
+    return listing.ORJSONResponse(report, status_code=200 if ready else 503)
+
+# ---------------- LIVE EVENTS ----------------
+@app.get("/events/stream")
+async def stream_events(
+    request: Request,
+    entities: Optional[str] = Query(None, description="Comma-separated: appointment, lab_test"),
+    current_user: models.User = Depends(get_stream_user)
+):
+    wanted = {e.strip() for e in entities.split(",") if e.strip()} if entities else None
+    role = getattr(current_user.role, "value", current_user.role)
+    subscription = events.bus.subscribe(events.visible_to(role, current_user.user_id, wanted))
+    return StreamingResponse(
+        events.sse_stream(request, subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # ---------------- USERS ----------------
 
 @app.get("/users/", response_model=list[schemas.UserOut])
 def read_users(
+    fields: list[str] = Depends(listing.fields_param(schemas.UserOut)),
+    page: listing.Page = Depends(listing.page_params(models.User, schemas.UserOut)),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)  # ✅ Allow all roles initially
 ):
     if current_user.role not in [RoleEnum.Admin, RoleEnum.Doctor]:
         raise HTTPException(status_code=403, detail="Access denied")
-    return crud.get_users(db)
+    return listing.rows_response(db, models.User, schemas.UserOut, fields=fields, page=page)
 
 @app.get("/users/{user_id}", response_model=schemas.UserOut)
-def read_user(user_id: int, db: Session = Depends(get_db)):
-    user = crud.get_user(db, user_id)
+def read_user(
+    user_id: int,
+    fields: list[str] = Depends(listing.fields_param(schemas.UserOut)),
+    db: Session = Depends(get_db)
+):
+    user = listing.select_row(db, models.User, schemas.UserOut, models.User.user_id == user_id, fields=fields)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return user
+    return listing.ORJSONResponse(user)
 
 @app.post("/users/", response_model=schemas.UserOut, status_code=201)
 def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
@@ -56,21 +132,31 @@ def delete_user(
     return {"detail": "User deleted"}
 
 # ---------------- APPOINTMENTS ----------------
-@app.get("/appointments/", response_model=list[schemas.AppointmentOut])
+APPOINTMENT_EXPANDS = {"patient": schemas.UserSummary, "doctor": schemas.UserSummary}
+
+@app.get("/appointments/", response_model=list[schemas.AppointmentExpandedOut])
 def read_appointments(
+    fields: list[str] = Depends(listing.fields_param(schemas.AppointmentOut)),
+    page: listing.Page = Depends(listing.page_params(models.Appointment, schemas.AppointmentOut)),
+    expansion: expand.Expansion = Depends(expand.expand_param(models.Appointment, APPOINTMENT_EXPANDS)),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     if current_user.role == RoleEnum.Patient:
-        return db.query(models.Appointment).filter(models.Appointment.patient_id == current_user.user_id).all()
-    return crud.get_appointments(db)
+        return listing.rows_response(db, models.Appointment, schemas.AppointmentOut, models.Appointment.patient_id == current_user.user_id, fields=fields, page=page, expand=expansion)
+    return listing.rows_response(db, models.Appointment, schemas.AppointmentOut, fields=fields, page=page, expand=expansion)
 
-@app.get("/appointments/{appointment_id}", response_model=schemas.AppointmentOut)
-def read_appointment(appointment_id: int, db: Session = Depends(get_db)):
-    appt = crud.get_appointment(db, appointment_id)
+@app.get("/appointments/{appointment_id}", response_model=schemas.AppointmentExpandedOut)
+def read_appointment(
+    appointment_id: int,
+    fields: list[str] = Depends(listing.fields_param(schemas.AppointmentOut)),
+    expansion: expand.Expansion = Depends(expand.expand_param(models.Appointment, APPOINTMENT_EXPANDS)),
+    db: Session = Depends(get_db)
+):
+    appt = archive.select_row(db, models.Appointment, schemas.AppointmentOut, appointment_id, fields=expansion.fields(fields))
     if not appt:
         raise HTTPException(status_code=404, detail="Appointment not found")
-    return appt
+    return listing.ORJSONResponse(expansion.apply(db, [appt])[0])
 
 @app.post("/appointments/", response_model=schemas.AppointmentOut, status_code=201)
 def create_appointment(
@@ -105,32 +191,121 @@ def delete_appointment(
     return {"detail": "Appointment deleted"}
 
 
+# ---------------- DOCTORS ----------------
+@app.get("/doctors/", response_model=list[schemas.DoctorOut])
+def read_doctors(
+    q: Optional[str] = Query(None, max_length=100, description="Name prefix; every word must match"),
+    specialty: Optional[str] = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=listing.MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    doctors = crud.search_doctors(db, q, specialty)
+    response = listing.ORJSONResponse(doctors[skip:skip + limit])
+    response.headers["X-Total-Count"] = str(len(doctors))
+    return response
+
+@app.get("/doctors/{doctor_id}/calendar", response_model=schemas.DoctorCalendarOut)
+def read_doctor_calendar(
+    doctor_id: int,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    granularity: schemas.CalendarGranularityEnum = schemas.CalendarGranularityEnum.day,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    if current_user.role == RoleEnum.Patient:
+        raise HTTPException(status_code=403, detail="Access denied")
+    if current_user.role == RoleEnum.Doctor and current_user.user_id != doctor_id:
+        raise HTTPException(status_code=403, detail="Doctors can only view their own calendar")
+    if start is None:
+        start = datetime.combine(doctor_calendar.week_start(datetime.now()), datetime.min.time())
+    if end is None:
+        end = start + timedelta(days=7)
+    return crud.get_doctor_calendar(db, doctor_id, start, end, granularity)
+
+# ---------------- PATIENTS ----------------
+@app.get("/patients/{patient_id}/timeline", response_model=list[schemas.TimelineEntry], dependencies=[Depends(audit.audited("timeline", "read", "patient_id"))])
+def read_patient_timeline(
+    patient_id: int,
+    before: Optional[datetime] = Query(None, description="Only entries strictly older than this"),
+    limit: int = Query(100, ge=1, le=archive.TIMELINE_MAX_LIMIT),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    if current_user.role == RoleEnum.Patient and current_user.user_id != patient_id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    return crud.get_patient_timeline(db, patient_id, before, limit)
+
 # ---------------- PRESCRIPTIONS ----------------
-@app.get("/prescriptions/", response_model=list[schemas.PrescriptionOut])
+PRESCRIPTION_EXPANDS = {"appointment": schemas.AppointmentSummary, "patient": schemas.UserSummary, "doctor": schemas.UserSummary}
+
+@app.get("/prescriptions/", response_model=list[schemas.PrescriptionExpandedOut], dependencies=[Depends(audit.audited("prescription", "list"))])
 def read_prescriptions(
+    fields: list[str] = Depends(listing.fields_param(schemas.PrescriptionOut)),
+    page: listing.Page = Depends(listing.page_params(models.Prescription, schemas.PrescriptionOut)),
+    expansion: expand.Expansion = Depends(expand.expand_param(models.Prescription, PRESCRIPTION_EXPANDS)),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     if current_user.role == RoleEnum.Patient:
-        return db.query(models.Prescription).filter(models.Prescription.patient_id == current_user.user_id).all()
-    return crud.get_prescriptions(db)
+        return listing.rows_response(db, models.Prescription, schemas.PrescriptionOut, models.Prescription.patient_id == current_user.user_id, fields=fields, page=page, expand=expansion)
+    return listing.rows_response(db, models.Prescription, schemas.PrescriptionOut, fields=fields, page=page, expand=expansion)
 
-@app.get("/prescriptions/{prescription_id}", response_model=schemas.PrescriptionOut)
-def read_prescription(prescription_id: int, db: Session = Depends(get_db)):
-    pres = crud.get_prescription(db, prescription_id)
+@app.get("/prescriptions/{prescription_id}", response_model=schemas.PrescriptionExpandedOut, dependencies=[Depends(audit.audited("prescription", "read", "prescription_id"))])
+def read_prescription(
+    prescription_id: int,
+    fields: list[str] = Depends(listing.fields_param(schemas.PrescriptionOut)),
+    expansion: expand.Expansion = Depends(expand.expand_param(models.Prescription, PRESCRIPTION_EXPANDS)),
+    db: Session = Depends(get_db)
+):
+    pres = archive.select_row(db, models.Prescription, schemas.PrescriptionOut, prescription_id, fields=expansion.fields(fields))
     if not pres:
         raise HTTPException(status_code=404, detail="Prescription not found")
-    return pres
+    return listing.ORJSONResponse(expansion.apply(db, [pres])[0])
+
+@app.get("/prescriptions/{prescription_id}/versions", response_model=list[schemas.RecordVersionInfo], dependencies=[Depends(audit.audited("prescription", "read_history", "prescription_id"))])
+def read_prescription_versions(
+    prescription_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    _check_patient_access(db, models.Prescription, prescription_id, current_user)
+    return crud.get_prescription_versions(db, prescription_id)
+
+@app.get("/prescriptions/{prescription_id}/versions/{version}", response_model=schemas.PrescriptionVersionOut, dependencies=[Depends(audit.audited("prescription", "read_history", "prescription_id"))])
+def read_prescription_version(
+    prescription_id: int,
+    version: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    _check_patient_access(db, models.Prescription, prescription_id, current_user)
+    return crud.get_prescription_version(db, prescription_id, version)
+
+@app.get("/prescriptions/{prescription_id}/document", response_class=HTMLResponse, dependencies=[Depends(audit.audited("prescription", "print", "prescription_id"))])
+def read_prescription_document(
+    prescription_id: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    _check_patient_access(db, models.Prescription, prescription_id, current_user)
+    return documents.document_response(db, "prescription", prescription_id, request.headers.get("if-none-match"))
 
 @app.post("/prescriptions/", response_model=schemas.PrescriptionOut, status_code=201)
 def create_prescription(
     pres: schemas.PrescriptionCreate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(require_role(RoleEnum.Doctor))
+    current_user: models.User = Depends(require_role(RoleEnum.Doctor)),
+    audit_entry: audit.AuditEntry = Depends(audit.audited("prescription", "create"))
 ):
-    return crud.create_prescription(db, pres)
+    created = crud.create_prescription(db, pres)
+    audit_entry.resource_id = created.prescription_id
+    return created
 
-@app.put("/prescriptions/{prescription_id}", response_model=schemas.PrescriptionOut)
+@app.put("/prescriptions/{prescription_id}", response_model=schemas.PrescriptionOut, dependencies=[Depends(audit.audited("prescription", "update", "prescription_id"))])
 def update_prescription(
     prescription_id: int,
     pres: schemas.PrescriptionCreate,
@@ -139,7 +314,7 @@ def update_prescription(
 ):
     return crud.update_prescription(db, prescription_id, pres)
 
-@app.delete("/prescriptions/{prescription_id}")
+@app.delete("/prescriptions/{prescription_id}", dependencies=[Depends(audit.audited("prescription", "delete", "prescription_id"))])
 def delete_prescription(
     prescription_id: int,
     db: Session = Depends(get_db),
@@ -149,31 +324,40 @@ def delete_prescription(
     return {"detail": "Prescription deleted"}
 
 # ---------------- LAB TESTS ----------------
-@app.get("/lab-tests/", response_model=list[schemas.LabTestOut])
+@app.get("/lab-tests/", response_model=list[schemas.LabTestOut], dependencies=[Depends(audit.audited("lab_test", "list"))])
 def read_lab_tests(
+    fields: list[str] = Depends(listing.fields_param(schemas.LabTestOut)),
+    page: listing.Page = Depends(listing.page_params(models.LabTest, schemas.LabTestOut)),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     if current_user.role == RoleEnum.Patient:
-        return db.query(models.LabTest).filter(models.LabTest.patient_id == current_user.user_id).all()
-    return crud.get_all_lab_tests(db)
+        return listing.rows_response(db, models.LabTest, schemas.LabTestOut, models.LabTest.patient_id == current_user.user_id, fields=fields, page=page)
+    return listing.rows_response(db, models.LabTest, schemas.LabTestOut, fields=fields, page=page)
 
-@app.get("/lab-tests/{test_id}", response_model=schemas.LabTestOut)
-def read_lab_test(test_id: int, db: Session = Depends(get_db)):
-    test = crud.get_lab_test(db, test_id)
+@app.get("/lab-tests/{test_id}", response_model=schemas.LabTestOut, dependencies=[Depends(audit.audited("lab_test", "read", "test_id"))])
+def read_lab_test(
+    test_id: int,
+    fields: list[str] = Depends(listing.fields_param(schemas.LabTestOut)),
+    db: Session = Depends(get_db)
+):
+    test = archive.select_row(db, models.LabTest, schemas.LabTestOut, test_id, fields=fields)
     if not test:
         raise HTTPException(status_code=404, detail="Lab test not found")
-    return test
+    return listing.ORJSONResponse(test)
 
 @app.post("/lab-tests/", response_model=schemas.LabTestOut, status_code=201)
 def create_lab_test(
     test: schemas.LabTestCreate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(require_role(RoleEnum.Doctor))
+    current_user: models.User = Depends(require_role(RoleEnum.Doctor)),
+    audit_entry: audit.AuditEntry = Depends(audit.audited("lab_test", "create"))
 ):
-    return crud.create_lab_test(db, test)
+    created = crud.create_lab_test(db, test)
+    audit_entry.resource_id = created.test_id
+    return created
 
-@app.put("/lab-tests/{test_id}", response_model=schemas.LabTestOut)
+@app.put("/lab-tests/{test_id}", response_model=schemas.LabTestOut, dependencies=[Depends(audit.audited("lab_test", "update", "test_id"))])
 def update_lab_test(
     test_id: int,
     test: schemas.LabTestCreate,
@@ -182,7 +366,7 @@ def update_lab_test(
 ):
     return crud.update_lab_test(db, test_id, test)
 
-@app.delete("/lab-tests/{test_id}")
+@app.delete("/lab-tests/{test_id}", dependencies=[Depends(audit.audited("lab_test", "delete", "test_id"))])
 def delete_lab_test(
     test_id: int,
     db: Session = Depends(get_db),
@@ -192,31 +376,73 @@ def delete_lab_test(
     return {"detail": "Lab test deleted"}
 
 # ---------------- EMR ----------------
-@app.get("/emr/", response_model=list[schemas.EMROut])
+EMR_EXPANDS = {"patient": schemas.UserSummary, "doctor": schemas.UserSummary}
+
+@app.get("/emr/", response_model=list[schemas.EMRExpandedOut], dependencies=[Depends(audit.audited("emr", "list"))])
 def read_emrs(
+    fields: list[str] = Depends(listing.fields_param(schemas.EMROut)),
+    page: listing.Page = Depends(listing.page_params(models.EMR, schemas.EMROut)),
+    expansion: expand.Expansion = Depends(expand.expand_param(models.EMR, EMR_EXPANDS)),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     if current_user.role == RoleEnum.Patient:
-        return db.query(models.EMR).filter(models.EMR.patient_id == current_user.user_id).all()
-    return crud.get_all_emrs(db)
+        return listing.rows_response(db, models.EMR, schemas.EMROut, models.EMR.patient_id == current_user.user_id, fields=fields, page=page, expand=expansion)
+    return listing.rows_response(db, models.EMR, schemas.EMROut, fields=fields, page=page, expand=expansion)
 
-@app.get("/emr/{emr_id}", response_model=schemas.EMROut)
-def read_emr(emr_id: int, db: Session = Depends(get_db)):
-    emr = crud.get_emr(db, emr_id)
+@app.get("/emr/{emr_id}", response_model=schemas.EMRExpandedOut, dependencies=[Depends(audit.audited("emr", "read", "emr_id"))])
+def read_emr(
+    emr_id: int,
+    fields: list[str] = Depends(listing.fields_param(schemas.EMROut)),
+    expansion: expand.Expansion = Depends(expand.expand_param(models.EMR, EMR_EXPANDS)),
+    db: Session = Depends(get_db)
+):
+    emr = archive.select_row(db, models.EMR, schemas.EMROut, emr_id, fields=expansion.fields(fields))
     if not emr:
         raise HTTPException(status_code=404, detail="EMR not found")
-    return emr
+    return listing.ORJSONResponse(expansion.apply(db, [emr])[0])
+
+@app.get("/emr/{emr_id}/versions", response_model=list[schemas.RecordVersionInfo], dependencies=[Depends(audit.audited("emr", "read_history", "emr_id"))])
+def read_emr_versions(
+    emr_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    _check_patient_access(db, models.EMR, emr_id, current_user)
+    return crud.get_emr_versions(db, emr_id)
+
+@app.get("/emr/{emr_id}/versions/{version}", response_model=schemas.EMRVersionOut, dependencies=[Depends(audit.audited("emr", "read_history", "emr_id"))])
+def read_emr_version(
+    emr_id: int,
+    version: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    _check_patient_access(db, models.EMR, emr_id, current_user)
+    return crud.get_emr_version(db, emr_id, version)
+
+@app.get("/emr/{emr_id}/document", response_class=HTMLResponse, dependencies=[Depends(audit.audited("emr", "print", "emr_id"))])
+def read_emr_document(
+    emr_id: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    _check_patient_access(db, models.EMR, emr_id, current_user)
+    return documents.document_response(db, "emr", emr_id, request.headers.get("if-none-match"))
 
 @app.post("/emr/", response_model=schemas.EMROut, status_code=201)
 def create_emr(
     emr: schemas.EMRCreate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(require_role(RoleEnum.Doctor))
+    current_user: models.User = Depends(require_role(RoleEnum.Doctor)),
+    audit_entry: audit.AuditEntry = Depends(audit.audited("emr", "create"))
 ):
-    return crud.create_emr(db, emr)
+    created = crud.create_emr(db, emr)
+    audit_entry.resource_id = created.emr_id
+    return created
 
-@app.put("/emr/{emr_id}", response_model=schemas.EMROut)
+@app.put("/emr/{emr_id}", response_model=schemas.EMROut, dependencies=[Depends(audit.audited("emr", "update", "emr_id"))])
 def update_emr(
     emr_id: int,
     emr: schemas.EMRCreate,
@@ -225,7 +451,7 @@ def update_emr(
 ):
     return crud.update_emr(db, emr_id, emr)
 
-@app.delete("/emr/{emr_id}")
+@app.delete("/emr/{emr_id}", dependencies=[Depends(audit.audited("emr", "delete", "emr_id"))])
 def delete_emr(
     emr_id: int,
     db: Session = Depends(get_db),
@@ -237,21 +463,24 @@ def delete_emr(
 # ---------------- INVENTORY ----------------
 @app.get("/inventory/", response_model=list[schemas.InventoryOut])
 def read_inventory(
+    fields: list[str] = Depends(listing.fields_param(schemas.InventoryOut)),
+    page: listing.Page = Depends(listing.page_params(models.Inventory, schemas.InventoryOut)),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(require_role(RoleEnum.Admin))
 ):
-    return crud.get_all_inventory(db)
+    return listing.rows_response(db, models.Inventory, schemas.InventoryOut, fields=fields, page=page)
 
 @app.get("/inventory/{item_id}", response_model=schemas.InventoryOut)
 def read_inventory_item(
     item_id: int,
+    fields: list[str] = Depends(listing.fields_param(schemas.InventoryOut)),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(require_role(RoleEnum.Admin))
 ):
-    item = crud.get_inventory_item(db, item_id)
+    item = listing.select_row(db, models.Inventory, schemas.InventoryOut, models.Inventory.medicine_id == item_id, fields=fields)
     if not item:
         raise HTTPException(status_code=404, detail="Inventory item not found")
-    return item
+    return listing.ORJSONResponse(item)
 
 @app.post("/inventory/", response_model=schemas.InventoryOut, status_code=201)
 def create_inventory(
@@ -282,21 +511,24 @@ def delete_inventory(
 # ---------------- PAYMENTS ----------------
 @app.get("/payments/", response_model=list[schemas.PaymentOut])
 def read_payments(
+    fields: list[str] = Depends(listing.fields_param(schemas.PaymentOut)),
+    page: listing.Page = Depends(listing.page_params(models.Payment, schemas.PaymentOut)),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(require_role(RoleEnum.Admin))
 ):
-    return crud.get_all_payments(db)
+    return listing.rows_response(db, models.Payment, schemas.PaymentOut, fields=fields, page=page)
 
 @app.get("/payments/{payment_id}", response_model=schemas.PaymentOut)
 def read_payment(
     payment_id: int,
+    fields: list[str] = Depends(listing.fields_param(schemas.PaymentOut)),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(require_role(RoleEnum.Admin))
 ):
-    payment = crud.get_payment(db, payment_id)
+    payment = archive.select_row(db, models.Payment, schemas.PaymentOut, payment_id, fields=fields)
     if not payment:
         raise HTTPException(status_code=404, detail="Payment not found")
-    return payment
+    return listing.ORJSONResponse(payment)
 
 @app.post("/payments/", response_model=schemas.PaymentOut, status_code=201)
 def create_payment(
@@ -323,3 +555,80 @@ def delete_payment(
 ):
     crud.delete_payment(db, payment_id)
     return {"detail": "Payment deleted"}
+
+# ---------------- AUDIT LOG ----------------
+@app.get("/audit/", response_model=list[schemas.AuditLogOut])
+def read_audit_log(
+    fields: list[str] = Depends(listing.fields_param(schemas.AuditLogOut)),
+    page: listing.Page = Depends(listing.page_params(models.AuditLog, schemas.AuditLogOut)),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(require_role(RoleEnum.Admin))
+):
+    # Let entries from requests that just finished reach the table
+    audit.writer.flush(timeout=1.0)
+    return listing.rows_response(db, models.AuditLog, schemas.AuditLogOut, fields=fields, page=page)
+
+# ---------------- CLINIC SHARDS ----------------
+def _require_platform_admin(current_user: models.User = Depends(require_role(RoleEnum.Admin))):
+    # Shards are managed by the admins of the default clinic only
+    if current_tenant.get() != DEFAULT_TENANT:
+        raise HTTPException(status_code=403, detail="Insufficient privileges")
+    return current_user
+
+@app.get("/admin/shards", response_model=list[schemas.ShardOut])
+def read_shards(current_user: models.User = Depends(_require_platform_admin)):
+    return tenancy.list_shards()
+
+@app.post("/admin/shards", response_model=schemas.ShardOut, status_code=201)
+def create_shard(
+    shard: schemas.ShardCreate,
+    current_user: models.User = Depends(_require_platform_admin)
+):
+    try:
+        return tenancy.provision(shard.clinic_id, log=lambda _: None)
+    except FileExistsError as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+
+# ---------------- BACKUPS ----------------
+def _known_clinic(clinic: Optional[str]) -> Optional[str]:
+    if clinic is not None and not shards.exists(clinic):
+        raise HTTPException(status_code=404, detail=f"Unknown clinic {clinic!r}")
+    return clinic
+
+@app.get("/admin/backups", response_model=schemas.BackupStatusOut)
+def read_backups(
+    clinic: Optional[str] = None,
+    current_user: models.User = Depends(_require_platform_admin)
+):
+    clinics = [_known_clinic(clinic)] if clinic else shards.tenants()
+    return {
+        "running": backups.running(),
+        "backups": [manifest for tenant in clinics for manifest in backups.list_backups(tenant)],
+    }
+
+@app.post("/admin/backups", status_code=202)
+def start_backup(
+    clinic: str = DEFAULT_TENANT,
+    current_user: models.User = Depends(_require_platform_admin)
+):
+    try:
+        backups.start_backup(_known_clinic(clinic))
+    except backups.BackupInProgress as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    return {"clinic_id": clinic, "status": "started"}
+
+# ---------------- SQL TRACE (SQL_TRACE=1 only) ----------------
+if sqltrace.SQL_TRACE:
+    @app.get("/debug/requests")
+    def read_recent_traces(
+        limit: int = Query(50, ge=1, le=sqltrace.TRACE_HISTORY),
+        current_user: models.User = Depends(require_role(RoleEnum.Admin))
+    ):
+        return sqltrace.traces.recent(limit)
+
+    @app.get("/debug/requests/{request_id}")
+    def read_trace(request_id: str, current_user: models.User = Depends(require_role(RoleEnum.Admin))):
+        summary = sqltrace.traces.get(request_id)
+        if summary is None:
+            raise HTTPException(status_code=404, detail="Trace not found or expired")
+        return summary
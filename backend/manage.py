@@ -0,0 +1,225 @@
+import argparse
+import asyncio
+
+import migrations, archive, tenancy, importer, backups, payment_reconciler, lab_ingest, passwords
+from database import DEFAULT_TENANT, UnknownTenant, shards
+
+# ------------------ MIGRATE ------------------
+def cmd_migrate(args):
+    if args.all_clinics:
+        tenancy.upgrade_all(target=args.target)
+        return
+    engine = shards.get(args.clinic)
+    if args.status:
+        version = migrations.current_version(engine)
+        print(f"Current schema version: {version} (latest {migrations.LATEST_VERSION})")
+        for number, description, _ in migrations.MIGRATIONS:
+            state = "applied" if number <= version else "pending"
+            print(f"  {number:>3}  {state:<8} {description}")
+        return
+    version = migrations.upgrade(engine, target=args.target)
+    print(f"Schema is at version {version}")
+
+# ------------------ ARCHIVE ------------------
+def cmd_archive(args):
+    engine = shards.get(args.clinic)
+    migrations.check_schema(engine)
+    cutoff = archive.cutoff_for(args.older_than)
+    if args.status:
+        sizes = archive.table_sizes(engine)
+        pending = archive.pending_counts(engine, cutoff)
+        print(f"Rows older than {cutoff:%Y-%m-%d} eligible for archiving:")
+        for name, (hot, cold) in sizes.items():
+            print(f"  {name:<14} hot {hot:>8}  archived {cold:>8}  eligible {pending[name]:>8}")
+        return
+    print(f"Archiving rows older than {cutoff:%Y-%m-%d} in batches of {args.batch_size}")
+    moved = archive.archive_older_than(engine, cutoff, batch_size=args.batch_size, pause=args.pause)
+    print(f"Archived {sum(moved.values())} rows")
+
+# ------------------ SHARDS ------------------
+def cmd_shards(args):
+    if args.action == "provision":
+        for clinic in args.clinics:
+            print(f"Provisioning clinic {clinic!r}")
+            info = tenancy.provision(clinic)
+            print(f"  created {info['path']} at schema version {info['schema_version']}")
+        return
+    print(f"{'clinic':<24} {'schema':>6} {'size':>12}  path")
+    for info in tenancy.list_shards():
+        print(f"{info['clinic_id']:<24} {info['schema_version']:>6} {info['size_bytes']:>12}  {info['path']}")
+
+# ------------------ IMPORT ------------------
+def cmd_import(args):
+    engine = shards.get(args.clinic)
+    migrations.check_schema(engine)
+    for path in args.paths:
+        print(f"Importing {args.entity} from {path}")
+        importer.Importer(
+            engine, args.entity, path,
+            id_field=args.id_field, chunk_size=args.chunk_size, workers=args.workers,
+            checkpoint=args.checkpoint, fmt=args.format,
+        ).run(restart=args.restart)
+
+# ------------------ BACKUPS ------------------
+def cmd_backup(args):
+    clinics = shards.tenants() if args.all_clinics else [args.clinic]
+    if args.list:
+        for clinic in clinics:
+            for manifest in backups.list_backups(clinic):
+                print(f"{clinic:<24} {manifest['created_at']:<34} {manifest['size_bytes']:>12} "
+                      f"{manifest['duration_seconds']:>8.2f}s  {manifest['file']}")
+        return
+    for clinic in clinics:
+        backups.create_backup(clinic, pages=args.pages, keep=args.keep)
+
+def cmd_restore(args):
+    path = backups.find_backup(args.backup, args.clinic)
+    if not args.yes:
+        answer = input(f"Overwrite the live database of clinic {args.clinic!r} with {path}? [y/N] ")
+        if answer.strip().lower() != "y":
+            raise SystemExit("Restore cancelled")
+    backups.restore(path, args.clinic)
+    print("Restart the API so cached reads are dropped")
+
+# ------------------ PAYMENTS ------------------
+def cmd_reconcile_payments(args):
+    def clinics():
+        names = shards.tenants() if args.all_clinics else [args.clinic]
+        for name in names:
+            migrations.check_schema(shards.get(name))
+        return names
+    if args.metrics_port:
+        from prometheus_client import start_http_server
+        start_http_server(args.metrics_port)
+    asyncio.run(payment_reconciler.reconcile(clinics, batch_size=args.batch_size, loop=args.loop, interval=args.interval))
+
+# ------------------ LAB RESULTS ------------------
+def cmd_ingest_labs(args):
+    def clinics():
+        names = shards.tenants() if args.all_clinics else [args.clinic]
+        for name in names:
+            migrations.check_schema(shards.get(name))
+        return names
+    if args.metrics_port:
+        from prometheus_client import start_http_server
+        start_http_server(args.metrics_port)
+    if args.watch:
+        lab_ingest.watch(clinics, poll=args.poll, batch_size=args.batch_size)
+        return
+    if not args.paths:
+        raise ValueError("give result files to ingest, or --watch")
+    clinic, = clinics()
+    for path in args.paths:
+        lab_ingest.ingest_file(path, clinic, batch_size=args.batch_size)
+
+# ------------------ PASSWORD HASHING ------------------
+def cmd_bench_hash(args):
+    ctx = passwords.build_context(
+        bcrypt_rounds=args.bcrypt_rounds, argon2_time_cost=args.argon2_time_cost,
+        argon2_memory_cost=args.argon2_memory_cost, pbkdf2_rounds=args.pbkdf2_rounds,
+    )
+    print(f"{'scheme':<16}{'hash ms':>10}{'verify ms':>11}  settings")
+    for result in passwords.benchmark(args.schemes, repeat=args.repeat, ctx=ctx):
+        settings = ", ".join(f"{name}={value}" for name, value in result["settings"].items())
+        marker = " (current)" if result["scheme"] == passwords.PASSWORD_SCHEME else ""
+        if "error" in result:
+            print(f"{result['scheme']:<16}{'-':>10}{'-':>11}  not available: {result['error']}")
+            continue
+        print(f"{result['scheme']:<16}{result['hash_ms']:>10.1f}{result['verify_ms']:>11.1f}  {settings}{marker}")
+
+# ------------------ ENTRY POINT ------------------
+def build_parser():
+    parser = argparse.ArgumentParser(description="Telemedicine backend management commands")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    migrate = sub.add_parser("migrate", help="apply pending schema migrations")
+    migrate.add_argument("--target", type=int, help="stop at this schema version")
+    migrate.add_argument("--status", action="store_true", help="list applied and pending migrations")
+    migrate.add_argument("--clinic", default=DEFAULT_TENANT, help="clinic shard to migrate")
+    migrate.add_argument("--all-clinics", action="store_true", help="migrate the default database and every shard")
+    migrate.set_defaults(func=cmd_migrate)
+
+    archiver = sub.add_parser("archive", help="move old clinical records into the archive tables")
+    archiver.add_argument("--older-than", type=int, default=archive.DEFAULT_HORIZON_DAYS, metavar="DAYS",
+                          help=f"archive records older than this many days (default {archive.DEFAULT_HORIZON_DAYS})")
+    archiver.add_argument("--batch-size", type=int, default=archive.BATCH_SIZE, help="rows moved per transaction")
+    archiver.add_argument("--pause", type=float, default=0.0, help="seconds to sleep between batches")
+    archiver.add_argument("--status", "--dry-run", dest="status", action="store_true",
+                          help="show hot/archived row counts and what would move, without moving anything")
+    archiver.add_argument("--clinic", default=DEFAULT_TENANT, help="clinic shard to archive")
+    archiver.set_defaults(func=cmd_archive)
+
+    imports = sub.add_parser("import", help="bulk import legacy CSV or JSONL exports")
+    imports.add_argument("entity", choices=list(importer.ENTITIES))
+    imports.add_argument("paths", nargs="+", metavar="FILE")
+    imports.add_argument("--format", choices=["csv", "jsonl"], help="default: from the file extension")
+    imports.add_argument("--id-field", default="id", help="column holding the legacy ID (default: id)")
+    imports.add_argument("--chunk-size", type=int, default=importer.CHUNK_SIZE, help="rows per transaction")
+    imports.add_argument("--workers", type=int, help="validation/hashing processes (default: CPU count, 1 = inline)")
+    imports.add_argument("--checkpoint", help="checkpoint file, may be shared by several FILEs (default: FILE.checkpoint.json)")
+    imports.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    imports.add_argument("--clinic", default=DEFAULT_TENANT, help="clinic shard to import into")
+    imports.set_defaults(func=cmd_import)
+
+    shard = sub.add_parser("shards", help="list or provision per-clinic databases")
+    shard_sub = shard.add_subparsers(dest="action", required=True)
+    shard_sub.add_parser("list", help="list clinics with their schema version and size")
+    provision = shard_sub.add_parser("provision", help="create and migrate new clinic databases")
+    provision.add_argument("clinics", nargs="+", metavar="CLINIC_ID")
+    shard.set_defaults(func=cmd_shards)
+
+    payments = sub.add_parser("reconcile-payments", help="settle Pending payments against their gateways")
+    payments.add_argument("--clinic", default=DEFAULT_TENANT, help="clinic shard to reconcile")
+    payments.add_argument("--all-clinics", action="store_true", help="reconcile the default database and every shard")
+    payments.add_argument("--batch-size", type=int, default=payment_reconciler.BATCH_SIZE, help="payments per gateway round")
+    payments.add_argument("--loop", action="store_true", help="keep running, one pass every --interval seconds")
+    payments.add_argument("--interval", type=float, default=payment_reconciler.LOOP_INTERVAL, help="seconds between passes")
+    payments.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port")
+    payments.set_defaults(func=cmd_reconcile_payments)
+
+    labs = sub.add_parser("ingest-labs", help="complete Pending lab tests from analyzer result files")
+    labs.add_argument("paths", nargs="*", metavar="FILE", help="CSV or JSONL result files")
+    labs.add_argument("--clinic", default=DEFAULT_TENANT, help="clinic shard the results belong to")
+    labs.add_argument("--watch", action="store_true", help=f"keep polling {lab_ingest.INBOX_DIR}/<clinic>/ for new files")
+    labs.add_argument("--all-clinics", action="store_true", help="with --watch, poll the inbox of every clinic")
+    labs.add_argument("--poll", type=float, default=lab_ingest.POLL_SECONDS, help="seconds between inbox scans")
+    labs.add_argument("--batch-size", type=int, default=lab_ingest.BATCH_SIZE, help="result rows per transaction")
+    labs.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port")
+    labs.set_defaults(func=cmd_ingest_labs)
+
+    bench = sub.add_parser("bench-hash", help="time password hashing and verification per scheme on this host")
+    bench.add_argument("--schemes", nargs="+", choices=passwords.SCHEMES, default=list(passwords.SCHEMES))
+    bench.add_argument("--repeat", type=int, default=5, help="hashes timed per scheme (the median is shown)")
+    bench.add_argument("--bcrypt-rounds", type=int, default=passwords.BCRYPT_ROUNDS, help="bcrypt log2 cost")
+    bench.add_argument("--argon2-time-cost", type=int, default=passwords.ARGON2_TIME_COST, help="argon2 passes")
+    bench.add_argument("--argon2-memory-cost", type=int, default=passwords.ARGON2_MEMORY_COST, help="argon2 memory in KiB")
+    bench.add_argument("--pbkdf2-rounds", type=int, default=passwords.PBKDF2_ROUNDS, help="PBKDF2-SHA256 iterations")
+    bench.set_defaults(func=cmd_bench_hash)
+
+    backup = sub.add_parser("backup", help="take an online backup of clinic databases")
+    backup.add_argument("--clinic", default=DEFAULT_TENANT, help="clinic shard to back up")
+    backup.add_argument("--all-clinics", action="store_true", help="back up the default database and every shard")
+    backup.add_argument("--pages", type=int, default=backups.PAGES_PER_STEP,
+                        help="pages copied per step; -1 copies everything in one step")
+    backup.add_argument("--keep", type=int, default=backups.RETENTION,
+                        help=f"backups kept per clinic (default {backups.RETENTION})")
+    backup.add_argument("--list", action="store_true", help="list existing backups instead of taking one")
+    backup.set_defaults(func=cmd_backup)
+
+    restorer = sub.add_parser("restore", help="overwrite a clinic database with a backup")
+    restorer.add_argument("backup", metavar="FILE", help="backup path, or a file name under backups/<clinic>/")
+    restorer.add_argument("--clinic", default=DEFAULT_TENANT, help="clinic shard to restore")
+    restorer.add_argument("--yes", action="store_true", help="do not ask for confirmation")
+    restorer.set_defaults(func=cmd_restore)
+
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        args.func(args)
+    except (UnknownTenant, FileExistsError, FileNotFoundError, ValueError, backups.BackupInProgress) as exc:
+        raise SystemExit(f"error: {exc}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateTable
+import models
+
+# Versioned schema migrations. The applied version lives in SQLite's
+# PRAGMA user_version, so the startup check is a single header read.
+# Every migration must be idempotent: it may be re-applied to a database
+# created by an older `create_all` that never recorded a version.
+# Tables with an `*_archive` twin take new columns through
+# `_add_archived_column`, which adds them to both: archiving copies every
+# current column of the hot table into the twin.
+
+MIGRATIONS = []
+
+def migration(version: int, description: str):
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+# ------------------ HELPERS ------------------
+def get_version(conn: Connection) -> int:
+    return conn.exec_driver_sql("PRAGMA user_version").scalar() or 0
+
+def _set_version(conn: Connection, version: int):
+    conn.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+
+def _create_table(conn: Connection, table):
+    table.create(conn, checkfirst=True)
+
+def _create_index(conn: Connection, name: str, table: str, columns: str):
+    conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+def _column_names(conn: Connection, table: str) -> set:
+    return {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+
+def _add_column(conn: Connection, table: str, name: str, ddl: str):
+    if name not in _column_names(conn, table):
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}")
+
+def _add_archived_column(conn: Connection, model, name: str, ddl: str):
+    _add_column(conn, model.__tablename__, name, ddl)
+    _add_column(conn, models.ARCHIVES_OF[model].__table__.name, name, ddl)
+
+def _table_sql(conn: Connection, table: str) -> str:
+    return conn.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).scalar() or ""
+
+def _rebuild_table(conn: Connection, table):
+    # SQLite cannot change a table's primary key in place: build the model's
+    # current shape under a temporary name, copy the rows, drop the old table,
+    # rename, then recreate its indexes
+    temp = f"{table.name}_rebuild"
+    ddl = str(CreateTable(table).compile(dialect=conn.dialect))
+    ddl = ddl.replace(f"CREATE TABLE {table.name} (", f"CREATE TABLE {temp} (", 1)
+    columns = ", ".join(column.name for column in table.columns)
+    conn.exec_driver_sql(f"DROP TABLE IF EXISTS {temp}")
+    conn.exec_driver_sql(ddl)
+    conn.exec_driver_sql(f"INSERT INTO {temp} ({columns}) SELECT {columns} FROM {table.name}")
+    conn.exec_driver_sql(f"DROP TABLE {table.name}")
+    conn.exec_driver_sql(f"ALTER TABLE {temp} RENAME TO {table.name}")
+    for index in table.indexes:
+        index.create(conn, checkfirst=True)
+
+# ------------------ MIGRATIONS ------------------
+@migration(1, "baseline tables")
+def _baseline(conn: Connection):
+    for model in (models.User, models.Appointment, models.Prescription, models.Inventory,
+                  models.Payment, models.LabTest, models.EMR):
+        _create_table(conn, model.__table__)
+
+@migration(2, "foreign key and range-scan indexes")
+def _lookup_indexes(conn: Connection):
+    _create_index(conn, "ix_appointments_patient_id", "appointments", "patient_id")
+    _create_index(conn, "ix_appointments_doctor_date", "appointments", "doctor_id, appointment_date")
+    _create_index(conn, "ix_prescriptions_patient_id", "prescriptions", "patient_id")
+    _create_index(conn, "ix_prescriptions_appointment_id", "prescriptions", "appointment_id")
+    _create_index(conn, "ix_payments_user_id", "payments", "user_id")
+    _create_index(conn, "ix_lab_tests_patient_status", "lab_tests", "patient_id, status")
+    _create_index(conn, "ix_emr_patient_id", "emr", "patient_id")
+    _create_index(conn, "ix_emr_doctor_id", "emr", "doctor_id")
+
+@migration(3, "record version history for EMR and prescriptions")
+def _record_versions(conn: Connection):
+    for table in ("emr", "prescriptions"):
+        _add_column(conn, table, "version", "INTEGER NOT NULL DEFAULT 1")
+        _add_column(conn, table, "updated_on", "DATETIME")
+    _create_table(conn, models.RecordVersion.__table__)
+
+@migration(4, "archive tables for old clinical records")
+def _archive_tables(conn: Connection):
+    for model in (models.AppointmentArchive, models.PrescriptionArchive, models.PaymentArchive,
+                  models.LabTestArchive, models.EMRArchive):
+        _create_table(conn, model.__table__)
+
+@migration(5, "audit log for clinical record access")
+def _audit_log(conn: Connection):
+    _create_table(conn, models.AuditLog.__table__)
+
+@migration(6, "legacy ID map for bulk imports")
+def _legacy_ids(conn: Connection):
+    _create_table(conn, models.LegacyId.__table__)
+
+@migration(7, "indexes for business metric counts")
+def _metric_indexes(conn: Connection):
+    _create_index(conn, "ix_appointments_date_status", "appointments", "appointment_date, status")
+    _create_index(conn, "ix_inventory_quantity", "inventory", "quantity")
+    _create_index(conn, "ix_lab_tests_status", "lab_tests", "status")
+
+@migration(8, "doctor specialty")
+def _doctor_specialty(conn: Connection):
+    _add_column(conn, "users", "specialty", "VARCHAR(100)")
+
+# audit_log.resource_type of each audited clinical table
+AUDITED_AS = {models.EMR: "emr", models.Prescription: "prescription", models.LabTest: "lab_test"}
+
+@migration(9, "AUTOINCREMENT IDs for tables with archives")
+def _archived_ids(conn: Connection):
+    # Without it, an insert after the newest row was archived or deleted
+    # reissued that row's ID, and with it its archived copy, version history
+    # and audit trail. The driver would commit each DDL statement on its own;
+    # an explicit BEGIN makes the rebuilds all-or-nothing.
+    conn.exec_driver_sql("BEGIN IMMEDIATE")
+    for model, cold in models.ARCHIVES_OF.items():
+        hot = model.__table__
+        if "AUTOINCREMENT" not in _table_sql(conn, hot.name).upper():
+            _rebuild_table(conn, hot)
+        pk = hot.primary_key.columns.values()[0].name
+        # Start above every ID either tier or the audit log has seen, so IDs
+        # deleted before this migration are not reissued either
+        high = conn.exec_driver_sql(
+            f"SELECT max(coalesce((SELECT max({pk}) FROM {hot.name}), 0),"
+            f" coalesce((SELECT max({pk}) FROM {cold.__table__.name}), 0),"
+            " coalesce((SELECT max(resource_id) FROM audit_log WHERE resource_type = ?), 0))",
+            (AUDITED_AS.get(model, ""),),
+        ).scalar()
+        updated = conn.exec_driver_sql(
+            "UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = ?", (high, hot.name)
+        ).rowcount
+        if not updated:
+            conn.exec_driver_sql("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (hot.name, high))
+
+@migration(10, "change feed for record changes made outside the API")
+def _change_feed(conn: Connection):
+    _create_table(conn, models.ChangeFeed.__table__)
+
+@migration(11, "tombstones that keep the history of deleted records")
+def _deleted_records(conn: Connection):
+    _create_table(conn, models.DeletedRecord.__table__)
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# ------------------ RUNNER ------------------
+def current_version(engine: Engine) -> int:
+    with engine.connect() as conn:
+        return get_version(conn)
+
+def pending_migrations(engine: Engine) -> list:
+    version = current_version(engine)
+    return [m for m in MIGRATIONS if m[0] > version]
+
+def upgrade(engine: Engine, target: int = None, log=print) -> int:
+    # Each migration runs in its own short transaction so index builds only
+    # hold the SQLite write lock for one statement batch at a time, and live
+    # writers waiting on the lock resume between steps.
+    target = LATEST_VERSION if target is None else target
+    version = current_version(engine)
+    for number, description, fn in MIGRATIONS:
+        if number <= version or number > target:
+            continue
+        log(f"Applying migration {number}: {description}")
+        with engine.begin() as conn:
+            fn(conn)
+            _set_version(conn, number)
+        version = number
+    return version
+
+def check_schema(engine: Engine):
+    version = current_version(engine)
+    if version < LATEST_VERSION:
+        raise RuntimeError(
+            f"Database schema is at version {version}, expected {LATEST_VERSION}. "
+            "Run `python manage.py migrate` before starting the API."
+        )
+    return version
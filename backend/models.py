@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, Enum, ForeignKey, Text, DECIMAL
+from sqlalchemy import Column, Integer, String, DateTime, Enum, ForeignKey, Text, DECIMAL, Index, Boolean, LargeBinary, Table
+from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
 import enum
@@ -29,6 +30,14 @@ class LabTestStatusEnum(str, enum.Enum):
     Completed = "Completed"
 
 # Tables
+# Tables with an archive twin (see _archive_of) use AUTOINCREMENT: plain
+# INTEGER PRIMARY KEY hands out max(rowid) + 1, which could reissue the ID of
+# a row that has been archived or deleted.
+ARCHIVED_IDS = {"sqlite_autoincrement": True}
+
+# Relationships are many-to-one only and never lazy-load: load them with
+# selectinload() or, on the dict read path, with expand.py, so listing N rows
+# cannot turn into N extra queries.
 class User(Base):
     __tablename__ = "users"
     user_id = Column(Integer, primary_key=True, index=True)
@@ -38,6 +47,7 @@ class User(Base):
     role = Column(Enum(RoleEnum), nullable=False)
     phone_number = Column(String(15), unique=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    specialty = Column(String(100))
 
 class Appointment(Base):
     __tablename__ = "appointments"
@@ -47,6 +57,16 @@ class Appointment(Base):
     appointment_date = Column(DateTime, nullable=False)
     status = Column(Enum(StatusEnum), default="Pending")
 
+    patient = relationship("User", foreign_keys=[patient_id], lazy="raise_on_sql")
+    doctor = relationship("User", foreign_keys=[doctor_id], lazy="raise_on_sql")
+
+    __table_args__ = (
+        Index("ix_appointments_patient_id", "patient_id"),
+        Index("ix_appointments_doctor_date", "doctor_id", "appointment_date"),
+        Index("ix_appointments_date_status", "appointment_date", "status"),
+        ARCHIVED_IDS,
+    )
+
 class Prescription(Base):
     __tablename__ = "prescriptions"
     prescription_id = Column(Integer, primary_key=True, index=True)
@@ -55,6 +75,18 @@ class Prescription(Base):
     patient_id = Column(Integer, ForeignKey("users.user_id", ondelete="RESTRICT"))
     prescribed_on = Column(DateTime(timezone=True), server_default=func.now())
     notes = Column(Text)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    updated_on = Column(DateTime(timezone=True))
+
+    appointment = relationship("Appointment", lazy="raise_on_sql")
+    patient = relationship("User", foreign_keys=[patient_id], lazy="raise_on_sql")
+    doctor = relationship("User", foreign_keys=[doctor_id], lazy="raise_on_sql")
+
+    __table_args__ = (
+        Index("ix_prescriptions_patient_id", "patient_id"),
+        Index("ix_prescriptions_appointment_id", "appointment_id"),
+        ARCHIVED_IDS,
+    )
 
 class Inventory(Base):
     __tablename__ = "inventory"
@@ -64,6 +96,10 @@ class Inventory(Base):
     price = Column(DECIMAL(10, 2), nullable=False)
     quantity = Column(Integer, nullable=False)
 
+    __table_args__ = (
+        Index("ix_inventory_quantity", "quantity"),
+    )
+
 class Payment(Base):
     __tablename__ = "payments"
     payment_id = Column(Integer, primary_key=True, index=True)
@@ -73,6 +109,13 @@ class Payment(Base):
     status = Column(Enum(PaymentStatusEnum), default="Pending")
     transaction_date = Column(DateTime(timezone=True), server_default=func.now())
 
+    user = relationship("User", lazy="raise_on_sql")
+
+    __table_args__ = (
+        Index("ix_payments_user_id", "user_id"),
+        ARCHIVED_IDS,
+    )
+
 class LabTest(Base):
     __tablename__ = "lab_tests"
     test_id = Column(Integer, primary_key=True, index=True)
@@ -82,6 +125,14 @@ class LabTest(Base):
     result = Column(Text)
     status = Column(Enum(LabTestStatusEnum), default="Pending")
 
+    patient = relationship("User", lazy="raise_on_sql")
+
+    __table_args__ = (
+        Index("ix_lab_tests_patient_status", "patient_id", "status"),
+        Index("ix_lab_tests_status", "status"),
+        ARCHIVED_IDS,
+    )
+
 class EMR(Base):
     __tablename__ = "emr"
     emr_id = Column(Integer, primary_key=True, index=True)
@@ -89,3 +140,113 @@ class EMR(Base):
     doctor_id = Column(Integer, ForeignKey("users.user_id", ondelete="RESTRICT"))
     summary = Column(Text)
     created_on = Column(DateTime(timezone=True), server_default=func.now())
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    updated_on = Column(DateTime(timezone=True))
+
+    patient = relationship("User", foreign_keys=[patient_id], lazy="raise_on_sql")
+    doctor = relationship("User", foreign_keys=[doctor_id], lazy="raise_on_sql")
+
+    __table_args__ = (
+        Index("ix_emr_patient_id", "patient_id"),
+        Index("ix_emr_doctor_id", "doctor_id"),
+        ARCHIVED_IDS,
+    )
+
+# Prior versions of EMR summaries and prescription notes. The live row keeps
+# the current text; each entry here holds a compressed reverse delta that
+# rebuilds version N from version N + 1, or a periodic full snapshot.
+class RecordVersion(Base):
+    __tablename__ = "record_versions"
+    version_id = Column(Integer, primary_key=True)
+    record_type = Column(String(20), nullable=False)
+    record_id = Column(Integer, nullable=False)
+    version = Column(Integer, nullable=False)
+    created_on = Column(DateTime(timezone=True))
+    is_snapshot = Column(Boolean, nullable=False, default=False)
+    payload = Column(LargeBinary, nullable=False)
+
+    __table_args__ = (
+        Index("ux_record_versions_record", "record_type", "record_id", "version", unique=True),
+    )
+
+# Deleted EMRs and prescriptions. Their record_versions rows are kept, with
+# the last live version (`version`) stored as a full snapshot, and this row
+# remembers whose record it was for access checks.
+class DeletedRecord(Base):
+    __tablename__ = "deleted_records"
+    record_type = Column(String(20), primary_key=True)
+    record_id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False)
+    patient_id = Column(Integer)
+    doctor_id = Column(Integer)
+    deleted_on = Column(DateTime(timezone=True), server_default=func.now())
+
+# Who read or changed which clinical record, written in batches by audit.py
+class AuditLog(Base):
+    __tablename__ = "audit_log"
+    audit_id = Column(Integer, primary_key=True)
+    at = Column(DateTime(timezone=True), nullable=False)
+    actor = Column(String(100))
+    actor_role = Column(String(20))
+    action = Column(String(20), nullable=False)
+    resource_type = Column(String(20), nullable=False)
+    resource_id = Column(Integer)
+    outcome = Column(Integer, nullable=False)
+    client = Column(String(64))
+
+    __table_args__ = (
+        Index("ix_audit_log_resource", "resource_type", "resource_id"),
+        Index("ix_audit_log_actor_at", "actor", "at"),
+    )
+
+# Legacy system IDs of bulk-imported rows, used by importer.py to resolve
+# references between import files and to skip rows on a re-run
+class LegacyId(Base):
+    __tablename__ = "legacy_ids"
+    entity = Column(String(20), primary_key=True)
+    legacy_id = Column(String(64), primary_key=True)
+    new_id = Column(Integer, nullable=False)
+
+# Record changes made by processes other than the API (lab result ingestion),
+# replayed into the API's live event streams and metrics by change_feed.py.
+# AUTOINCREMENT, so IDs keep rising after old rows are pruned.
+class ChangeFeed(Base):
+    __tablename__ = "change_feed"
+    change_id = Column(Integer, primary_key=True)
+    at = Column(DateTime(timezone=True), nullable=False)
+    entity = Column(String(20), nullable=False)
+    action = Column(String(20), nullable=False)
+    record_id = Column(Integer, nullable=False)
+    payload = Column(Text, nullable=False)
+
+    __table_args__ = (
+        Index("ix_change_feed_at", "at"),
+        {"sqlite_autoincrement": True},
+    )
+
+# Cold storage for old clinical rows, filled by archive.py. Each archive table
+# mirrors its hot table's columns (without foreign keys or server defaults,
+# the rows arrive complete) plus when the row was moved. archive.move_batch
+# copies every current column of the hot table, so a migration that adds a
+# column to a hot table must add it to the twin too (migrations._add_archived_column).
+def _archive_of(model, class_name, *indexes):
+    hot = model.__table__
+    name = f"{hot.name}_archive"
+    table = Table(
+        name, Base.metadata,
+        *[Column(column.name, column.type, primary_key=column.primary_key) for column in hot.columns],
+        Column("archived_on", DateTime(timezone=True), server_default=func.now()),
+        *[Index(f"ix_{name}_{'_'.join(columns)}", *columns) for columns in indexes],
+    )
+    return type(class_name, (Base,), {"__table__": table})
+
+AppointmentArchive = _archive_of(Appointment, "AppointmentArchive", ("patient_id",), ("doctor_id", "appointment_date"))
+PrescriptionArchive = _archive_of(Prescription, "PrescriptionArchive", ("patient_id",), ("doctor_id",))
+PaymentArchive = _archive_of(Payment, "PaymentArchive", ("user_id",))
+LabTestArchive = _archive_of(LabTest, "LabTestArchive", ("patient_id",))
+EMRArchive = _archive_of(EMR, "EMRArchive", ("patient_id",), ("doctor_id",))
+
+ARCHIVES_OF = {
+    Appointment: AppointmentArchive, Prescription: PrescriptionArchive, Payment: PaymentArchive,
+    LabTest: LabTestArchive, EMR: EMRArchive,
+}
@@ -0,0 +1,81 @@
+import os
+import statistics
+import time
+
+from passlib.context import CryptContext
+from passlib.exc import MissingBackendError
+
+# Password hashing policy. PASSWORD_SCHEME picks the scheme new hashes use and
+# the *_ROUNDS / ARGON2_* settings its cost; every supported scheme still
+# verifies, so changing the policy never locks anyone out. A stored hash made
+# with another scheme or another cost is reported by `verify_and_update()`,
+# and crud.verify_user_credentials re-hashes it with the current policy on
+# the user's next successful login. `benchmark()` (manage.py bench-hash)
+# times each scheme on this host to help pick the costs.
+
+SCHEMES = ("bcrypt", "argon2", "pbkdf2_sha256")
+PASSWORD_SCHEME = os.getenv("PASSWORD_SCHEME", "bcrypt")
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536"))  # KiB
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "4"))
+PBKDF2_ROUNDS = int(os.getenv("PBKDF2_ROUNDS", "600000"))
+
+def build_context(scheme: str = PASSWORD_SCHEME, bcrypt_rounds: int = BCRYPT_ROUNDS,
+                  argon2_time_cost: int = ARGON2_TIME_COST, argon2_memory_cost: int = ARGON2_MEMORY_COST,
+                  argon2_parallelism: int = ARGON2_PARALLELISM, pbkdf2_rounds: int = PBKDF2_ROUNDS) -> CryptContext:
+    if scheme not in SCHEMES:
+        raise ValueError(f"Unknown password scheme {scheme!r}, expected one of {', '.join(SCHEMES)}")
+    # min = max = default, so hashes of any other cost count as outdated
+    return CryptContext(
+        schemes=[scheme] + [other for other in SCHEMES if other != scheme],
+        default=scheme,
+        deprecated="auto",
+        bcrypt__default_rounds=bcrypt_rounds, bcrypt__min_rounds=bcrypt_rounds, bcrypt__max_rounds=bcrypt_rounds,
+        argon2__default_rounds=argon2_time_cost, argon2__min_rounds=argon2_time_cost, argon2__max_rounds=argon2_time_cost,
+        argon2__memory_cost=argon2_memory_cost, argon2__parallelism=argon2_parallelism,
+        pbkdf2_sha256__default_rounds=pbkdf2_rounds, pbkdf2_sha256__min_rounds=pbkdf2_rounds,
+        pbkdf2_sha256__max_rounds=pbkdf2_rounds,
+    )
+
+context = build_context()
+
+def hash_password(password: str) -> str:
+    return context.hash(password)
+
+def verify_password(password: str, password_hash: str) -> bool:
+    return context.verify(password, password_hash)
+
+def verify_and_update(password: str, password_hash: str) -> tuple[bool, str]:
+    # (matches, replacement hash or None when the stored one is current)
+    return context.verify_and_update(password, password_hash)
+
+# ------------------ BENCHMARK ------------------
+def benchmark(schemes=SCHEMES, repeat: int = 5, ctx: CryptContext = None) -> list[dict]:
+    # Median hash and verify time per scheme with the configured costs
+    ctx = ctx or context
+    results = []
+    for scheme in schemes:
+        handler = ctx.handler(scheme)
+        settings = {name: getattr(handler, name) for name in ("default_rounds", "memory_cost", "parallelism")
+                    if getattr(handler, name, None) is not None}
+        try:
+            hash_times, verify_times = [], []
+            for attempt in range(repeat):
+                password = f"benchmark-password-{attempt}"
+                started = time.perf_counter()
+                hashed = ctx.hash(password, scheme=scheme)
+                hash_times.append(time.perf_counter() - started)
+                started = time.perf_counter()
+                ctx.verify(password, hashed)
+                verify_times.append(time.perf_counter() - started)
+        except MissingBackendError as exc:
+            results.append({"scheme": scheme, "settings": settings, "error": str(exc)})
+            continue
+        results.append({
+            "scheme": scheme,
+            "settings": settings,
+            "hash_ms": statistics.median(hash_times) * 1000,
+            "verify_ms": statistics.median(verify_times) * 1000,
+        })
+    return results
@@ -0,0 +1,188 @@
+import abc
+import asyncio
+import logging
+import random
+import time
+from collections import namedtuple
+
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import select, update
+import models, clinic_metrics
+from database import current_tenant, shards
+
+# Settles Pending payments against their payment gateways. The reconciler
+# pages through Pending payments by ID, asks the gateway registered for each
+# payment_method about every payment of the page concurrently (each gateway
+# has its own concurrency limit), then applies the settled statuses in one
+# executemany transaction. An update only lands while the row is still
+# Pending, so an admin's manual PUT in the meantime wins. Gateways are
+# adapters registered per PaymentMethodEnum; FakeGateway stands in for the
+# real Card, Easypaisa and JazzCash APIs until those are wired up.
+
+BATCH_SIZE = 200
+LOOP_INTERVAL = 60.0
+
+logger = logging.getLogger("payment_reconciler")
+
+gateway_checks = Counter(
+    "payment_gateway_checks_total", "Gateway status lookups by outcome", ["gateway", "outcome"]
+)
+gateway_seconds = Histogram("payment_gateway_seconds", "Gateway status lookup latency", ["gateway"])
+payments_settled = Counter("payment_reconcile_updates_total", "Payment statuses changed by reconciliation", ["status"])
+batch_seconds = Histogram("payment_reconcile_batch_seconds", "Time to reconcile one batch of payments")
+last_run = Gauge("payment_reconcile_last_run_timestamp_seconds", "Unix time the last reconciliation pass finished", ["clinic"])
+
+Settlement = namedtuple("Settlement", ["payment_id", "status"])
+
+class GatewayError(Exception):
+    pass
+
+# ------------------ GATEWAYS ------------------
+class PaymentGateway(abc.ABC):
+    # Adapters answer with a PaymentStatusEnum, Pending while not yet settled
+    name = "gateway"
+    concurrency = 4
+
+    @abc.abstractmethod
+    async def fetch_status(self, payment_id: int, amount: float) -> models.PaymentStatusEnum:
+        ...
+
+class FakeGateway(PaymentGateway):
+    # Outcomes are derived from the payment ID, so reruns agree with each
+    # other; latency and transient errors are random like a real network.
+    def __init__(self, name: str, concurrency: int = 4, latency=(0.02, 0.2), failure_rate: float = 0.1,
+                 pending_rate: float = 0.1, error_rate: float = 0.02):
+        self.name = name
+        self.concurrency = concurrency
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.pending_rate = pending_rate
+        self.error_rate = error_rate
+
+    async def fetch_status(self, payment_id: int, amount: float) -> models.PaymentStatusEnum:
+        await asyncio.sleep(random.uniform(*self.latency))
+        if random.random() < self.error_rate:
+            raise GatewayError(f"{self.name} timed out")
+        roll = random.Random(f"{self.name}:{payment_id}").random()
+        if roll < self.pending_rate:
+            return models.PaymentStatusEnum.Pending
+        if roll < self.pending_rate + self.failure_rate:
+            return models.PaymentStatusEnum.Failed
+        return models.PaymentStatusEnum.Success
+
+GATEWAYS = {
+    models.PaymentMethodEnum.Card: FakeGateway("card", concurrency=16, latency=(0.02, 0.1)),
+    models.PaymentMethodEnum.Easypaisa: FakeGateway("easypaisa", concurrency=4, latency=(0.05, 0.3)),
+    models.PaymentMethodEnum.JazzCash: FakeGateway("jazzcash", concurrency=4, latency=(0.05, 0.3)),
+}
+
+def register_gateway(method: models.PaymentMethodEnum, gateway: PaymentGateway):
+    GATEWAYS[method] = gateway
+
+# ------------------ RECONCILER ------------------
+class PaymentReconciler:
+    def __init__(self, tenant: str, gateways: dict = None, batch_size: int = BATCH_SIZE, log=print):
+        self.tenant = tenant
+        self.engine = shards.get(tenant)
+        self.gateways = gateways or GATEWAYS
+        self.batch_size = batch_size
+        self.log = log
+        # Created per pass, since semaphores belong to the running event loop
+        self._limits = {}
+
+    def _pending_page(self, after_id: int) -> list:
+        with self.engine.connect() as conn:
+            return conn.execute(
+                select(models.Payment.payment_id, models.Payment.payment_method, models.Payment.amount)
+                .where(models.Payment.status == models.PaymentStatusEnum.Pending, models.Payment.payment_id > after_id)
+                .order_by(models.Payment.payment_id)
+                .limit(self.batch_size)
+            ).all()
+
+    def _apply(self, settlements: list) -> list:
+        # Returns the settlements that were written; a payment that left
+        # Pending meanwhile (say an admin's update won) is skipped. One UPDATE
+        # per outcome status, since RETURNING cannot be used with executemany.
+        by_status = {}
+        for settlement in settlements:
+            by_status.setdefault(settlement.status, []).append(settlement.payment_id)
+        table = models.Payment.__table__
+        applied = []
+        with self.engine.begin() as conn:
+            for status, payment_ids in by_status.items():
+                result = conn.execute(
+                    update(table)
+                    .where(table.c.payment_id.in_(payment_ids), table.c.status == models.PaymentStatusEnum.Pending.value)
+                    .values(status=status.value)
+                    .returning(table.c.payment_id)
+                )
+                applied.extend(Settlement(payment_id, status) for payment_id in result.scalars())
+        return applied
+
+    async def _check(self, payment_id: int, method, amount):
+        # Returns (outcome, Settlement or None)
+        gateway = self.gateways.get(models.PaymentMethodEnum(method))
+        if gateway is None:
+            gateway_checks.labels(gateway=str(method), outcome="no_gateway").inc()
+            return "error", None
+        limit = self._limits.setdefault(gateway.name, asyncio.Semaphore(gateway.concurrency))
+        async with limit:
+            started = time.perf_counter()
+            try:
+                status = await gateway.fetch_status(payment_id, float(amount))
+            except Exception as exc:
+                gateway_checks.labels(gateway=gateway.name, outcome="error").inc()
+                logger.warning("Gateway %s failed for payment %s: %s", gateway.name, payment_id, exc)
+                return "error", None
+            finally:
+                gateway_seconds.labels(gateway=gateway.name).observe(time.perf_counter() - started)
+        gateway_checks.labels(gateway=gateway.name, outcome=status.value.lower()).inc()
+        if status == models.PaymentStatusEnum.Pending:
+            return "pending", None
+        return "settled", Settlement(payment_id, status)
+
+    async def run_once(self) -> dict:
+        self._limits = {}
+        totals = {"checked": 0, "settled": 0, "errors": 0}
+        token = current_tenant.set(self.tenant)
+        started = time.perf_counter()
+        try:
+            after_id = 0
+            while True:
+                page = await asyncio.to_thread(self._pending_page, after_id)
+                if not page:
+                    break
+                batch_started = time.perf_counter()
+                results = await asyncio.gather(*(self._check(*row) for row in page))
+                settlements = [settlement for _, settlement in results if settlement is not None]
+                applied = await asyncio.to_thread(self._apply, settlements)
+                batch_seconds.observe(time.perf_counter() - batch_started)
+                for settlement in applied:
+                    payments_settled.labels(status=settlement.status.value).inc()
+                    clinic_metrics.payment_changed(models.PaymentStatusEnum.Pending, settlement.status)
+                totals["checked"] += len(page)
+                totals["settled"] += len(applied)
+                totals["errors"] += sum(1 for outcome, _ in results if outcome == "error")
+                after_id = page[-1].payment_id
+        finally:
+            current_tenant.reset(token)
+        elapsed = time.perf_counter() - started
+        last_run.labels(clinic=self.tenant).set_to_current_time()
+        self.log(f"[{self.tenant}] checked {totals['checked']} pending payments, settled {totals['settled']}, "
+                 f"{totals['errors']} gateway errors in {elapsed:.1f}s ({totals['checked'] / elapsed if elapsed else 0:,.0f}/s)")
+        return totals
+
+async def reconcile(tenants, batch_size: int = BATCH_SIZE, loop: bool = False,
+                    interval: float = LOOP_INTERVAL, log=print):
+    # `tenants()` is re-read every pass, so newly provisioned clinics join in
+    while True:
+        for tenant in tenants():
+            try:
+                await PaymentReconciler(tenant, batch_size=batch_size, log=log).run_once()
+            except Exception:
+                if not loop:
+                    raise
+                logger.exception("Reconciling payments of clinic %r failed", tenant)
+        if not loop:
+            return
+        await asyncio.sleep(interval)
@@ -0,0 +1,188 @@
+import ipaddress
+import json
+import math
+import os
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import parse_qs
+
+from prometheus_client import Counter
+
+# Token buckets checked in front of the auth routes, before any request
+# reaches bcrypt. `rate` is tokens refilled per second, `burst` the bucket size.
+Limit = namedtuple("Limit", ["rate", "burst"])
+
+RATE_LIMITS = {
+    "/login": {"ip": Limit(rate=20 / 60, burst=20), "email": Limit(rate=5 / 60, burst=5)},
+    "/signup": {"ip": Limit(rate=5 / 60, burst=5)},
+    "/reset-password": {"ip": Limit(rate=5 / 60, burst=5), "email": Limit(rate=3 / 300, burst=3)},
+}
+
+MAX_BODY_BYTES = 64 * 1024
+
+# Peers whose X-Forwarded-For is believed (the web frontend, a reverse proxy),
+# as comma-separated addresses or CIDR ranges. Requests they relay are limited
+# per original client instead of all sharing the proxy's own IP bucket.
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(entry.strip(), strict=False)
+    for entry in os.getenv("TRUSTED_PROXIES", "").split(",") if entry.strip()
+]
+
+rate_limit_rejections = Counter(
+    "rate_limit_rejections_total",
+    "Requests rejected by the rate limiter",
+    ["route", "key"],
+)
+
+# ------------------ BUCKET STORE ------------------
+class BucketStore:
+    # key -> (tokens, updated_at, full_at). A bucket past `full_at` has refilled
+    # completely and is indistinguishable from a new one, so sweeps drop it.
+    def __init__(self, max_entries: int = 100_000, sweep_every: int = 1000):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._max_entries = max_entries
+        self._sweep_every = sweep_every
+        self._ops = 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key, limit: Limit, now: float = None) -> float:
+        # Returns 0 when a token was taken, otherwise seconds until one is available.
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (limit.burst, now, now))
+            tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / limit.rate
+            self._buckets[key] = (tokens, now, now + (limit.burst - tokens) / limit.rate)
+            self._ops += 1
+            if self._ops >= self._sweep_every or len(self._buckets) > self._max_entries:
+                self._sweep(now)
+        return wait
+
+    def _sweep(self, now: float):
+        self._ops = 0
+        expired = [k for k, (_, _, full_at) in self._buckets.items() if full_at <= now]
+        for k in expired:
+            del self._buckets[k]
+        overflow = len(self._buckets) - self._max_entries
+        if overflow > 0:
+            for k in list(self._buckets)[:overflow]:
+                del self._buckets[k]
+
+# ------------------ MIDDLEWARE ------------------
+def _extract_email(body: bytes, content_type: str):
+    try:
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            form = parse_qs(body.decode("utf-8"))
+            values = form.get("username") or form.get("email")
+            email = values[0] if values else None
+        elif content_type.startswith("application/json"):
+            data = json.loads(body or b"{}")
+            email = data.get("email") if isinstance(data, dict) else None
+        else:
+            return None
+    except (UnicodeDecodeError, ValueError):
+        return None
+    return email.strip().lower() if isinstance(email, str) and email.strip() else None
+
+class RateLimitMiddleware:
+    def __init__(self, app, limits: dict = None, store: BucketStore = None, trusted_proxies: list = None):
+        self.app = app
+        self.limits = RATE_LIMITS if limits is None else limits
+        self.store = store or BucketStore()
+        self.trusted_proxies = TRUSTED_PROXIES if trusted_proxies is None else trusted_proxies
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.limits:
+            await self.app(scope, receive, send)
+            return
+
+        route = scope["path"]
+        rules = self.limits[route]
+        headers = dict(scope["headers"])
+
+        wait = 0.0
+        if "ip" in rules:
+            wait = self.store.take((route, "ip", self._client_ip(scope, headers)), rules["ip"])
+            if wait:
+                rate_limit_rejections.labels(route=route, key="ip").inc()
+
+        if not wait and "email" in rules:
+            body, receive = await self._buffer_body(receive)
+            content_type = headers.get(b"content-type", b"").decode("latin-1")
+            email = _extract_email(body, content_type)
+            if email:
+                # The same address may exist in several clinics
+                clinic = headers.get(b"x-clinic-id", b"").decode("latin-1").strip().lower()
+                wait = self.store.take((route, "email", clinic, email), rules["email"])
+                if wait:
+                    rate_limit_rejections.labels(route=route, key="email").inc()
+
+        if wait:
+            await self._reject(send, wait)
+            return
+        await self.app(scope, receive, send)
+
+    def _trusted(self, address: str) -> bool:
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in network for network in self.trusted_proxies)
+
+    def _client_ip(self, scope, headers) -> str:
+        client = scope.get("client")
+        peer = client[0] if client else "unknown"
+        if b"x-forwarded-for" not in headers or not self._trusted(peer):
+            return peer
+        # Walk back past our own proxies; the first other hop is the client,
+        # anything left of it could have been written by the client itself
+        hops = headers[b"x-forwarded-for"].decode("latin-1").split(",")
+        for hop in reversed([hop.strip() for hop in hops]):
+            if hop and not self._trusted(hop):
+                return hop
+        return peer
+
+    async def _buffer_body(self, receive):
+        chunks, size, more = [], 0, True
+        while more:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            chunks.append(chunk)
+            more = message.get("more_body", False)
+            if size > MAX_BODY_BYTES:
+                break
+        body = b"".join(chunks)
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": more}
+            return await receive()
+
+        return body, replay
+
+    async def _reject(self, send, wait: float):
+        payload = json.dumps({"detail": "Too many requests, please retry later"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(payload)).encode()),
+                (b"retry-after", str(max(1, math.ceil(wait))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": payload})
@@ -55,6 +55,7 @@ class UserBase(BaseModel):
     password: constr(min_length=6)  # change from password_hash
     role: RoleEnum
     phone_number: constr(min_length=10, max_length=15)
+    specialty: Optional[constr(max_length=100)] = None
 
 class UserCreate(UserBase):
     pass
@@ -66,8 +67,14 @@ class UserOut(BaseModel):
     role: RoleEnum
     phone_number: str
     created_at: datetime
+    specialty: Optional[str] = None
     model_config = ConfigDict(from_attributes=True)
 
+class UserSummary(BaseModel):
+    user_id: int
+    full_name: str
+    role: RoleEnum
+
 class UserWithToken(BaseModel):
     user: UserOut
     token: TokenResponse
@@ -86,6 +93,39 @@ class AppointmentOut(AppointmentBase):
     appointment_id: int
     model_config = ConfigDict(from_attributes=True)
 
+class AppointmentSummary(BaseModel):
+    appointment_id: int
+    appointment_date: datetime
+    status: StatusEnum
+
+class AppointmentExpandedOut(AppointmentOut):
+    # Present only when requested with ?expand=
+    patient: Optional[UserSummary] = None
+    doctor: Optional[UserSummary] = None
+
+# ------------------ DOCTOR DIRECTORY ------------------
+class DoctorOut(BaseModel):
+    user_id: int
+    full_name: str
+    specialty: Optional[str] = None
+
+# ------------------ DOCTOR CALENDAR ------------------
+class CalendarGranularityEnum(str, Enum):
+    day = "day"
+    hour = "hour"
+
+class CalendarBucket(BaseModel):
+    start: datetime
+    count: int
+    appointments: list[AppointmentOut]
+
+class DoctorCalendarOut(BaseModel):
+    doctor_id: int
+    start: datetime
+    end: datetime
+    granularity: CalendarGranularityEnum
+    buckets: list[CalendarBucket]
+
 # ------------------ PRESCRIPTION ------------------
 class PrescriptionBase(BaseModel):
     appointment_id: int
@@ -99,8 +139,21 @@ class PrescriptionCreate(PrescriptionBase):
 class PrescriptionOut(PrescriptionBase):
     prescription_id: int
     prescribed_on: datetime
+    version: int = 1
+    updated_on: Optional[datetime] = None
     model_config = ConfigDict(from_attributes=True)
 
+class PrescriptionExpandedOut(PrescriptionOut):
+    appointment: Optional[AppointmentSummary] = None
+    patient: Optional[UserSummary] = None
+    doctor: Optional[UserSummary] = None
+
+class PrescriptionVersionOut(BaseModel):
+    prescription_id: int
+    version: int
+    created_on: Optional[datetime] = None
+    notes: Optional[str] = None
+
 # ------------------ INVENTORY ------------------
 class InventoryBase(BaseModel):
     name: constr(min_length=2)
@@ -145,6 +198,13 @@ class LabTestOut(LabTestBase):
     date_requested: datetime
     model_config = ConfigDict(from_attributes=True)
 
+class LabResultIn(BaseModel):
+    # One row of an analyzer result file; see lab_ingest.py
+    patient_id: int
+    test_type: constr(strip_whitespace=True, min_length=1)
+    result: constr(strip_whitespace=True, min_length=1)
+    test_id: Optional[int] = None
+
 # ------------------ EMR ------------------
 class EMRBase(BaseModel):
     patient_id: int
@@ -157,4 +217,77 @@ class EMRCreate(EMRBase):
 class EMROut(EMRBase):
     emr_id: int
     created_on: datetime
+    version: int = 1
+    updated_on: Optional[datetime] = None
     model_config = ConfigDict(from_attributes=True)
+
+class EMRExpandedOut(EMROut):
+    patient: Optional[UserSummary] = None
+    doctor: Optional[UserSummary] = None
+
+class EMRVersionOut(BaseModel):
+    emr_id: int
+    version: int
+    created_on: Optional[datetime] = None
+    summary: Optional[str] = None
+
+# ------------------ VERSION HISTORY ------------------
+class RecordVersionInfo(BaseModel):
+    version: int
+    created_on: Optional[datetime] = None
+    is_current: bool = False
+    stored_bytes: int = 0
+
+# ------------------ PATIENT TIMELINE ------------------
+class TimelineKindEnum(str, Enum):
+    appointment = "appointment"
+    prescription = "prescription"
+    lab_test = "lab_test"
+    emr = "emr"
+    payment = "payment"
+
+class TimelineEntry(BaseModel):
+    kind: TimelineKindEnum
+    record_id: int
+    at: Optional[datetime] = None
+    archived: bool = False
+    status: Optional[str] = None
+    doctor_id: Optional[int] = None
+    detail: Optional[str] = None
+
+# ------------------ AUDIT LOG ------------------
+class AuditLogOut(BaseModel):
+    audit_id: int
+    at: datetime
+    actor: Optional[str] = None
+    actor_role: Optional[str] = None
+    action: str
+    resource_type: str
+    resource_id: Optional[int] = None
+    outcome: int
+    client: Optional[str] = None
+    model_config = ConfigDict(from_attributes=True)
+
+# ------------------ CLINIC SHARDS ------------------
+class ShardCreate(BaseModel):
+    clinic_id: constr(pattern=r"^[a-z0-9][a-z0-9_-]{0,62}$")
+
+class ShardOut(BaseModel):
+    clinic_id: str
+    path: str
+    size_bytes: int
+    schema_version: int
+    open: bool
+
+# ------------------ BACKUPS ------------------
+class BackupOut(BaseModel):
+    clinic_id: str
+    file: str
+    created_at: datetime
+    size_bytes: int
+    duration_seconds: float
+    restarts: int = 0
+
+class BackupStatusOut(BaseModel):
+    running: list[str]
+    backups: list[BackupOut]
@@ -0,0 +1,174 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Per-request SQL trace for development and staging. With SQL_TRACE=1 in the
+# environment, SQLTraceMiddleware records every statement a request runs
+# (on the default engine and every clinic shard), groups them by shape with
+# literals and IN-lists collapsed, and flags shapes repeated N_PLUS_ONE_THRESHOLD
+# times or more as a likely N+1. A one-line summary goes out in the
+# X-SQL-Trace header and the full trace stays available for a while at
+# /debug/requests/{id}. When disabled neither the engine listeners nor the
+# middleware are installed, so requests pay nothing. Bound parameters are
+# never recorded, since they may hold patient data.
+
+SQL_TRACE = os.getenv("SQL_TRACE", "0") == "1"
+N_PLUS_ONE_THRESHOLD = 5
+TRACE_HISTORY = 200
+TRACE_HEADER = b"x-sql-trace"
+REQUEST_ID_HEADER = b"x-debug-request-id"
+
+logger = logging.getLogger("sqltrace")
+
+current_trace = ContextVar("current_trace", default=None)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE = re.compile(r"\s+")
+
+def statement_shape(sql: str) -> str:
+    shape = _STRING.sub("?", sql)
+    shape = _NUMBER.sub("?", shape)
+    shape = _IN_LIST.sub("(?...)", shape)
+    return _SPACE.sub(" ", shape).strip()
+
+# ------------------ TRACE ------------------
+class RequestTrace:
+    def __init__(self, method: str, path: str):
+        self.request_id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.started = time.time()
+        self.status = None
+        self.duration_ms = 0.0
+        self.statements = []
+        self._lock = threading.Lock()
+
+    def record(self, sql: str, duration_ms: float, many: bool):
+        with self._lock:
+            self.statements.append((sql, duration_ms, many))
+
+    def summary(self) -> dict:
+        with self._lock:
+            statements = list(self.statements)
+        shapes = OrderedDict()
+        for sql, duration_ms, _ in statements:
+            entry = shapes.setdefault(statement_shape(sql), {"count": 0, "total_ms": 0.0})
+            entry["count"] += 1
+            entry["total_ms"] += duration_ms
+        repeated = [
+            {"shape": shape, "count": entry["count"], "total_ms": round(entry["total_ms"], 3)}
+            for shape, entry in shapes.items() if entry["count"] > 1
+        ]
+        return {
+            "request_id": self.request_id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "duration_ms": round(self.duration_ms, 3),
+            "query_count": len(statements),
+            "sql_ms": round(sum(duration_ms for _, duration_ms, _ in statements), 3),
+            "repeated": repeated,
+            "n_plus_one": [entry for entry in repeated
+                           if entry["count"] >= N_PLUS_ONE_THRESHOLD and entry["shape"].upper().startswith("SELECT")],
+            "statements": [{"sql": sql, "ms": round(duration_ms, 3), "executemany": many}
+                           for sql, duration_ms, many in statements],
+        }
+
+    def header(self, summary: dict) -> bytes:
+        return (f"id={self.request_id}; queries={summary['query_count']}; sql_ms={summary['sql_ms']}; "
+                f"n_plus_one={len(summary['n_plus_one'])}").encode("latin-1")
+
+class TraceStore:
+    def __init__(self, max_entries: int = TRACE_HISTORY):
+        self._traces = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_entries = max_entries
+
+    def add(self, summary: dict):
+        with self._lock:
+            self._traces[summary["request_id"]] = summary
+            while len(self._traces) > self._max_entries:
+                self._traces.popitem(last=False)
+
+    def get(self, request_id: str):
+        with self._lock:
+            return self._traces.get(request_id)
+
+    def recent(self, limit: int = 50) -> list[dict]:
+        with self._lock:
+            summaries = list(self._traces.values())[-limit:]
+        return [{key: value for key, value in summary.items() if key != "statements"}
+                for summary in reversed(summaries)]
+
+traces = TraceStore()
+
+# ------------------ ENGINE LISTENERS ------------------
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_trace.get() is not None:
+        context._sqltrace_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    trace = current_trace.get()
+    started = getattr(context, "_sqltrace_started", None)
+    if trace is not None and started is not None:
+        trace.record(statement, (time.perf_counter() - started) * 1000, executemany)
+
+_installed = False
+
+def install():
+    # Listening on the Engine class covers shard engines opened later too
+    global _installed
+    if not _installed:
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        _installed = True
+
+# ------------------ MIDDLEWARE ------------------
+class SQLTraceMiddleware:
+    def __init__(self, app, skip_paths=("/metrics", "/debug/")):
+        self.app = app
+        self.skip_paths = skip_paths
+        install()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.skip_paths):
+            await self.app(scope, receive, send)
+            return
+        trace = RequestTrace(scope["method"], scope["path"])
+        token = current_trace.set(trace)
+        started = time.perf_counter()
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                trace.status = message["status"]
+                trace.duration_ms = (time.perf_counter() - started) * 1000
+                summary = trace.summary()
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + [
+                    (REQUEST_ID_HEADER, trace.request_id.encode()),
+                    (TRACE_HEADER, trace.header(summary)),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace)
+        finally:
+            current_trace.reset(token)
+            # Statements run while streaming the body are included here
+            trace.duration_ms = (time.perf_counter() - started) * 1000
+            summary = trace.summary()
+            traces.add(summary)
+            if summary["n_plus_one"]:
+                logger.warning("Possible N+1 in %s %s (request %s): %s", trace.method, trace.path, trace.request_id,
+                               json.dumps([(entry["count"], entry["shape"]) for entry in summary["n_plus_one"]]))
@@ -0,0 +1,89 @@
+import json
+import os
+
+from jose import jwt, JWTError
+import migrations
+from auth import SECRET_KEY, ALGORITHM
+from database import DEFAULT_TENANT, TENANT_ID, current_tenant, shards
+
+# Picks the clinic for each request. A bearer token's `tenant` claim wins
+# (tokens minted before sharding belong to the default clinic); requests
+# without a token, such as /login and /signup, name their clinic with the
+# X-Clinic-ID header. A header that disagrees with the token is rejected,
+# so a token can never be replayed against another clinic's database.
+
+TENANT_HEADER = b"x-clinic-id"
+
+def _token_tenant(authorization: bytes):
+    scheme, _, token = authorization.decode("latin-1").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        # Left for get_current_user to reject with a 401
+        return None
+    return claims.get("tenant", DEFAULT_TENANT)
+
+class TenantMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        claimed = _token_tenant(headers.get(b"authorization", b""))
+        requested = headers.get(TENANT_HEADER, b"").decode("latin-1").strip().lower() or None
+        if claimed and requested and claimed != requested:
+            await self._send_json(send, 403, {"detail": "Token was issued for a different clinic"})
+            return
+        tenant = claimed or requested or DEFAULT_TENANT
+        if not shards.exists(tenant):
+            await self._send_json(send, 404, {"detail": f"Unknown clinic {tenant!r}"})
+            return
+        scope.setdefault("state", {})["tenant"] = tenant
+        token = current_tenant.set(tenant)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_tenant.reset(token)
+
+    async def _send_json(self, send, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+# ------------------ SHARD ADMINISTRATION ------------------
+def shard_info(tenant: str) -> dict:
+    path = shards.path(tenant)
+    return {
+        "clinic_id": tenant,
+        "path": path,
+        "size_bytes": os.path.getsize(path) if os.path.exists(path) else 0,
+        "schema_version": migrations.current_version(shards.get(tenant)),
+        "open": tenant in shards.open_tenants(),
+    }
+
+def list_shards() -> list[dict]:
+    return [shard_info(tenant) for tenant in shards.tenants()]
+
+def provision(tenant: str, log=print) -> dict:
+    if not TENANT_ID.match(tenant):
+        raise ValueError("Clinic IDs are 1-63 lowercase letters, digits, '-' or '_'")
+    if shards.exists(tenant):
+        raise FileExistsError(f"Clinic {tenant!r} already exists")
+    migrations.upgrade(shards.get(tenant, create=True), log=log)
+    return shard_info(tenant)
+
+def upgrade_all(target: int = None, log=print) -> dict:
+    versions = {}
+    for tenant in shards.tenants():
+        log(f"[{tenant}]")
+        versions[tenant] = migrations.upgrade(shards.get(tenant), target=target, log=log)
+    return versions
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine, insert
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models, migrations
+
+# Each test gets its own file-backed SQLite database, migrated to the latest
+# schema, so WAL/locking behaviour matches production rather than :memory:.
+
+def make_engine(path):
+    return create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = make_engine(tmp_path / "test.db")
+    migrations.upgrade(engine, log=lambda *_: None)
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [
+            {"user_id": 1, "full_name": "Test Patient", "email": "p@test.example", "password_hash": "x", "role": "Patient"},
+            {"user_id": 2, "full_name": "Test Doctor", "email": "d@test.example", "password_hash": "x", "role": "Doctor"},
+        ])
+    yield engine
+    engine.dispose()
@@ -0,0 +1,131 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, event, func, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+import models, schemas, crud, migrations, group_commit
+from database import current_tenant
+from conftest import make_engine
+
+def appointment(minutes: int = 0):
+    return models.Appointment(patient_id=1, doctor_id=2, status="Pending",
+                              appointment_date=datetime(2024, 1, 1, 8, 0) + timedelta(minutes=minutes))
+
+def count(engine, model) -> int:
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(model)).scalar()
+
+@pytest.fixture
+def committer(engine):
+    committer = group_commit.GroupCommitter(engine_for=lambda tenant: engine, window=0.02)
+    yield committer
+    committer.stop()
+
+def test_add_returns_committed_row_with_server_defaults(engine, committer):
+    payment = committer.add(models.Payment(user_id=1, amount=10, payment_method="Card", status="Pending"))
+    assert payment.payment_id is not None
+    assert payment.transaction_date is not None
+    assert count(engine, models.Payment) == 1
+
+def test_concurrent_adds_are_grouped_into_fewer_commits(engine, committer):
+    commits = []
+    event.listen(engine, "commit", lambda conn: commits.append(1))
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        created = list(pool.map(lambda n: committer.add(appointment(n)), range(64)))
+    ids = [appt.appointment_id for appt in created]
+    assert len(set(ids)) == 64
+    assert count(engine, models.Appointment) == 64
+    assert len(commits) < 64
+
+def test_bad_row_fails_only_its_own_caller(engine, committer):
+    barrier = threading.Barrier(3)
+
+    def add(obj):
+        barrier.wait()
+        return committer.add(obj)
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        good = [pool.submit(add, appointment(n)) for n in range(2)]
+        # name is NOT NULL
+        bad = pool.submit(add, models.Inventory(name=None, price=1, quantity=1))
+        assert all(future.result().appointment_id for future in good)
+        with pytest.raises(IntegrityError):
+            bad.result()
+    assert count(engine, models.Appointment) == 2
+    assert count(engine, models.Inventory) == 0
+
+def test_rows_are_committed_to_their_own_clinic(tmp_path, engine):
+    north = make_engine(tmp_path / "north.db")
+    migrations.upgrade(north, log=lambda *_: None)
+    engines = {"default": engine, "north": north}
+    committer = group_commit.GroupCommitter(engine_for=engines.__getitem__, window=0.02)
+
+    def add_in(tenant, minutes):
+        token = current_tenant.set(tenant)
+        try:
+            return committer.add(appointment(minutes))
+        finally:
+            current_tenant.reset(token)
+
+    try:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda n: add_in("north" if n % 4 == 0 else "default", n), range(20)))
+    finally:
+        committer.stop()
+    assert count(north, models.Appointment) == 5
+    assert count(engine, models.Appointment) == 15
+    north.dispose()
+
+def test_commit_failure_reaches_every_caller_of_the_group():
+    def broken(tenant):
+        raise RuntimeError("clinic database unavailable")
+
+    committer = group_commit.GroupCommitter(engine_for=broken, window=0.02)
+    try:
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = [pool.submit(committer.add, appointment(n)) for n in range(4)]
+            for future in futures:
+                with pytest.raises(RuntimeError):
+                    future.result(timeout=5)
+    finally:
+        committer.stop()
+
+def test_stop_commits_rows_already_queued(engine):
+    committer = group_commit.GroupCommitter(engine_for=lambda tenant: engine, window=0.02)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(committer.add, appointment(n)) for n in range(8)]
+        committer.stop()
+        assert all(future.result(timeout=5).appointment_id for future in futures)
+    assert count(engine, models.Appointment) == 8
+
+def test_crud_creates_do_not_starve_the_writer_of_connections(tmp_path, monkeypatch):
+    # Callers waiting on the writer must not hold pooled connections it needs
+    engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", connect_args={"check_same_thread": False},
+                           pool_size=2, max_overflow=0, pool_timeout=5)
+    migrations.upgrade(engine, log=lambda *_: None)
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [
+            {"user_id": 1, "full_name": "Test Patient", "email": "p@test.example", "password_hash": "x", "role": "Patient"},
+            {"user_id": 2, "full_name": "Test Doctor", "email": "d@test.example", "password_hash": "x", "role": "Doctor"},
+        ])
+    committer = group_commit.GroupCommitter(engine_for=lambda tenant: engine, window=0.02)
+    monkeypatch.setattr(group_commit, "committer", committer)
+    Session = sessionmaker(bind=engine, autoflush=False)
+
+    def create(minutes):
+        with Session() as db:
+            return crud.create_appointment(db, schemas.AppointmentCreate(
+                patient_id=1, doctor_id=2, appointment_date=datetime(2024, 1, 1, 8, 0) + timedelta(minutes=minutes)))
+
+    try:
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            created = list(pool.map(create, range(30)))
+    finally:
+        committer.stop()
+    assert len({appt.appointment_id for appt in created}) == 30
+    assert count(engine, models.Appointment) == 30
+    engine.dispose()
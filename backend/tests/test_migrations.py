@@ -0,0 +1,88 @@
+import pytest
+from sqlalchemy import text
+
+import models, migrations
+from conftest import make_engine
+
+def table_sql(conn, table: str) -> str:
+    return conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).scalar()
+
+def strip_autoincrement(conn, table: str):
+    # Recreates `table` the way create_all made it before migration 9
+    sql = table_sql(conn, table).replace(" AUTOINCREMENT", "").replace(f'CREATE TABLE "{table}"', f"CREATE TABLE {table}")
+    conn.exec_driver_sql(f"ALTER TABLE {table} RENAME TO {table}_old")
+    conn.exec_driver_sql(sql)
+    conn.exec_driver_sql(f"INSERT INTO {table} SELECT * FROM {table}_old")
+    conn.exec_driver_sql(f"DROP TABLE {table}_old")
+    conn.exec_driver_sql(f"DELETE FROM sqlite_sequence WHERE name = '{table}'")
+
+@pytest.fixture
+def version_8(tmp_path):
+    # A clinic database from before AUTOINCREMENT: EMR 1 archived, EMR 2 (the
+    # newest) deleted, EMR 3 still hot
+    engine = make_engine(tmp_path / "old.db")
+    migrations.upgrade(engine, target=8, log=lambda *_: None)
+    with engine.begin() as conn:
+        for model in models.ARCHIVES_OF:
+            strip_autoincrement(conn, model.__tablename__)
+        conn.execute(text("INSERT INTO emr (emr_id, patient_id, doctor_id, summary) VALUES (1, 1, 2, 'old'), (3, 1, 2, 'kept')"))
+        conn.execute(text("INSERT INTO emr_archive (emr_id, patient_id, doctor_id, summary) VALUES (5, 1, 2, 'archived')"))
+        conn.execute(text("INSERT INTO lab_tests (test_id, patient_id, test_type, status) VALUES (7, 1, 'CBC', 'Pending')"))
+        conn.execute(text("INSERT INTO audit_log (at, action, resource_type, resource_id, outcome) "
+                          "VALUES ('2024-01-01', 'delete', 'lab_test', 9, 200)"))
+        assert "AUTOINCREMENT" not in table_sql(conn, "emr")
+    yield engine
+    engine.dispose()
+
+def test_rebuild_adds_autoincrement_and_keeps_rows_and_indexes(version_8):
+    migrations.upgrade(version_8, log=lambda *_: None)
+    with version_8.connect() as conn:
+        for model in models.ARCHIVES_OF:
+            assert "AUTOINCREMENT" in table_sql(conn, model.__tablename__)
+            indexes = {row[1] for row in conn.exec_driver_sql(f"PRAGMA index_list({model.__tablename__})")}
+            assert {index.name for index in model.__table__.indexes} <= indexes
+        assert conn.execute(text("SELECT emr_id, summary FROM emr ORDER BY emr_id")).all() == [(1, "old"), (3, "kept")]
+        assert conn.execute(text("SELECT test_id FROM lab_tests")).scalars().all() == [7]
+        assert not conn.execute(text("SELECT name FROM sqlite_master WHERE name LIKE '%_rebuild'")).all()
+
+def test_new_ids_start_above_hot_archive_and_audit_ids(version_8):
+    migrations.upgrade(version_8, log=lambda *_: None)
+    with version_8.begin() as conn:
+        conn.execute(text("INSERT INTO emr (patient_id, doctor_id, summary) VALUES (1, 2, 'new')"))
+        conn.execute(text("INSERT INTO lab_tests (patient_id, test_type, status) VALUES (1, 'LFT', 'Pending')"))
+        conn.execute(text("INSERT INTO payments (user_id, amount, payment_method, status) VALUES (1, 5, 'Card', 'Pending')"))
+        assert conn.execute(text("SELECT max(emr_id) FROM emr")).scalar() == 6
+        assert conn.execute(text("SELECT max(test_id) FROM lab_tests")).scalar() == 10
+        assert conn.execute(text("SELECT max(payment_id) FROM payments")).scalar() == 1
+
+def test_deleted_newest_id_is_not_reused_after_migration(version_8):
+    migrations.upgrade(version_8, log=lambda *_: None)
+    with version_8.begin() as conn:
+        conn.execute(text("INSERT INTO emr (patient_id, doctor_id, summary) VALUES (1, 2, 'a')"))
+        newest = conn.execute(text("SELECT max(emr_id) FROM emr")).scalar()
+        conn.execute(text("DELETE FROM emr WHERE emr_id = :id"), {"id": newest})
+        conn.execute(text("INSERT INTO emr (patient_id, doctor_id, summary) VALUES (1, 2, 'b')"))
+        assert conn.execute(text("SELECT max(emr_id) FROM emr")).scalar() == newest + 1
+
+def test_migration_is_idempotent(version_8):
+    migrations.upgrade(version_8, log=lambda *_: None)
+    with version_8.begin() as conn:
+        migrations._archived_ids(conn)
+        assert conn.execute(text("SELECT seq FROM sqlite_sequence WHERE name = 'emr'")).scalar() == 5
+
+def test_failed_rebuild_leaves_the_database_unchanged(version_8, monkeypatch):
+    # The second table's rebuild fails; the first one must be rolled back too
+    rebuild, rebuilt = migrations._rebuild_table, []
+
+    def rebuild_then_fail(conn, table):
+        rebuilt.append(table.name)
+        if len(rebuilt) == 2:
+            raise RuntimeError("disk full")
+        rebuild(conn, table)
+
+    monkeypatch.setattr(migrations, "_rebuild_table", rebuild_then_fail)
+    with pytest.raises(RuntimeError):
+        migrations.upgrade(version_8, log=lambda *_: None)
+    assert migrations.current_version(version_8) == 8
+    with version_8.connect() as conn:
+        assert "AUTOINCREMENT" not in table_sql(conn, rebuilt[0])
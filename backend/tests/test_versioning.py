@@ -0,0 +1,106 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+import models, schemas, crud, versioning
+
+WORDS = "patient reports mild fever cough rest fluids paracetamol 500mg twice daily review in one week".split()
+
+def edit(rng: random.Random, text: str) -> str:
+    # A random token-level edit: replace, insert or delete a few words
+    words = text.split(" ")
+    position = rng.randrange(len(words) + 1)
+    action = rng.choice(("insert", "replace", "delete"))
+    if action == "insert" or len(words) < 3:
+        words[position:position] = rng.sample(WORDS, 2)
+    elif action == "replace":
+        words[position:position + 1] = [rng.choice(WORDS)]
+    else:
+        del words[position:position + 2]
+    return " ".join(words)
+
+@pytest.fixture
+def Session(engine):
+    return sessionmaker(bind=engine, autoflush=False)
+
+@pytest.mark.parametrize("base, target", [
+    ("", "new text"),
+    ("same text", "same text"),
+    ("line one\nline two\n", "line one\nline 2\nline three\n"),
+    ("take 1 tablet", ""),
+])
+def test_delta_round_trip(base, target):
+    assert versioning.apply_delta(base, versioning.make_delta(base, target)) == target
+
+def test_delta_round_trip_random_edits():
+    rng = random.Random(7)
+    text = " ".join(WORDS)
+    for _ in range(200):
+        target = edit(rng, text)
+        assert versioning.apply_delta(text, versioning.make_delta(text, target)) == target
+        text = target
+
+def test_every_version_rebuilds_across_snapshots(Session):
+    # More edits than SNAPSHOT_EVERY, so reads cross full snapshots
+    rng = random.Random(11)
+    texts = [" ".join(WORDS)]
+    for _ in range(versioning.SNAPSHOT_EVERY * 2 + 3):
+        texts.append(edit(rng, texts[-1]))
+    with Session() as db:
+        start = datetime(2024, 1, 1)
+        for version in range(1, len(texts)):
+            versioning.record_previous(db, "emr", 1, version, start + timedelta(hours=version),
+                                       texts[version - 1], texts[version])
+        db.commit()
+        current = len(texts)
+        for version in range(1, current + 1):
+            assert versioning.reconstruct(db, "emr", 1, version, current, texts[-1]) == texts[version - 1]
+        stored = versioning.list_versions(db, "emr", 1, current, None)
+        assert [entry["version"] for entry in stored] == list(range(1, current + 1))
+        assert any(row.is_snapshot for row in db.query(models.RecordVersion).filter_by(version=versioning.SNAPSHOT_EVERY))
+
+def test_missing_version_is_a_lookup_error(Session):
+    with Session() as db:
+        with pytest.raises(LookupError):
+            versioning.get_version(db, "emr", 1, 1, 3, None, "current")
+
+def test_deleted_record_keeps_its_history(Session):
+    with Session() as db:
+        emr = crud.create_emr(db, schemas.EMRCreate(patient_id=1, doctor_id=2, summary="first draft"))
+        emr_id = emr.emr_id
+        for summary in ("second draft", "final summary"):
+            crud.update_emr(db, emr_id, schemas.EMRCreate(patient_id=1, doctor_id=2, summary=summary))
+        crud.delete_emr(db, emr_id)
+    with Session() as db:
+        assert [entry["version"] for entry in crud.get_emr_versions(db, emr_id)] == [1, 2, 3]
+        assert [crud.get_emr_version(db, emr_id, v)["summary"] for v in (1, 2, 3)] == \
+            ["first draft", "second draft", "final summary"]
+        assert versioning.get_deleted(db, "emr", emr_id).patient_id == 1
+
+def test_concurrent_updates_keep_one_entry_per_version(Session):
+    # Racing updates may conflict (409), but every stored version must be
+    # unique and rebuild to text one of the writers actually saved
+    with Session() as db:
+        emr_id = crud.create_emr(db, schemas.EMRCreate(patient_id=1, doctor_id=2, summary="v1")).emr_id
+
+    def update(n):
+        with Session() as db:
+            try:
+                crud.update_emr(db, emr_id, schemas.EMRCreate(patient_id=1, doctor_id=2, summary=f"writer {n}"))
+                return f"writer {n}"
+            except Exception:
+                db.rollback()
+                return None
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        saved = {text for text in pool.map(update, range(24)) if text}
+    with Session() as db:
+        current = crud.get_emr(db, emr_id)
+        assert current.version == len(saved) + 1
+        versions = [entry["version"] for entry in crud.get_emr_versions(db, emr_id)]
+        assert versions == list(range(1, current.version + 1))
+        history = {crud.get_emr_version(db, emr_id, v)["summary"] for v in versions}
+        assert history == saved | {"v1"}
@@ -0,0 +1,150 @@
+import json
+import re
+import zlib
+from difflib import SequenceMatcher
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+import models
+
+# Append-only history for free-text clinical fields. The live record keeps
+# the current text; every edit appends one row holding a zlib-compressed
+# reverse delta that rebuilds the previous version from the next one.
+# Storage therefore grows with the size of the edits, and every
+# SNAPSHOT_EVERY versions a full copy bounds the delta chain a read replays.
+# Deleting a record keeps its history: the last live version is appended as a
+# full snapshot and a DeletedRecord tombstone takes the live row's place.
+
+SNAPSHOT_EVERY = 16
+_TOKEN = re.compile(r"\s+|[^\s]+")
+
+# ------------------ DELTA CODEC ------------------
+def _tokens(text):
+    return _TOKEN.findall(text or "")
+
+def make_delta(base, target) -> list:
+    # Ops that rebuild `target` from `base`: [start, end] copies a token
+    # range of the base, a string inserts literal text.
+    base_tokens, target_tokens = _tokens(base), _tokens(target)
+    ops = []
+    matcher = SequenceMatcher(None, base_tokens, target_tokens, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif tag in ("replace", "insert"):
+            ops.append("".join(target_tokens[j1:j2]))
+    return ops
+
+def apply_delta(base, ops) -> str:
+    base_tokens = _tokens(base)
+    parts = []
+    for op in ops:
+        parts.append(op if isinstance(op, str) else "".join(base_tokens[op[0]:op[1]]))
+    return "".join(parts)
+
+def _pack(value) -> bytes:
+    return zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8"))
+
+def _unpack(payload: bytes):
+    return json.loads(zlib.decompress(payload).decode("utf-8"))
+
+# ------------------ WRITE PATH ------------------
+def record_previous(db: Session, record_type: str, record_id: int, version: int, created_on, previous_text, current_text):
+    # Called by the update paths before committing: stores how to get back
+    # from `current_text` (version + 1) to `previous_text` (version).
+    snapshot = _pack(previous_text)
+    payload, is_snapshot = snapshot, True
+    if previous_text is not None and version % SNAPSHOT_EVERY != 0:
+        delta = _pack(make_delta(current_text, previous_text))
+        if len(delta) < len(snapshot):
+            payload, is_snapshot = delta, False
+    db.add(models.RecordVersion(
+        record_type=record_type,
+        record_id=record_id,
+        version=version,
+        created_on=created_on,
+        is_snapshot=is_snapshot,
+        payload=payload,
+    ))
+
+def record_deletion(db: Session, record_type: str, record_id: int, version: int, created_on, text,
+                    patient_id: int, doctor_id: int):
+    # Called by the delete paths before committing; the snapshot lets every
+    # version be rebuilt without the live text
+    db.add(models.RecordVersion(
+        record_type=record_type,
+        record_id=record_id,
+        version=version,
+        created_on=created_on,
+        is_snapshot=True,
+        payload=_pack(text),
+    ))
+    db.add(models.DeletedRecord(
+        record_type=record_type,
+        record_id=record_id,
+        version=version,
+        patient_id=patient_id,
+        doctor_id=doctor_id,
+    ))
+
+def get_deleted(db: Session, record_type: str, record_id: int):
+    return db.get(models.DeletedRecord, (record_type, record_id))
+
+# ------------------ READ PATH ------------------
+def list_versions(db: Session, record_type: str, record_id: int, current_version: int = None, current_created_on=None) -> list[dict]:
+    # Without a current version (a deleted record) only stored history is listed
+    rows = db.execute(
+        select(models.RecordVersion.version, models.RecordVersion.created_on,
+               func.length(models.RecordVersion.payload))
+        .where(models.RecordVersion.record_type == record_type, models.RecordVersion.record_id == record_id)
+        .order_by(models.RecordVersion.version)
+    ).all()
+    versions = [
+        {"version": version, "created_on": created_on, "is_current": False, "stored_bytes": size}
+        for version, created_on, size in rows
+    ]
+    if current_version is not None:
+        versions.append({"version": current_version, "created_on": current_created_on, "is_current": True, "stored_bytes": 0})
+    return versions
+
+def reconstruct(db: Session, record_type: str, record_id: int, version: int, current_version: int, current_text):
+    # Replays reverse deltas from the nearest snapshot at or above `version`
+    # (or from the live text) down to the requested version.
+    if version == current_version:
+        return current_text
+    history = models.RecordVersion
+    scope = (history.record_type == record_type, history.record_id == record_id)
+    snapshot_version = db.execute(
+        select(func.min(history.version)).where(*scope, history.is_snapshot, history.version >= version)
+    ).scalar()
+    upper = snapshot_version if snapshot_version is not None else current_version - 1
+    rows = db.execute(
+        select(history.version, history.is_snapshot, history.payload)
+        .where(*scope, history.version >= version, history.version <= upper)
+        .order_by(history.version.desc())
+    ).all()
+    if not rows or rows[-1].version != version or len(rows) != upper - version + 1:
+        raise LookupError(f"{record_type} {record_id} has no stored version {version}")
+
+    text = current_text
+    for row in rows:
+        value = _unpack(row.payload)
+        text = value if row.is_snapshot else apply_delta(text, value)
+    return text
+
+def get_version(db: Session, record_type: str, record_id: int, version: int, current_version: int, current_created_on, current_text) -> dict:
+    # A deleted record is passed as current_version = its last version + 1
+    # with no text, so versions up to the last come from the stored history
+    if version == current_version:
+        return {"version": version, "created_on": current_created_on, "text": current_text}
+    if not 1 <= version < current_version:
+        raise LookupError(f"{record_type} {record_id} has no version {version}")
+    created_on = db.execute(
+        select(models.RecordVersion.created_on).where(
+            models.RecordVersion.record_type == record_type,
+            models.RecordVersion.record_id == record_id,
+            models.RecordVersion.version == version,
+        )
+    ).scalar()
+    text = reconstruct(db, record_type, record_id, version, current_version, current_text)
+    return {"version": version, "created_on": created_on, "text": text}
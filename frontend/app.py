@@ -1,12 +1,86 @@
 import streamlit as st
 import requests
 import datetime
+import functools
+import time
+import os
 import re
 import html
+import json
+import threading
+import collections
+from concurrent.futures import Future, ThreadPoolExecutor
 import bleach
 import pandas as pd
 
 BASE_URL = "http://backend:8000"
+ASSET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+# FRONTEND_DEBUG=1 (or ?debug=1) shows render times against the budget
+FRONTEND_DEBUG = os.getenv("FRONTEND_DEBUG", "0") == "1"
+RENDER_BUDGET_MS = int(os.getenv("RENDER_BUDGET_MS", "200"))
+RUN_STARTED = time.perf_counter()
+
+# Entities pushed by /events/stream and the list endpoint each one invalidates
+LIVE_ENDPOINTS = {"appointment": "appointments", "lab_test": "lab-tests"}
+LISTENER_IDLE_TIMEOUT = 60
+PAGE_SIZES = [25, 50, 100]
+TYPEAHEAD_LIMIT = 20
+TYPEAHEAD_TTL = 30
+PERSON_FIELDS = ["user_id", "patient_id", "doctor_id"]
+OPTIONAL_FIELDS = {"specialty"}
+APPOINTMENT_CHOICES = 200
+
+def client_ip():
+    # The browser's address; st.context.ip_address needs Streamlit 1.45+
+    ip = getattr(st.context, "ip_address", None)
+    if not ip:
+        ip = st.context.headers.get("X-Forwarded-For", "").split(",")[0].strip()
+    return ip or None
+
+def clinic_headers(clinic):
+    # Login, signup and reset name their clinic; later calls carry it in the
+    # token. They also forward the browser's IP, so the backend's per-IP rate
+    # limits (with this server in TRUSTED_PROXIES) apply per user, not per frontend.
+    headers = {}
+    clinic = (clinic or "").strip().lower()
+    if clinic:
+        headers["X-Clinic-ID"] = clinic
+    ip = client_ip()
+    if ip:
+        headers["X-Forwarded-For"] = ip
+    return headers
+
+@st.cache_resource
+def asset(name):
+    # Bundled images, read once per server process instead of fetched per rerun
+    with open(os.path.join(ASSET_DIR, name), encoding="utf-8") as handle:
+        return handle.read()
+
+def debug_mode():
+    return FRONTEND_DEBUG or st.query_params.get("debug") == "1"
+
+def render_budget(label, started):
+    if not debug_mode():
+        return
+    elapsed = (time.perf_counter() - started) * 1000
+    message = f"⏱️ {label} rendered in {elapsed:.0f} ms (budget {RENDER_BUDGET_MS} ms)"
+    if elapsed > RENDER_BUDGET_MS:
+        st.warning(message)
+    else:
+        st.caption(message)
+
+def panel(fn):
+    # Panels are fragments: interacting with a widget inside one reruns only
+    # that panel, not the whole dashboard
+    @st.fragment
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            render_budget(fn.__name__, started)
+    return run
 
 def sanitize_input(value):
     if value is None:
@@ -18,11 +92,18 @@ if "token" not in st.session_state:
     st.session_state.token = None
 if "user" not in st.session_state:
     st.session_state.user = None
+if "list_cache" not in st.session_state:
+    st.session_state.list_cache = {}
+if "live_events" not in st.session_state:
+    st.session_state.live_events = []
+if "grid_columns" not in st.session_state:
+    st.session_state.grid_columns = {}
 
 # ---------------- Authentication ----------------
 def login():
     st.subheader("🔐 Login")
     with st.form("login_form"):
+        clinic = st.text_input("🏥 Clinic ID", help="Leave empty for the main clinic")
         email = st.text_input("📧 Email")
         password = st.text_input("🔑 Password", type="password")
         submitted = st.form_submit_button("Login")
@@ -31,19 +112,22 @@ def login():
             if not email or not password:
                 st.warning("⚠️ Email and password are required")
             else:
-                res = requests.post(f"{BASE_URL}/login", data={"username": email, "password": password})
+                res = requests.post(f"{BASE_URL}/login", data={"username": email, "password": password}, headers=clinic_headers(clinic))
                 if res.status_code == 200:
                     data = res.json()
                     st.session_state.token = data["token"]["access_token"]
                     st.session_state.user = data["user"]
                     st.success("✅ Login successful")
                     st.rerun()
+                elif res.status_code == 404:
+                    st.error("❌ Unknown clinic")
                 else:
                     st.error("❌ Invalid credentials")
 
 def signup():
     st.subheader("📝 Signup")
     with st.form("signup_form"):
+        clinic = st.text_input("🏥 Clinic ID", help="Leave empty for the main clinic")
         name = st.text_input("📛 Full Name")
         email = st.text_input("📧 Email")
         password = st.text_input("🔒 Password", type="password")
@@ -68,7 +152,7 @@ def signup():
                     "role": role,
                     "phone_number": phone.strip()
                 }
-                res = requests.post(f"{BASE_URL}/signup", json=payload)
+                res = requests.post(f"{BASE_URL}/signup", json=payload, headers=clinic_headers(clinic))
                 if res.status_code in [200, 201]:
                     st.success("✅ Signup successful. You may login.")
                 else:
@@ -77,6 +161,7 @@ def signup():
 def reset_password():
     st.subheader("🔁 Password Reset")
     with st.form("reset_form"):
+        clinic = st.text_input("🏥 Clinic ID", help="Leave empty for the main clinic")
         email = st.text_input("📧 Registered Email")
         new_pw = st.text_input("🔒 New Password", type="password")
         submitted = st.form_submit_button("Reset Password")
@@ -88,17 +173,82 @@ def reset_password():
                 st.warning("⚠️ Password cannot be empty")
             else:
                 payload = {"email": email.strip(), "new_password": new_pw}
-                res = requests.post(f"{BASE_URL}/reset-password", json=payload)
+                res = requests.post(f"{BASE_URL}/reset-password", json=payload, headers=clinic_headers(clinic))
                 if res.status_code == 200:
                     st.success("✅ Password updated.")
                 else:
                     st.error("❌ Reset failed.")
 
 def logout():
+    listener = st.session_state.get("event_listener")
+    if listener:
+        listener.stop_event.set()
+    st.session_state.event_listener = None
+    st.session_state.list_cache = {}
+    st.session_state.live_events = []
     st.session_state.token = None
     st.session_state.user = None
     st.rerun()
 
+# ---------------- Live Updates ----------------
+class EventListener(threading.Thread):
+    # Reads the backend's server-sent events into a deque. The Streamlit
+    # session drains it; if the session stops draining (tab closed) the
+    # thread exits after LISTENER_IDLE_TIMEOUT.
+    def __init__(self, token):
+        super().__init__(daemon=True)
+        self.token = token
+        self.events = collections.deque(maxlen=200)
+        self.stop_event = threading.Event()
+        self.last_seen = time.monotonic()
+
+    def idle(self):
+        return self.stop_event.is_set() or time.monotonic() - self.last_seen > LISTENER_IDLE_TIMEOUT
+
+    def run(self):
+        backoff = 1
+        while not self.idle():
+            try:
+                headers = {"Authorization": f"Bearer {self.token}"}
+                with requests.get(f"{BASE_URL}/events/stream", headers=headers, stream=True, timeout=(5, 30)) as res:
+                    if res.status_code == 200:
+                        backoff = 1
+                        data = []
+                        for line in res.iter_lines(decode_unicode=True):
+                            if self.idle():
+                                return
+                            if line.startswith("data:"):
+                                data.append(line[5:].strip())
+                            elif not line and data:
+                                self.events.append(json.loads("\n".join(data)))
+                                data = []
+            except (requests.RequestException, ValueError):
+                pass
+            self.stop_event.wait(backoff)
+            backoff = min(backoff * 2, 30)
+
+def ensure_event_listener():
+    listener = st.session_state.get("event_listener")
+    if listener is None or not listener.is_alive() or listener.token != st.session_state.token:
+        if listener:
+            listener.stop_event.set()
+        listener = EventListener(st.session_state.token)
+        listener.start()
+        st.session_state.event_listener = listener
+    return listener
+
+def drain_events():
+    listener = ensure_event_listener()
+    listener.last_seen = time.monotonic()
+    new_events = []
+    while listener.events:
+        event = listener.events.popleft()
+        st.session_state.list_cache.pop(LIVE_ENDPOINTS.get(event["entity"]), None)
+        new_events.append(event)
+    if new_events:
+        st.session_state.live_events = (new_events[::-1] + st.session_state.live_events)[:20]
+    return new_events
+
 # ---------------- Auth Flow ----------------
 if not st.session_state.token:
     auth_tab = st.sidebar.radio("🔐 Select Option", ["Login", "Signup", "Reset Password"])
@@ -137,14 +287,40 @@ else:
 # Sidebar selections
 st.sidebar.markdown("## 📁 Navigation")
 menu = st.sidebar.selectbox("📋 Select Module", allowed_modules)
-action = st.sidebar.radio("⚙️ Select Action", allowed_actions)
-
-st.image("https://encrypted-tbn0.gstatic.com/images?q=tbn:ANd9GcRJYk1MTig96Bql3gEO4_GlDMsnZgHidWY0Pw&s", use_container_width=True)
+module_actions = list(allowed_actions)
+if menu == "Appointments" and role in ["Admin", "Doctor"]:
+    module_actions.append("Calendar")
+# Module-specific actions change the radio's options, so carry the choice over explicitly
+previous_action = st.session_state.get("last_action")
+action_index = module_actions.index(previous_action) if previous_action in module_actions else 0
+action = st.sidebar.radio("⚙️ Select Action", module_actions, index=action_index)
+st.session_state.last_action = action
+
+st.image(asset("banner.svg"), use_container_width=True)
+
+MODULE_ENDPOINTS = {
+    "Users": "users", "Appointments": "appointments", "Prescriptions": "prescriptions", "Inventory": "inventory",
+    "Payments": "payments", "Lab Tests": "lab-tests", "EMR": "emr"
+}
+drain_events()
+
+@st.fragment(run_every="3s")
+def live_updates():
+    new_events = drain_events()
+    for event in new_events[-5:]:
+        st.toast(f"🔔 {event['entity'].replace('_', ' ').title()} #{event['record_id']} {event['action']}: {event.get('status', '')}")
+    st.caption(f"🟢 Live updates · {len(st.session_state.live_events)} recent")
+    changed = {LIVE_ENDPOINTS.get(e["entity"]) for e in new_events}
+    if action == "View All" and MODULE_ENDPOINTS.get(menu) in changed:
+        st.rerun()
+
+with st.sidebar:
+    live_updates()
 
 def emoji_field(field):
     emojis = {
         "full_name": "📛 Full Name", "email": "📧 Email", "password_hash": "🔒 Password",
-        "role": "🧑‍⚕️ Role", "phone_number": "📞 Phone Number", "patient_id": "🧑 Patient ID",
+        "role": "🧑‍⚕️ Role", "phone_number": "📞 Phone Number", "specialty": "🩺 Specialty (doctors)", "patient_id": "🧑 Patient ID",
         "doctor_id": "👨‍⚕️ Doctor ID", "appointment_date": "📅 Appointment Date", "status": "📌 Status",
         "notes": "📝 Notes", "appointment_id": "📄 Appointment ID", "name": "💊 Medicine Name",
         "description": "🧾 Description", "price": "💵 Price", "quantity": "📦 Quantity", "user_id": "👤 User ID",
@@ -154,16 +330,7 @@ def emoji_field(field):
     return emojis.get(field, field.replace("_", " ").title())
 
 def section_image(module):
-    icons = {
-        "Users": "https://cdn-icons-png.flaticon.com/512/847/847969.png",
-        "Appointments": "https://cdn-icons-png.flaticon.com/512/2989/2989988.png",
-        "Prescriptions": "https://cdn-icons-png.flaticon.com/512/899/899755.png",
-        "Inventory": "https://cdn-icons-png.flaticon.com/512/3621/3621605.png",
-        "Payments": "https://cdn-icons-png.flaticon.com/512/1574/1574345.png",
-        "Lab Tests": "https://cdn-icons-png.flaticon.com/512/2674/2674510.png",
-        "EMR": "https://cdn-icons-png.flaticon.com/512/2037/2037991.png"
-    }
-    st.image(icons.get(module), width=80)
+    st.image(asset(f"{MODULE_ENDPOINTS[module]}.svg"), width=80)
 
 # ---------------- API Request Wrapper ----------------
 def make_request(method, endpoint, **kwargs):
@@ -175,8 +342,80 @@ def make_request(method, endpoint, **kwargs):
         st.error(f"❌ {e}")
         return None
 
+# ---------------- Typeahead Pickers ----------------
+@st.cache_data(ttl=TYPEAHEAD_TTL, show_spinner=False)
+def search_people(token, field, query):
+    # Doctors come from the indexed /doctors/ directory; other people are
+    # matched by name on /users/. Only one small page is ever fetched.
+    headers = {"Authorization": f"Bearer {token}"}
+    if field == "doctor_id":
+        params = {"q": query or None, "limit": TYPEAHEAD_LIMIT}
+        res = requests.get(f"{BASE_URL}/doctors/", headers=headers, params=params, timeout=10)
+    else:
+        filters = [f"full_name:{query}"] if query else []
+        if field == "patient_id":
+            filters.append("role:Patient")
+        params = {"fields": "user_id,full_name,role", "sort": "full_name", "limit": TYPEAHEAD_LIMIT, "filter": filters}
+        res = requests.get(f"{BASE_URL}/users/", headers=headers, params=params, timeout=10)
+    if res.status_code != 200:
+        return {"error": f"{res.status_code} - {res.text}"}
+    return {"people": res.json(), "total": int(res.headers.get("X-Total-Count", 0))}
+
+@st.cache_data(ttl=TYPEAHEAD_TTL, show_spinner=False)
+def appointment_choices(token):
+    # Newest appointments first; only their IDs are fetched
+    headers = {"Authorization": f"Bearer {token}"}
+    params = {"fields": "appointment_id", "sort": "-appointment_id", "limit": APPOINTMENT_CHOICES}
+    res = requests.get(f"{BASE_URL}/appointments/", headers=headers, params=params, timeout=10)
+    if res.status_code != 200:
+        return {"error": res.status_code}
+    return {"ids": [a["appointment_id"] for a in res.json()]}
+
+def pick_person(label, field, endpoint):
+    query = st.text_input(f"🔎 Search {label}", key=f"typeahead_{endpoint}_{field}",
+                          placeholder="Type part of a name").strip()
+    result = search_people(st.session_state.token, field, query)
+    if "error" in result:
+        st.error(f"❌ Unable to fetch users: {result['error']}")
+        return None
+    people = result["people"]
+    if not people:
+        st.warning(f"⚠️ No {field.replace('_id', 's')} found")
+        return None
+    options = {
+        f"{p['full_name']} (#{p['user_id']})" + (f" · {p['specialty']}" if p.get("specialty") else ""): p["user_id"]
+        for p in people
+    }
+    choice = st.selectbox(label, list(options), key=f"typeahead_pick_{endpoint}_{field}")
+    if result["total"] > len(people):
+        st.caption(f"Showing {len(people)} of {result['total']} matches, type more to narrow down")
+    return options[choice]
+
+def pick_people(fields, endpoint):
+    # Widgets inside st.form only rerun on submit, so the pickers live outside it
+    people = {}
+    for f in fields:
+        if f in PERSON_FIELDS:
+            try:
+                people[f] = pick_person(emoji_field(f), f, endpoint)
+            except Exception as e:
+                st.error(f"❌ Failed to load user list: {e}")
+                people[f] = None
+    return people
+
+def request_body(inputs):
+    # None when a required field is empty; optional ones are left out instead
+    body = {}
+    for key, value in inputs.items():
+        if value is None or str(value).strip() == "":
+            if key in OPTIONAL_FIELDS:
+                continue
+            return None
+        body[key] = value
+    return body
+
 # ---------------- Dynamic Input Fields ----------------
-def build_inputs(fields, endpoint):
+def build_inputs(fields, endpoint, people=None):
     inputs = {}
     valid = True
 
@@ -233,46 +472,22 @@ def build_inputs(fields, endpoint):
             elif f == "quantity":
                 value = st.number_input(label, min_value=0, step=1)
 
-            elif f in ["user_id", "patient_id", "doctor_id"]:
-                try:
-                    headers = {"Authorization": f"Bearer {st.session_state.token}"}
-                    res = requests.get(f"{BASE_URL}/users/", headers=headers)
-                    if res.status_code == 200:
-                        users = res.json()
-
-                        # Role filtering
-                        if f == "patient_id":
-                            users = [u for u in users if u["role"] == "Patient"]
-                        elif f == "doctor_id":
-                            users = [u for u in users if u["role"] == "Doctor"]
-
-                        ids = [u["user_id"] for u in users]
-                        if ids:
-                            value = st.selectbox(label, ids)
-                        else:
-                            st.warning(f"⚠️ No {f.replace('_id','s')} found")
-                            valid = False
-                    else:
-                        st.error(f"❌ Unable to fetch users: {res.status_code}")
-                        valid = False
-                except Exception as e:
-                    st.error(f"❌ Failed to load user list: {e}")
+            elif f in PERSON_FIELDS:
+                # Picked above the form by pick_people(), which reruns as you type
+                value = (people or {}).get(f)
+                if value is None:
                     valid = False
 
             elif f == "appointment_id":
                 try:
-                    headers = {"Authorization": f"Bearer {st.session_state.token}"}
-                    res = requests.get(f"{BASE_URL}/appointments/", headers=headers)
-                    if res.status_code == 200:
-                        appts = res.json()
-                        ids = [a["appointment_id"] for a in appts]
-                        if ids:
-                            value = st.selectbox(label, ids)
-                        else:
-                            st.warning("⚠️ No appointments found")
-                            valid = False
+                    choices = appointment_choices(st.session_state.token)
+                    if "error" in choices:
+                        st.error(f"❌ Unable to fetch appointments: {choices['error']}")
+                        valid = False
+                    elif choices["ids"]:
+                        value = st.selectbox(label, choices["ids"])
                     else:
-                        st.error(f"❌ Unable to fetch appointments: {res.status_code}")
+                        st.warning("⚠️ No appointments found")
                         valid = False
                 except Exception as e:
                     st.error(f"❌ Failed to load appointments: {e}")
@@ -290,6 +505,216 @@ def build_inputs(fields, endpoint):
     return inputs, valid
 
 
+# ---------------- Doctor Calendar ----------------
+@panel
+def show_calendar(headers):
+    st.subheader("🗓️ Doctor Calendar")
+    if role == "Doctor":
+        doctor_id = st.session_state.user["user_id"]
+    else:
+        doctor_id = st.number_input("👨‍⚕️ Doctor ID", min_value=1, step=1)
+    week_of = st.date_input("📅 Week of", value=datetime.date.today())
+    granularity = st.radio("⏱️ Granularity", ["day", "hour"], horizontal=True)
+
+    monday = week_of - datetime.timedelta(days=week_of.weekday())
+    start = datetime.datetime.combine(monday, datetime.time.min)
+    params = {
+        "from": start.isoformat(),
+        "to": (start + datetime.timedelta(days=7)).isoformat(),
+        "granularity": granularity,
+    }
+    res = requests.get(f"{BASE_URL}/doctors/{doctor_id}/calendar", params=params, headers=headers)
+    if res.status_code != 200:
+        st.error(f"❌ Unable to load calendar: {res.status_code} - {res.text}")
+        return
+
+    buckets = res.json()["buckets"]
+    if granularity == "day":
+        by_day = {b["start"][:10]: b for b in buckets}
+        for i, col in enumerate(st.columns(7)):
+            day = monday + datetime.timedelta(days=i)
+            bucket = by_day.get(day.isoformat())
+            with col:
+                st.markdown(f"**{day.strftime('%a %d %b')}**")
+                if not bucket:
+                    st.caption("—")
+                    continue
+                for appt in bucket["appointments"]:
+                    st.markdown(f"🕘 {appt['appointment_date'][11:16]} · #{appt['appointment_id']} · {appt['status']}")
+    elif buckets:
+        rows = [{"Day": b["start"][:10], "Hour": b["start"][11:16], "Appointments": b["count"]} for b in buckets]
+        df = pd.DataFrame(rows).pivot(index="Hour", columns="Day", values="Appointments").fillna(0).astype(int)
+        st.dataframe(df)
+    else:
+        st.info("ℹ️ No appointments this week.")
+
+# ---------------- Paginated Grid ----------------
+@st.cache_resource
+def prefetch_pool():
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="grid-prefetch")
+
+def fetch_page(endpoint, token, params):
+    # Runs on the prefetch pool too, so it must not touch st.*
+    headers = {"Authorization": f"Bearer {token}"}
+    res = requests.get(f"{BASE_URL}/{endpoint}/", headers=headers, params=params, timeout=30)
+    if res.status_code != 200:
+        return {"error": f"{res.status_code} - {res.text}"}
+    return {"rows": res.json(), "total": int(res.headers.get("X-Total-Count", 0))}
+
+def grid_buffer(endpoint, query):
+    # One buffer per module holding the visible page and its neighbours for
+    # the current sort/filter; changing the query starts a fresh buffer.
+    buffer = st.session_state.list_cache.get(endpoint)
+    if buffer is None or buffer["query"] != query:
+        if buffer is not None:
+            st.session_state[f"grid_page_{endpoint}"] = 0
+        buffer = {"query": query, "pages": {}, "total": 0}
+        st.session_state.list_cache[endpoint] = buffer
+    return buffer
+
+def page_request(buffer, page_no):
+    sort, filter_expr, page_size = buffer["query"]
+    params = {"skip": page_no * page_size, "limit": page_size}
+    if sort:
+        params["sort"] = sort
+    if filter_expr:
+        params["filter"] = filter_expr
+    return params
+
+def load_page(endpoint, buffer, page_no):
+    entry = buffer["pages"].get(page_no)
+    if isinstance(entry, Future):
+        entry = entry.result()
+    if entry is None or "error" in entry:
+        entry = fetch_page(endpoint, st.session_state.token, page_request(buffer, page_no))
+    buffer["pages"][page_no] = entry
+    return entry
+
+def prefetch_page(endpoint, buffer, page_no):
+    if page_no not in buffer["pages"]:
+        buffer["pages"][page_no] = prefetch_pool().submit(
+            fetch_page, endpoint, st.session_state.token, page_request(buffer, page_no)
+        )
+
+@panel
+def show_grid(endpoint):
+    columns = st.session_state.grid_columns.get(endpoint, [])
+    c1, c2, c3, c4, c5 = st.columns([2, 1, 2, 2, 1])
+    sort_field = c1.selectbox("↕️ Sort by", ["(default)"] + columns, key=f"grid_sort_{endpoint}")
+    descending = c2.toggle("⬇️ Desc", key=f"grid_desc_{endpoint}")
+    filter_field = c3.selectbox("🔎 Filter field", ["(none)"] + columns, key=f"grid_filter_field_{endpoint}")
+    filter_value = c4.text_input("Filter value", key=f"grid_filter_value_{endpoint}").strip()
+    page_size = c5.selectbox("Rows", PAGE_SIZES, key=f"grid_size_{endpoint}")
+
+    sort = None if sort_field == "(default)" else ("-" if descending else "") + sort_field
+    filter_expr = f"{filter_field}:{filter_value}" if filter_field != "(none)" and filter_value else None
+    buffer = grid_buffer(endpoint, (sort, filter_expr, page_size))
+
+    page_key = f"grid_page_{endpoint}"
+    page_no = st.session_state.get(page_key, 0)
+    entry = load_page(endpoint, buffer, page_no)
+    if "error" in entry:
+        st.error(f"❌ Error: {entry['error']}")
+        return
+    buffer["total"] = entry["total"]
+    if entry["rows"] and not columns:
+        st.session_state.grid_columns[endpoint] = list(entry["rows"][0].keys())
+
+    page_count = max(1, -(-buffer["total"] // page_size))
+    if entry["rows"]:
+        st.dataframe(pd.DataFrame(entry["rows"]), use_container_width=True)
+    else:
+        st.info("ℹ️ No records found.")
+
+    nav_prev, nav_info, nav_next, nav_refresh = st.columns([1, 2, 1, 1])
+    if nav_prev.button("◀ Prev", disabled=page_no == 0, key=f"grid_prev_{endpoint}"):
+        st.session_state[page_key] = page_no - 1
+        st.rerun(scope="fragment")
+    nav_info.markdown(f"Page **{page_no + 1}** of **{page_count}** · {buffer['total']} records")
+    if nav_next.button("Next ▶", disabled=page_no + 1 >= page_count, key=f"grid_next_{endpoint}"):
+        st.session_state[page_key] = page_no + 1
+        st.rerun(scope="fragment")
+    if nav_refresh.button("🔄 Refresh", key=f"grid_refresh_{endpoint}"):
+        st.session_state.list_cache.pop(endpoint, None)
+        st.rerun(scope="fragment")
+
+    # Keep only the visible page and its neighbours; warm the next one
+    for stale in [n for n in buffer["pages"] if abs(n - page_no) > 1]:
+        del buffer["pages"][stale]
+    if page_no + 1 < page_count:
+        prefetch_page(endpoint, buffer, page_no + 1)
+
+@panel
+def create_panel(module, fields, endpoint, headers):
+    st.subheader(f"➕ Create New {module}")
+    people = pick_people(fields, endpoint)
+    with st.form(f"create_{module}"):
+        inputs, valid = build_inputs(fields, endpoint, people)
+        submitted = st.form_submit_button(f"Create {module}")
+        if submitted:
+            body = request_body(inputs)
+            if not valid or body is None:
+                st.error("❌ All fields are required and must be valid.")
+            else:
+                res = requests.post(f"{BASE_URL}/{endpoint}/", json=body, headers=headers)
+                if res.status_code in [200, 201]:
+                    st.session_state.list_cache.pop(endpoint, None)
+                    if endpoint == "appointments":
+                        appointment_choices.clear()
+                    st.success("✅ Created successfully!")
+                    st.json(res.json())
+                else:
+                    st.error(f"❌ Creation failed: {res.status_code} - {res.text}")
+
+@panel
+def view_panel(module, endpoint, headers):
+    st.subheader(f"🔍 View {module} by ID")
+    obj_id = st.number_input(f"Enter {module} ID", min_value=1, step=1)
+    if st.button("Fetch"):
+        res = requests.get(f"{BASE_URL}/{endpoint}/{obj_id}", headers=headers)
+        if res.status_code == 200:
+            data = res.json()
+            df = pd.DataFrame([data])
+            st.dataframe(df)
+        else:
+            st.error(f"❌ Record not found. {res.status_code} - {res.text}")
+
+@panel
+def update_panel(module, fields, endpoint, headers):
+    st.subheader(f"✏️ Update {module}")
+    obj_id = st.number_input(f"Enter {module} ID to Update", min_value=1, step=1)
+    people = pick_people(fields, endpoint)
+    with st.form(f"update_{module}"):
+        inputs, valid = build_inputs(fields, endpoint, people)
+        submitted = st.form_submit_button("Update")
+        if submitted:
+            body = request_body(inputs)
+            if not valid or body is None:
+                st.error("❌ All fields are required and must be valid.")
+            else:
+                res = requests.put(f"{BASE_URL}/{endpoint}/{obj_id}", json=body, headers=headers)
+                if res.status_code == 200:
+                    st.session_state.list_cache.pop(endpoint, None)
+                    st.success("✅ Updated successfully!")
+                    st.json(res.json())
+                else:
+                    st.error(f"❌ Update failed: {res.status_code} - {res.text}")
+
+@panel
+def delete_panel(module, endpoint, headers):
+    st.subheader(f"🗑️ Delete {module}")
+    obj_id = st.number_input(f"Enter {module} ID to Delete", min_value=1, step=1)
+    if st.button("Delete"):
+        res = requests.delete(f"{BASE_URL}/{endpoint}/{obj_id}", headers=headers)
+        if res.status_code == 200:
+            st.session_state.list_cache.pop(endpoint, None)
+            if endpoint == "appointments":
+                appointment_choices.clear()
+            st.success("✅ Deleted successfully!")
+            st.json(res.json())
+        else:
+            st.error(f"❌ Deletion failed: {res.status_code} - {res.text}")
+
 def handle_crud(module, fields, endpoint, action):
     st.markdown(f"### 🚀 {module} Management Panel")
     section_image(module)
@@ -299,77 +724,27 @@ def handle_crud(module, fields, endpoint, action):
     headers = {"Authorization": f"Bearer {st.session_state.token}"}
 
     if action == "Create":
-        st.subheader(f"➕ Create New {module}")
-        with st.form(f"create_{module}"):
-            inputs, valid = build_inputs(fields, endpoint)
-            submitted = st.form_submit_button(f"Create {module}")
-            if submitted:
-                if not valid or None in inputs.values() or any(str(v).strip() == "" for v in inputs.values()):
-                    st.error("❌ All fields are required and must be valid.")
-                else:
-                    res = requests.post(f"{BASE_URL}/{endpoint}/", json=inputs, headers=headers)
-                    if res.status_code in [200, 201]:
-                        st.success("✅ Created successfully!")
-                        st.json(res.json())
-                    else:
-                        st.error(f"❌ Creation failed: {res.status_code} - {res.text}")
+        create_panel(module, fields, endpoint, headers)
 
     elif action == "View All":
         st.subheader(f"📃 All {module}")
-        res = requests.get(f"{BASE_URL}/{endpoint}/", headers=headers)
-        if res.status_code == 200:
-            data = res.json()
-            if data:
-                df = pd.DataFrame(data)
-                st.dataframe(df)
-            else:
-                st.info("ℹ️ No records found.")
-        else:
-            st.error(f"❌ Error: {res.status_code} - {res.text}")
+        show_grid(endpoint)
 
     elif action == "View by ID":
-        st.subheader(f"🔍 View {module} by ID")
-        obj_id = st.number_input(f"Enter {module} ID", min_value=1, step=1)
-        if st.button("Fetch"):
-            res = requests.get(f"{BASE_URL}/{endpoint}/{obj_id}", headers=headers)
-            if res.status_code == 200:
-                data = res.json()
-                df = pd.DataFrame([data])
-                st.dataframe(df)
-            else:
-                st.error(f"❌ Record not found. {res.status_code} - {res.text}")
+        view_panel(module, endpoint, headers)
 
     elif action == "Update":
-        st.subheader(f"✏️ Update {module}")
-        obj_id = st.number_input(f"Enter {module} ID to Update", min_value=1, step=1)
-        with st.form(f"update_{module}"):
-            inputs, valid = build_inputs(fields, endpoint)
-            submitted = st.form_submit_button("Update")
-            if submitted:
-                if not valid or None in inputs.values() or any(str(v).strip() == "" for v in inputs.values()):
-                    st.error("❌ All fields are required and must be valid.")
-                else:
-                    res = requests.put(f"{BASE_URL}/{endpoint}/{obj_id}", json=inputs, headers=headers)
-                    if res.status_code == 200:
-                        st.success("✅ Updated successfully!")
-                        st.json(res.json())
-                    else:
-                        st.error(f"❌ Update failed: {res.status_code} - {res.text}")
+        update_panel(module, fields, endpoint, headers)
+
+    elif action == "Calendar":
+        show_calendar(headers)
 
     elif action == "Delete":
-        st.subheader(f"🗑️ Delete {module}")
-        obj_id = st.number_input(f"Enter {module} ID to Delete", min_value=1, step=1)
-        if st.button("Delete"):
-            res = requests.delete(f"{BASE_URL}/{endpoint}/{obj_id}", headers=headers)
-            if res.status_code == 200:
-                st.success("✅ Deleted successfully!")
-                st.json(res.json())
-            else:
-                st.error(f"❌ Deletion failed: {res.status_code} - {res.text}")
+        delete_panel(module, endpoint, headers)
 
 # Route modules
 if menu == "Users":
-    handle_crud("Users", ["full_name", "email", "password", "role", "phone_number"], "users", action)
+    handle_crud("Users", ["full_name", "email", "password", "role", "phone_number", "specialty"], "users", action)
 elif menu == "Appointments":
     handle_crud("Appointments", ["patient_id", "doctor_id", "appointment_date", "status"], "appointments", action)
 elif menu == "Prescriptions":
@@ -382,3 +757,6 @@ elif menu == "Lab Tests":
     handle_crud("Lab Tests", ["patient_id", "test_type", "result", "status"], "lab-tests", action)
 elif menu == "EMR":
     handle_crud("EMR", ["patient_id", "doctor_id", "summary"], "emr", action)
+
+with st.sidebar:
+    render_budget("Dashboard", RUN_STARTED)